@@ -0,0 +1,88 @@
+# coding: utf-8
+
+import hashlib
+import os
+import threading
+from os.path import dirname, join
+
+import numpy as np
+import pandas as pd
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+
+project_path = dirname(__file__)
+data_path = join(project_path, "stanford-ner-tagger", "data")
+allergen_data_path = join(data_path, "AllergenData.csv")
+
+
+class AllergenSnapshot:
+    """Everything derived from one version of AllergenData.csv"""
+
+    def __init__(self, csv_path):
+        self.mtime = os.stat(csv_path).st_mtime_ns
+        with open(csv_path, "rb") as file:
+            self.digest = hashlib.sha1(file.read()).hexdigest()
+        df_allergies = pd.read_csv(csv_path, encoding="utf8")
+
+        self.allergens = df_allergies["allergen"].tolist()
+        self.allergy_list = df_allergies["allergy"].drop_duplicates().tolist()
+
+        # TfidfVectorizer rows are already L2-normalized, so a dot product
+        # with a normalized query is the cosine similarity
+        self.vectorizer = TfidfVectorizer()
+        self.matrix_t = self.vectorizer.fit_transform(self.allergens).T.tocsr()
+
+        # Rows of the CSV in file order, equivalent to the old inner merge
+        self.rows = list(zip(df_allergies["allergen"], df_allergies["allergy"]))
+
+
+class AllergenIndex:
+    """Fitted TF-IDF allergen matcher that reloads when the CSV changes"""
+
+    def __init__(self, csv_path=allergen_data_path):
+        self.csv_path = csv_path
+        self.lock = threading.Lock()
+        self.snapshot = AllergenSnapshot(csv_path)
+
+    def current(self):
+        # Build the new snapshot aside and swap the reference, so requests
+        # already running keep the version they started with
+        try:
+            mtime = os.stat(self.csv_path).st_mtime_ns
+        except OSError:
+            return self.snapshot
+        if mtime != self.snapshot.mtime:
+            with self.lock:
+                if mtime != self.snapshot.mtime:
+                    self.snapshot = AllergenSnapshot(self.csv_path)
+        return self.snapshot
+
+    def match(self, ingredients: list, snapshot=None):
+        """Best matching allergen for each ingredient, or None"""
+        snapshot = snapshot or self.current()
+        if not ingredients:
+            return []
+        query = snapshot.vectorizer.transform(ingredients)
+        scores = (query @ snapshot.matrix_t).toarray()
+
+        # Exact ties go to the first allergen in the CSV, argsort left them
+        # in an arbitrary order
+        top = np.argmax(scores, axis=1)
+        best = scores[np.arange(len(ingredients)), top]
+        return [
+            snapshot.allergens[index] if score > 0 else None
+            for index, score in zip(top, best)
+        ]
+
+    def allergies(self, allergens, snapshot=None):
+        """Unique allergies for the matched allergens, in CSV order"""
+        snapshot = snapshot or self.current()
+        matched = set(allergen for allergen in allergens if allergen is not None)
+        allergies = []
+        for allergen, allergy in snapshot.rows:
+            if allergen in matched and allergy not in allergies:
+                allergies.append(allergy)
+        return allergies
+
+    def allergy_list(self):
+        return self.current().allergy_list
@@ -0,0 +1,77 @@
+# coding: utf-8
+
+import argparse
+import json
+import time
+from os.path import exists, join
+
+import nltk
+import numpy as np
+from nltk.tag.stanford import StanfordNERTagger
+
+from crf_tagger import CRFTagger
+from ner_service import GetTagger, native_model
+from test_model import data_path, jar, model
+
+
+# Old path: new tagger per recipe and one JVM per ingredient
+def TagRecipePerIngredient(recipe: dict):
+    ner_tagger = StanfordNERTagger(model, jar, encoding="utf8")
+    return [
+        ner_tagger.tag(nltk.word_tokenize(ingredient))
+        for ingredient in recipe["ingredients"]
+    ]
+
+
+# New path: whole recipe in one batch against the warm tagging service
+def TagRecipeBatched(recipe: dict):
+    return GetTagger().tag_sents(
+        [nltk.word_tokenize(ingredient) for ingredient in recipe["ingredients"]]
+    )
+
+
+# Native path: NumPy CRF decoder in process, no JVM at all
+native_tagger = CRFTagger.load(native_model) if exists(native_model) else None
+
+
+def TagRecipeNative(recipe: dict):
+    return native_tagger.tag_sents(
+        [nltk.word_tokenize(ingredient) for ingredient in recipe["ingredients"]]
+    )
+
+
+def TimeRecipes(func, recipes: list):
+    timings = []
+    for recipe in recipes:
+        starttime = time.perf_counter()
+        func(recipe)
+        timings.append(time.perf_counter() - starttime)
+    return np.array(timings)
+
+
+def Report(name: str, timings):
+    print(
+        f"{name:<16} mean {timings.mean() * 1000:9.1f} ms"
+        f"  p50 {np.percentile(timings, 50) * 1000:9.1f} ms"
+        f"  p99 {np.percentile(timings, 99) * 1000:9.1f} ms"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-recipe NER tagging latency")
+    parser.add_argument("--recipes", type=int, default=20)
+    args = parser.parse_args()
+
+    with open(join(data_path, "parsed_data.json"), "r", encoding="utf8") as file:
+        recipes = json.load(file)[: args.recipes]
+
+    # Warm the service up so the first measured recipe doesn't pay the JVM start
+    GetTagger().tag_sents([["warmup"]])
+
+    print(f"Tagging {len(recipes)} recipes")
+    Report("per-ingredient", TimeRecipes(TagRecipePerIngredient, recipes))
+    Report("batched", TimeRecipes(TagRecipeBatched, recipes))
+    if native_tagger is not None:
+        Report("native", TimeRecipes(TagRecipeNative, recipes))
+    else:
+        print("No native model, run `python crf_tagger.py train` first")
@@ -0,0 +1,388 @@
+# coding: utf-8
+
+import argparse
+import os
+import shutil
+import time
+from os.path import dirname, join
+
+import numpy as np
+from scipy import sparse
+from scipy.optimize import minimize
+from scipy.special import logsumexp
+
+project_path = dirname(__file__)
+ner_path = join(project_path, "stanford-ner-tagger")
+data_path = join(ner_path, "data")
+native_model = join(ner_path, "classifiers", "ingredient-ner-model.npz")
+
+
+# Read a CoNLL style tsv into sentences of (word, label), blank line separated
+def ReadTsv(path):
+    sentences = [[]]
+    with open(path, "r", encoding="utf8") as file:
+        for line in file:
+            parts = line.rstrip("\n").split("\t")
+            if len(parts) < 2 or not parts[0].strip():
+                if sentences[-1]:
+                    sentences.append([])
+                continue
+            sentences[-1].append((parts[0].strip(), parts[1].strip()))
+    return [sentence for sentence in sentences if sentence]
+
+
+# Close to the chris2useLC word shape: character classes of the first and
+# last two characters and the set of classes in between
+def WordShape(word):
+    def CharClass(char):
+        if char.isdigit():
+            return "d"
+        if char.isupper():
+            return "X"
+        if char.isalpha():
+            return "x"
+        return char
+
+    classes = [CharClass(char) for char in word]
+    if len(classes) <= 4:
+        return "".join(classes)
+    middle = "".join(sorted(set(classes[2:-2])))
+    return "".join(classes[:2]) + middle + "".join(classes[-2:])
+
+
+# Feature strings for every token, the nearest Python equivalent of the
+# features enabled in prop.txt (word, edge n-grams, prev/next word, shapes,
+# shape sequences and disjunctive words)
+def SentenceFeatures(words, max_ngram=6, disjunction_width=4):
+    shapes = [WordShape(word) for word in words]
+    features = []
+    for i, word in enumerate(words):
+        prev_word = words[i - 1] if i > 0 else "<S>"
+        next_word = words[i + 1] if i + 1 < len(words) else "</S>"
+        prev_shape = shapes[i - 1] if i > 0 else "<S>"
+        next_shape = shapes[i + 1] if i + 1 < len(words) else "</S>"
+
+        token = [
+            "BIAS",
+            "W=" + word,
+            "LW=" + word.lower(),
+            "PW=" + prev_word,
+            "NW=" + next_word,
+            "SH=" + shapes[i],
+            "PSH|SH=" + prev_shape + "|" + shapes[i],
+            "SH|NSH=" + shapes[i] + "|" + next_shape,
+            "PSH|SH|NSH=" + prev_shape + "|" + shapes[i] + "|" + next_shape,
+        ]
+        for n in range(1, min(max_ngram, len(word) - 1) + 1):
+            token.append("P=" + word[:n])
+            token.append("S=" + word[-n:])
+        for other in words[max(0, i - disjunction_width) : i]:
+            token.append("DL=" + other)
+        for other in words[i + 1 : i + 1 + disjunction_width]:
+            token.append("DR=" + other)
+        features.append(token)
+    return features
+
+
+# (sentence, position) of every token when sentences are flattened in order
+def TokenPositions(lengths):
+    sentence_ids = np.repeat(np.arange(len(lengths)), lengths)
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    return sentence_ids, np.arange(lengths.sum()) - starts[sentence_ids]
+
+
+class CRFTagger:
+    """Linear-chain CRF with a vectorized Viterbi decoder"""
+
+    def __init__(self, feature_index, labels, weights, transitions, start):
+        self.feature_index = feature_index
+        self.labels = labels
+        self.weights = weights
+        self.transitions = transitions
+        self.start = start
+
+    @classmethod
+    def load(cls, path=native_model):
+        model = np.load(path, allow_pickle=False)
+        feature_index = {
+            feature: index for index, feature in enumerate(model["features"].tolist())
+        }
+        return cls(
+            feature_index,
+            model["labels"].tolist(),
+            model["weights"],
+            model["transitions"],
+            model["start"],
+        )
+
+    def save(self, path=native_model):
+        features = [None] * len(self.feature_index)
+        for feature, index in self.feature_index.items():
+            features[index] = feature
+        np.savez_compressed(
+            path,
+            features=np.array(features),
+            labels=np.array(self.labels),
+            weights=self.weights.astype(np.float32),
+            transitions=self.transitions.astype(np.float32),
+            start=self.start.astype(np.float32),
+        )
+
+    def feature_matrix(self, sentences):
+        # One sparse row per token, features never seen in training are dropped
+        indptr = [0]
+        indices = []
+        for words in sentences:
+            for token in SentenceFeatures(words):
+                indices.extend(
+                    self.feature_index[feature]
+                    for feature in token
+                    if feature in self.feature_index
+                )
+                indptr.append(len(indices))
+        return sparse.csr_matrix(
+            (np.ones(len(indices), dtype=np.float32), indices, indptr),
+            shape=(len(indptr) - 1, len(self.feature_index)),
+        )
+
+    def decode(self, emissions, lengths):
+        """Viterbi over a padded (sentences, tokens, labels) batch"""
+        batch, max_len, _ = emissions.shape
+        score = self.start[None, :] + emissions[:, 0]
+        backpointers = np.zeros((batch, max_len, len(self.labels)), dtype=np.int32)
+        for t in range(1, max_len):
+            candidates = score[:, :, None] + self.transitions[None, :, :]
+            best = candidates.argmax(axis=1)
+            step = np.take_along_axis(candidates, best[:, None, :], axis=1)[:, 0]
+            active = (t < lengths)[:, None]
+            score = np.where(active, step + emissions[:, t], score)
+            backpointers[:, t] = best
+
+        paths = np.zeros((batch, max_len), dtype=np.int32)
+        current = score.argmax(axis=1)
+        for t in range(max_len - 1, -1, -1):
+            active = t < lengths
+            paths[active, t] = current[active]
+            if t > 0:
+                previous = backpointers[np.arange(batch), t, current]
+                # Sentences shorter than t haven't started their path yet
+                current = np.where(t < lengths, previous, current)
+        return paths
+
+    def tag_sents(self, sentences):
+        sentences = [list(words) for words in sentences]
+        lengths = np.array([len(words) for words in sentences])
+        if not lengths.any():
+            return [[] for _ in sentences]
+
+        token_scores = self.feature_matrix(sentences) @ self.weights
+        emissions = np.zeros((len(sentences), lengths.max(), len(self.labels)))
+        emissions[TokenPositions(lengths)] = token_scores
+
+        paths = self.decode(emissions, lengths)
+        return [
+            [(word, self.labels[label]) for word, label in zip(words, paths[i])]
+            for i, words in enumerate(sentences)
+        ]
+
+    def tag(self, tokens):
+        return self.tag_sents([tokens])[0]
+
+
+# Padded forward-backward, returns log Z and the unary/pairwise marginals
+def ForwardBackward(emissions, lengths, transitions, start):
+    batch, max_len, n_labels = emissions.shape
+    mask = np.arange(max_len)[None, :] < lengths[:, None]
+
+    alpha = np.zeros((batch, max_len, n_labels))
+    alpha[:, 0] = start[None, :] + emissions[:, 0]
+    for t in range(1, max_len):
+        step = (
+            logsumexp(alpha[:, t - 1, :, None] + transitions[None], axis=1)
+            + emissions[:, t]
+        )
+        alpha[:, t] = np.where(mask[:, t, None], step, alpha[:, t - 1])
+    log_z = logsumexp(alpha[:, -1], axis=1)
+
+    beta = np.zeros((batch, max_len, n_labels))
+    for t in range(max_len - 2, -1, -1):
+        step = logsumexp(
+            transitions[None] + (emissions[:, t + 1] + beta[:, t + 1])[:, None, :],
+            axis=2,
+        )
+        beta[:, t] = np.where(mask[:, t + 1, None], step, beta[:, t + 1])
+
+    unary = np.exp(alpha + beta - log_z[:, None, None]) * mask[:, :, None]
+    pairwise = np.zeros((n_labels, n_labels))
+    for t in range(1, max_len):
+        joint = (
+            alpha[:, t - 1, :, None]
+            + transitions[None]
+            + (emissions[:, t] + beta[:, t])[:, None, :]
+            - log_z[:, None, None]
+        )
+        pairwise += (np.exp(joint) * mask[:, t, None, None]).sum(axis=0)
+    return log_z, unary, pairwise
+
+
+# Retrain the ingredient CRF from gk_train.tsv with an L2 (sigma) prior, the
+# same objective as Stanford's CRFClassifier, optimized with L-BFGS
+def TrainCRF(sentences, sigma=1.0, max_iterations=200, min_feature_count=1):
+    counts = {}
+    token_features = []
+    for sentence in sentences:
+        features = SentenceFeatures([word for word, _ in sentence])
+        token_features.append(features)
+        for token in features:
+            for feature in token:
+                counts[feature] = counts.get(feature, 0) + 1
+    feature_index = {}
+    for feature, count in counts.items():
+        if count >= min_feature_count:
+            feature_index[feature] = len(feature_index)
+
+    labels = sorted(set(label for sentence in sentences for _, label in sentence))
+    label_index = {label: index for index, label in enumerate(labels)}
+    n_features, n_labels = len(feature_index), len(labels)
+
+    tagger = CRFTagger(
+        feature_index,
+        labels,
+        np.zeros((n_features, n_labels)),
+        np.zeros((n_labels, n_labels)),
+        np.zeros(n_labels),
+    )
+    X = tagger.feature_matrix(
+        [[word for word, _ in sentence] for sentence in sentences]
+    )
+    lengths = np.array([len(sentence) for sentence in sentences])
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    gold = np.array(
+        [label_index[label] for sentence in sentences for _, label in sentence]
+    )
+    gold_onehot = np.zeros((len(gold), n_labels))
+    gold_onehot[np.arange(len(gold)), gold] = 1
+
+    # Gold counts never change, only the expectations do
+    gold_features = X.T @ gold_onehot
+    gold_transitions = np.zeros((n_labels, n_labels))
+    gold_start = np.zeros(n_labels)
+    for i in range(len(sentences)):
+        path = gold[offsets[i] : offsets[i + 1]]
+        gold_start[path[0]] += 1
+        np.add.at(gold_transitions, (path[:-1], path[1:]), 1)
+
+    sentence_ids, positions = TokenPositions(lengths)
+
+    def Unpack(params):
+        weights = params[: n_features * n_labels].reshape(n_features, n_labels)
+        transitions = params[n_features * n_labels : -n_labels].reshape(
+            n_labels, n_labels
+        )
+        return weights, transitions, params[-n_labels:]
+
+    def Objective(params):
+        weights, transitions, start = Unpack(params)
+        token_scores = X @ weights
+        emissions = np.zeros((len(sentences), lengths.max(), n_labels))
+        emissions[sentence_ids, positions] = token_scores
+
+        log_z, unary, pairwise = ForwardBackward(emissions, lengths, transitions, start)
+        gold_score = (
+            (token_scores * gold_onehot).sum()
+            + (transitions * gold_transitions).sum()
+            + (start * gold_start).sum()
+        )
+        token_marginals = unary[sentence_ids, positions]
+
+        loss = log_z.sum() - gold_score + (params**2).sum() / (2 * sigma**2)
+        grad_weights = X.T @ token_marginals - gold_features
+        grad_transitions = pairwise - gold_transitions
+        grad_start = unary[:, 0].sum(axis=0) - gold_start
+        grad = np.concatenate(
+            [grad_weights.ravel(), grad_transitions.ravel(), grad_start]
+        )
+        return loss, grad + params / sigma**2
+
+    result = minimize(
+        Objective,
+        np.zeros(n_features * n_labels + n_labels * n_labels + n_labels),
+        jac=True,
+        method="L-BFGS-B",
+        options={"maxiter": max_iterations},
+    )
+    print(f"Training finished after {result.nit} iterations, loss {result.fun:.2f}")
+    tagger.weights, tagger.transitions, tagger.start = Unpack(result.x)
+    return tagger
+
+
+# Only the NAME tag is used downstream, everything else counts as O
+def NameTags(tags):
+    return ["NAME" if tag == "NAME" else "O" for tag in tags]
+
+
+def AgreementReport(tagger, sentences, java_tagger=None):
+    words = [[word for word, _ in sentence] for sentence in sentences]
+    gold = [NameTags([label for _, label in sentence]) for sentence in sentences]
+    native = [
+        NameTags([tag for _, tag in tagged]) for tagged in tagger.tag_sents(words)
+    ]
+
+    def Compare(name, expected):
+        tokens = sum(len(tags) for tags in expected)
+        same = sum(a == b for x, y in zip(native, expected) for a, b in zip(x, y))
+        exact = sum(x == y for x, y in zip(native, expected))
+        print(
+            f"native vs {name:<5} token agreement {same / tokens:.4f}"
+            f"  sentence agreement {exact / len(expected):.4f}"
+            f"  ({tokens} tokens, {len(expected)} sentences)"
+        )
+
+    Compare("gold", gold)
+    if java_tagger is not None:
+        java = [
+            NameTags([tag for _, tag in tagged])
+            for tagged in java_tagger.tag_sents(words)
+        ]
+        Compare("java", java)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Native ingredient NER model")
+    parser.add_argument("command", choices=["train", "agree"])
+    parser.add_argument("--sigma", type=float, default=1.0)
+    parser.add_argument("--max-iterations", type=int, default=200)
+    parser.add_argument(
+        "--no-java", action="store_true", help="skip the comparison with the JVM"
+    )
+    args = parser.parse_args()
+
+    if args.command == "train":
+        starttime = time.time()
+        tagger = TrainCRF(
+            ReadTsv(join(data_path, "gk_train.tsv")),
+            sigma=args.sigma,
+            max_iterations=args.max_iterations,
+        )
+        tagger.save()
+        print(f"Saved {native_model} in {time.time() - starttime:.1f}s")
+    else:
+        java_tagger = None
+        if not args.no_java:
+            from ner_service import JavaTagger, jar, model
+
+            # The jar and the serialized model aren't checked in
+            missing = [path for path in (jar, model) if not os.path.exists(path)]
+            if shutil.which("java") is None:
+                missing.append("java")
+            if missing:
+                print(
+                    f"Skipping the comparison with the JVM, missing {', '.join(missing)}"
+                )
+            else:
+                java_tagger = JavaTagger()
+        AgreementReport(
+            CRFTagger.load(), ReadTsv(join(data_path, "gk_test.tsv")), java_tagger
+        )
+        if java_tagger is not None:
+            java_tagger.stop()
@@ -0,0 +1,140 @@
+# coding: utf-8
+
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from os.path import dirname, join
+
+project_path = dirname(__file__)
+cache_path = os.environ.get(
+    "INGREDIENT_CACHE_PATH", join(project_path, "cache", "ingredients.sqlite3")
+)
+
+
+def NormalizeIngredient(ingredient: str):
+    # Only whitespace is normalized, the NER model is case sensitive
+    return " ".join(ingredient.split())
+
+
+class IngredientCache:
+    """In-process LRU in front of a SQLite file shared by every worker
+
+    Values are (parsed ingredient, matched allergen or None) and every entry
+    belongs to a version string, a lookup with another version is a miss.
+    Workers can be on different versions during a reload, so a version's rows
+    are only pruned once no worker has used it for version_ttl seconds.
+    """
+
+    def __init__(self, db_path=cache_path, max_entries=50000, version_ttl=3600):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.version_ttl = version_ttl
+        self.lock = threading.Lock()
+        self.memory = OrderedDict()
+        self.version = None
+        self.used_at = 0.0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        os.makedirs(dirname(db_path), exist_ok=True)
+        self.db = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS ingredients ("
+            "version TEXT, key TEXT, parsed TEXT, allergen TEXT, "
+            "PRIMARY KEY (version, key))"
+        )
+        # When a worker last used each version
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS versions (version TEXT PRIMARY KEY, used_at REAL)"
+        )
+        self.db.commit()
+
+    def _set_version(self, version):
+        # A new model or allergen file invalidates everything cached before it
+        now = time.time()
+        if version != self.version:
+            self.memory.clear()
+            self.version = version
+            self._touch(version, now)
+            self._prune(now)
+        elif now - self.used_at > self.version_ttl / 4:
+            self._touch(version, now)
+
+    def _touch(self, version, now):
+        self.used_at = now
+        self.db.execute("INSERT OR REPLACE INTO versions VALUES (?, ?)", (version, now))
+        self.db.commit()
+
+    def _prune(self, now):
+        # Rows of versions no worker has used lately, or never recorded
+        recent = "SELECT version FROM versions WHERE used_at >= ?"
+        cutoff = now - self.version_ttl
+        self.db.execute(
+            f"DELETE FROM ingredients WHERE version NOT IN ({recent})", (cutoff,)
+        )
+        self.db.execute("DELETE FROM versions WHERE used_at < ?", (cutoff,))
+        self.db.commit()
+
+    def _remember(self, key, value):
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        if len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def get_many(self, keys, version):
+        found = {}
+        with self.lock:
+            self._set_version(version)
+            missing = []
+            for key in keys:
+                if key in self.memory:
+                    self.memory.move_to_end(key)
+                    found[key] = self.memory[key]
+                    self.memory_hits += 1
+                else:
+                    missing.append(key)
+
+            # SQLite caps the number of bound parameters, query in chunks
+            for start in range(0, len(missing), 500):
+                chunk = missing[start : start + 500]
+                rows = self.db.execute(
+                    "SELECT key, parsed, allergen FROM ingredients "
+                    f"WHERE version = ? AND key IN ({','.join('?' * len(chunk))})",
+                    [version] + chunk,
+                ).fetchall()
+                for key, parsed, allergen in rows:
+                    found[key] = (parsed, allergen)
+                    self._remember(key, (parsed, allergen))
+                self.disk_hits += len(rows)
+                self.misses += len(chunk) - len(rows)
+        return found
+
+    def set_many(self, items: dict, version):
+        with self.lock:
+            self._set_version(version)
+            for key, value in items.items():
+                self._remember(key, value)
+            self.db.executemany(
+                "INSERT OR REPLACE INTO ingredients VALUES (?, ?, ?, ?)",
+                [
+                    (version, key, parsed, allergen)
+                    for key, (parsed, allergen) in items.items()
+                ],
+            )
+            self.db.commit()
+
+    def stats(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (
+                (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0
+            ),
+            "memory_entries": len(self.memory),
+        }
@@ -0,0 +1,348 @@
+# coding: utf-8
+
+import hashlib
+import json
+import os
+import queue
+import socket
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+import logging
+from os.path import dirname, join
+
+project_path = dirname(__file__)
+ner_path = join(project_path, "stanford-ner-tagger")
+jar = join(ner_path, "stanford-ner.jar")
+model = join(ner_path, "classifiers", "ingredient-ner-model.ser.gz")
+native_model = join(ner_path, "classifiers", "ingredient-ner-model.npz")
+
+SERVICE_HOST = os.environ.get("NER_SERVICE_HOST", "127.0.0.1")
+SERVICE_PORT = int(os.environ.get("NER_SERVICE_PORT", 9199))
+JAVA_OPTIONS = os.environ.get("NER_JAVA_OPTIONS", "-mx1000m").split()
+# "jvm" for the Stanford CRFClassifier, "native" for the NumPy port in crf_tagger
+NER_BACKEND = os.environ.get("NER_BACKEND", "jvm")
+# Seconds the JVM may go without writing a line before it is restarted
+READ_TIMEOUT = float(os.environ.get("NER_READ_TIMEOUT", 15))
+
+logger = logging.getLogger(__name__)
+
+
+class JavaTagger:
+    """Long-lived CRFClassifier process that tags one sentence per stdin line"""
+
+    def __init__(
+        self,
+        model_path=model,
+        jar_path=jar,
+        restart_backoff=0.5,
+        read_timeout=READ_TIMEOUT,
+    ):
+        self.model_path = model_path
+        self.jar_path = jar_path
+        self.restart_backoff = restart_backoff
+        self.read_timeout = read_timeout
+        self.restarts = 0
+        self.process = None
+        self.lines = None
+        self.lock = threading.Lock()
+
+    def _command(self):
+        # Same flags nltk's StanfordNERTagger uses, but reading from stdin so
+        # the JVM and the loaded classifier stay warm between batches
+        return (
+            ["java"]
+            + JAVA_OPTIONS
+            + [
+                "-cp",
+                self.jar_path,
+                "edu.stanford.nlp.ie.crf.CRFClassifier",
+                "-loadClassifier",
+                self.model_path,
+                "-readStdin",
+                "-outputFormat",
+                "slashTags",
+                "-tokenizerFactory",
+                "edu.stanford.nlp.process.WhitespaceTokenizer",
+                "-tokenizerOptions",
+                "tokenizeNLs=false",
+                "-encoding",
+                "utf8",
+            ]
+        )
+
+    def start(self):
+        self.process = subprocess.Popen(
+            self._command(),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            encoding="utf8",
+            bufsize=1,
+        )
+        # stdout is read on its own thread so waiting for a line can time out,
+        # each process gets a fresh queue so a killed one's output is never read
+        self.lines = queue.Queue()
+        threading.Thread(
+            target=self._read, args=(self.process.stdout, self.lines), daemon=True
+        ).start()
+        # The classifier logs timing info to stderr, drain it so it never blocks
+        threading.Thread(
+            target=self._drain, args=(self.process.stderr,), daemon=True
+        ).start()
+
+    def _read(self, stream, lines):
+        for line in stream:
+            lines.put(line)
+        # End of output, the process exited
+        lines.put("")
+
+    def _drain(self, stream):
+        for line in stream:
+            logger.debug(f"CRFClassifier: {line.rstrip()}")
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def stop(self):
+        if self.process is not None:
+            self.process.kill()
+            self.process.wait()
+            self.process = None
+
+    def restart(self):
+        self.stop()
+        self.restarts += 1
+        time.sleep(self.restart_backoff)
+        self.start()
+
+    def _write(self, stdin, lines):
+        try:
+            for line in lines:
+                stdin.write(line + "\n")
+            stdin.flush()
+        except (OSError, ValueError):
+            # The process died or was killed, reading its output reports it
+            pass
+
+    def _tag_sents(self, sentences):
+        # Words are never split by the whitespace tokenizer, so the output can
+        # be regrouped per sentence by counting tokens, like nltk's parse_output
+        lines = [" ".join(sentence) for sentence in sentences if sentence]
+        expected = sum(len(sentence) for sentence in sentences)
+
+        # Write from a separate thread so a large batch can't fill the stdout
+        # pipe while we are still writing to stdin
+        writer = threading.Thread(
+            target=self._write, args=(self.process.stdin, lines), daemon=True
+        )
+        writer.start()
+
+        tagged_words = []
+        while len(tagged_words) < expected:
+            try:
+                line = self.lines.get(timeout=self.read_timeout)
+            except queue.Empty:
+                raise TimeoutError(
+                    f"CRFClassifier wrote nothing for {self.read_timeout}s"
+                ) from None
+            if not line:
+                raise RuntimeError("CRFClassifier process exited")
+            for tagged_word in line.split():
+                word_tags = tagged_word.split("/")
+                tagged_words.append(("/".join(word_tags[:-1]), word_tags[-1]))
+        writer.join()
+
+        result = []
+        start = 0
+        for sentence in sentences:
+            result.append(tagged_words[start : start + len(sentence)])
+            start += len(sentence)
+        return result
+
+    def tag_sents(self, sentences):
+        with self.lock:
+            if self.process is None:
+                self.start()
+            elif not self.alive():
+                self.restart()
+            try:
+                return self._tag_sents(sentences)
+            except (OSError, ValueError, RuntimeError) as e:
+                # Supervisor: restart the JVM once and replay the batch
+                logger.warning(f"Tagger process failed ({e}), restarting")
+                self.restart()
+                try:
+                    return self._tag_sents(sentences)
+                except (OSError, ValueError, RuntimeError):
+                    # Don't leave a hung JVM for the next batch
+                    self.stop()
+                    raise
+
+    def tag(self, tokens):
+        return self.tag_sents([tokens])[0]
+
+
+class TaggerRequestHandler(socketserver.StreamRequestHandler):
+    """Newline-delimited JSON: {"sentences": [[token, ...], ...]} per request"""
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                if request.get("ping"):
+                    response = {"ok": True, "restarts": self.server.tagger.restarts}
+                else:
+                    tags = self.server.tagger.tag_sents(request["sentences"])
+                    response = {"tags": tags}
+            except Exception as e:
+                logger.error(f"Tagging request failed: {e}", exc_info=True)
+                response = {"error": str(e)}
+            self.wfile.write((json.dumps(response) + "\n").encode("utf8"))
+            self.wfile.flush()
+
+
+class TaggerServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, tagger):
+        super().__init__(address, TaggerRequestHandler)
+        self.tagger = tagger
+
+
+def serve(host=SERVICE_HOST, port=SERVICE_PORT):
+    """Run the shared tagging service, one warm JVM for every Flask worker"""
+    tagger = JavaTagger()
+    tagger.start()
+    with TaggerServer((host, port), tagger) as server:
+        logger.info(f"NER tagging service listening on {host}:{port}")
+        try:
+            server.serve_forever()
+        finally:
+            tagger.stop()
+
+
+class TaggerClient:
+    """Client for the shared tagging service with a local fallback tagger"""
+
+    def __init__(self, host=SERVICE_HOST, port=SERVICE_PORT, timeout=30):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.sock = None
+        self.reader = None
+        self.lock = threading.Lock()
+        self.local_tagger = None
+        self.spawned = False
+
+    def _connect(self):
+        self.sock = socket.create_connection((self.host, self.port), self.timeout)
+        self.reader = self.sock.makefile("r", encoding="utf8")
+
+    def _close(self):
+        if self.sock is not None:
+            self.sock.close()
+        self.sock = None
+        self.reader = None
+
+    def _request(self, payload):
+        if self.sock is None:
+            self._connect()
+        self.sock.sendall((json.dumps(payload) + "\n").encode("utf8"))
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionError("NER tagging service closed the connection")
+        response = json.loads(line)
+        if "error" in response:
+            raise RuntimeError(response["error"])
+        return response
+
+    def _spawn_service(self):
+        # Only try once per process, the first worker to bind the port wins
+        # and the others just connect to it
+        self.spawned = True
+        subprocess.Popen(
+            [sys.executable, __file__, "serve"],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+
+    def _local_tag_sents(self, sentences):
+        if self.local_tagger is None:
+            self.local_tagger = JavaTagger()
+        return self.local_tagger.tag_sents(sentences)
+
+    def tag_sents(self, sentences):
+        sentences = [list(sentence) for sentence in sentences]
+        with self.lock:
+            try:
+                tags = self._request({"sentences": sentences})["tags"]
+                return [[tuple(tag) for tag in sentence] for sentence in tags]
+            except (OSError, ValueError, RuntimeError) as e:
+                self._close()
+                if not self.spawned:
+                    logger.info("NER tagging service unavailable, starting it")
+                    self._spawn_service()
+                logger.warning(f"NER tagging service failed ({e}), tagging locally")
+                return self._local_tag_sents(sentences)
+
+    def tag(self, tokens):
+        return self.tag_sents([tokens])[0]
+
+    def ping(self):
+        with self.lock:
+            try:
+                return self._request({"ping": True})
+            except (OSError, ValueError, RuntimeError):
+                self._close()
+                return None
+
+
+_client = None
+_model_digests = {}
+
+
+def ModelDigest(model_path=model):
+    # Hash of the model file, recomputed only when the file changes
+    try:
+        stat = os.stat(model_path)
+    except OSError:
+        return "missing"
+    key = (model_path, stat.st_mtime_ns, stat.st_size)
+    if key not in _model_digests:
+        digest = hashlib.sha1()
+        with open(model_path, "rb") as file:
+            for chunk in iter(lambda: file.read(1 << 20), b""):
+                digest.update(chunk)
+        _model_digests[key] = digest.hexdigest()
+    return _model_digests[key]
+
+
+def ActiveModel():
+    return native_model if NER_BACKEND == "native" else model
+
+
+def GetTagger():
+    # One tagger per process, every request shares the same warm tagger
+    global _client
+    if _client is None:
+        if NER_BACKEND == "native":
+            from crf_tagger import CRFTagger
+
+            _client = CRFTagger.load(native_model)
+        else:
+            _client = TaggerClient()
+    return _client
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        serve()
+    else:
+        print(GetTagger().tag_sents([["2", "cups", "all-purpose", "flour"]]))
@@ -1,16 +1,15 @@
 # coding: utf-8
 
 import nltk
-from nltk.tag.stanford import StanfordNERTagger
 from os.path import dirname, join, exists
 import json
-import pandas as pd
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-import numpy as np
+import logging
 import time
 from nltk.stem import WordNetLemmatizer
 from nltk.corpus import wordnet
+from ner_service import GetTagger, ModelDigest, ActiveModel
+from allergen_index import AllergenIndex
+from ingredient_cache import IngredientCache, NormalizeIngredient
 
 
 project_path = dirname(__file__)
@@ -19,14 +18,20 @@ data_path = join(ner_path, "data")
 jar = join(ner_path, "stanford-ner.jar")
 model = join(ner_path, "classifiers", "ingredient-ner-model.ser.gz")
 lemmatizer = WordNetLemmatizer()
+allergen_index = AllergenIndex(join(data_path, "AllergenData.csv"))
+ingredient_cache = IngredientCache()
+
+logger = logging.getLogger(__name__)
 
 
 # Use NER model to identify ingredient element from string
 def GetIngredients(ner_tagger, ingredients: list = []):
+    # Tag every ingredient of the recipe in a single round trip
+    tagged = ner_tagger.tag_sents(
+        [nltk.word_tokenize(ingredient) for ingredient in ingredients]
+    )
     parsed_ingredients = []
-    for ingredient in ingredients:
-        words = nltk.word_tokenize(ingredient)
-        tag_lst = ner_tagger.tag(words)
+    for tag_lst in tagged:
         parsed_ingredients.append(
             " ".join(
                 [
@@ -39,60 +44,91 @@ def GetIngredients(ner_tagger, ingredients: list = []):
     return parsed_ingredients
 
 
-# Calculate TF-IDF score to find matching allergen for each ingredient
-def AllergenMatch(ingredients: list, allergens: list):
-    vectorizer = TfidfVectorizer()
-    tfidf_matrix = vectorizer.fit_transform(allergens)
-    query_vector = vectorizer.transform(ingredients)
-    cosine_similarities = cosine_similarity(query_vector, tfidf_matrix)
+# Find the matching allergen for each ingredient with the precompiled index
+def AllergenMatch(ingredients: list, snapshot=None):
     res = []
-    for i, query in enumerate(ingredients):
-        # Get similarity scores for this query
-        scores = cosine_similarities[i]
-        # Rank document indices based on scores (highest score first)
-        ranked_doc_indices = np.argsort(scores)[::-1]
+    allergens = allergen_index.match(ingredients, snapshot)
+    for query, allergen in zip(ingredients, allergens):
         # Add Ingredient and Allergen to result
-        index = ranked_doc_indices[0]
-        if scores[index] > 0:
-            res.append({"ingredient": query, "allergen": allergens[index]})
+        if allergen is not None:
+            res.append({"ingredient": query, "allergen": allergen})
     return res
 
 
+# Cache entries are only valid for one NER model and one allergen file
+def CacheVersion(snapshot):
+    return f"{ModelDigest(ActiveModel())}:{snapshot.digest}"
+
+
+def GetAllergenVersion():
+    # Changes whenever the NER model or the allergen data changes
+    return CacheVersion(allergen_index.current())
+
+
+# Parsed ingredient and matched allergen for each ingredient, only cache
+# misses go through the tagger and the allergen index
+def MatchIngredients(ingredients: list, snapshot):
+    version = CacheVersion(snapshot)
+    keys = [NormalizeIngredient(ingredient) for ingredient in ingredients]
+    results = ingredient_cache.get_many(list(dict.fromkeys(keys)), version)
+
+    misses = [key for key in dict.fromkeys(keys) if key not in results]
+    if misses:
+        parsed_ingredients = GetIngredients(GetTagger(), misses)
+        allergens = allergen_index.match(parsed_ingredients, snapshot)
+        new_results = dict(zip(misses, zip(parsed_ingredients, allergens)))
+        ingredient_cache.set_many(new_results, version)
+        results.update(new_results)
+
+    return [results[key] for key in keys]
+
+
 # Process recipe to return ingredient allergy
 def ProcessRecipe(recipe: dict):
+    return ProcessRecipes([recipe])[0]
+
+
+# Process a batch of recipes, every unique ingredient is tagged and matched
+# once and the matches are fanned back out per recipe
+def ProcessRecipes(recipes: list):
     starttime = time.time()
-    ner_tagger = StanfordNERTagger(model, jar, encoding="utf8")
-    df_allergies = pd.read_csv(join(data_path, "AllergenData.csv"), encoding="utf8")
-    ingredients = GetIngredients(ner_tagger, recipe["ingredients"])
-    allergens = df_allergies["allergen"].tolist()
-    df_allergens = pd.DataFrame.from_dict(AllergenMatch(ingredients, allergens))
-
-    allergies = allergies = (
-        df_allergies.merge(
-            df_allergens,
-            how="inner",
-            left_on="allergen",
-            right_on="allergen",
-            suffixes=("_left", "_right"),
-        )["allergy"]
-        .unique()
-        .tolist()
+    snapshot = allergen_index.current()
+    matches = MatchIngredients(
+        [ingredient for recipe in recipes for ingredient in recipe["ingredients"]],
+        snapshot,
     )
 
-    print("Time taken to process recipe: ", time.time() - starttime)
-    return {"recipe_name": recipe["recipe_name"], "allergies": allergies}
+    results = []
+    start = 0
+    for recipe in recipes:
+        recipe_matches = matches[start : start + len(recipe["ingredients"])]
+        start += len(recipe["ingredients"])
+        allergies = allergen_index.allergies(
+            [allergen for _, allergen in recipe_matches], snapshot
+        )
+        results.append({"recipe_name": recipe["recipe_name"], "allergies": allergies})
+
+    if logger.isEnabledFor(logging.DEBUG):
+        elapsed = time.time() - starttime
+        logger.debug(
+            f"Processed {len(recipes)} recipes in {elapsed:.3f}s "
+            f"({len(recipes) / max(elapsed, 1e-9):.1f} recipes/sec), "
+            f"ingredient cache: {ingredient_cache.stats()}"
+        )
+    return results
+
+
+def GetCacheStats():
+    return ingredient_cache.stats()
 
 
 def GetAllergenData():
-    # Read allergen data from CSV file
-    df_allergies = pd.read_csv(join(data_path, "AllergenData.csv"), encoding="utf8")
-    allergens = df_allergies["allergy"].drop_duplicates().tolist()
-    return allergens
+    # Allergy names straight from the loaded allergen index
+    return allergen_index.allergy_list()
 
 
 if __name__ == "__main__":
     # Open Parsed data file
     with open(join(data_path, "parsed_data.json"), "r", encoding="utf8") as file:
-        for recipe in json.load(file):
-            recipe_allergies = ProcessRecipe(recipe)
+        for recipe_allergies in ProcessRecipes(json.load(file)):
             print(recipe_allergies["recipe_name"], recipe_allergies["allergies"])
@@ -0,0 +1,82 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResultCache:
+    """LRU of finished responses with a time to live, keyed by a normalized query
+
+    Every entry belongs to a version string. A lookup with a new version (a
+    rebuilt index or allergen file) drops everything cached before it.
+    """
+
+    def __init__(self, max_entries=10000, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.invalidations = 0
+        self.seconds_saved = 0.0
+
+    def _set_version(self, version):
+        if version != self.version:
+            if self.version is not None:
+                self.invalidations += 1
+            self.entries.clear()
+            self.version = version
+
+    def get(self, key, version):
+        """Cached value for key, or None"""
+        start_time = time.perf_counter()
+        with self.lock:
+            self._set_version(version)
+            entry = self.entries.get(key)
+            if entry is not None and time.monotonic() - entry["stored_at"] > self.ttl:
+                del self.entries[key]
+                self.expired += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            # What the request would have cost without the cache
+            self.seconds_saved += max(
+                entry["duration"] - (time.perf_counter() - start_time), 0.0
+            )
+            return entry["value"]
+
+    def set(self, key, version, value, duration):
+        """Store value, duration is how long computing it took"""
+        with self.lock:
+            self._set_version(version)
+            self.entries[key] = {
+                "value": value,
+                "duration": duration,
+                "stored_at": time.monotonic(),
+            }
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "expired": self.expired,
+                "invalidations": self.invalidations,
+                "entries": len(self.entries),
+                "seconds_saved": round(self.seconds_saved, 3),
+                "ms_saved_per_hit": (
+                    round(self.seconds_saved / self.hits * 1000, 1)
+                    if self.hits
+                    else 0.0
+                ),
+            }
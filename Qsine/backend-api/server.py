@@ -1,6 +1,8 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Request, request, jsonify
 from werkzeug.utils import secure_filename
+import io
 import os
+import tempfile
 import requests
 from pymongo import MongoClient
 from PIL import Image
@@ -9,7 +11,6 @@ import logging
 import time
 from logging.handlers import RotatingFileHandler
 from dotenv import load_dotenv
-import json
 
 load_dotenv()
 
@@ -28,28 +29,68 @@ logger = logging.getLogger(__name__)
 
 sys.path.append("../custom_model")
 
-from classify import infer_image
+from classify import load_model
+from micro_batcher import get_batcher
+
+# Load the classifier and run its warmup inference before serving requests
+load_model()
 
 sys.path.append("../allergen-detector")
 
-from test_model import ProcessRecipe, GetAllergenData
+from test_model import (
+    ProcessRecipe,
+    ProcessRecipes,
+    GetAllergenData,
+    GetAllergenVersion,
+    GetCacheStats,
+)
 
 sys.path.append("../data")
 
 from get_ingredients import get_ingredients_by_category
+from recipe_store import get_recipe_store
 
 sys.path.append("../text-processor")
 
-from reranker import GetRecipe
+from reranker import (
+    RERANK_CASCADE,
+    Confidence,
+    GetRecipe,
+    QueryKey,
+    RetrievalVersion,
+    WarmBM25,
+)
+
+# Load the BM25 index, or build it once across workers, before serving requests
+WarmBM25()
 
 
 from helpers import attempt_to_find_product, clean_text
+from result_cache import ResultCache
+
+
+class SpooledRequest(Request):
+    # Keep uploads in memory, only spool to an anonymous temp file when the
+    # upload is bigger than UPLOAD_SPOOL_THRESHOLD
+    def _get_file_stream(
+        self, total_content_length, content_type, filename=None, content_length=None
+    ):
+        return tempfile.SpooledTemporaryFile(
+            max_size=app.config["UPLOAD_SPOOL_THRESHOLD"]
+        )
+
 
 app = Flask(__name__)
-app.config["UPLOAD_FOLDER"] = "./temp"
+app.request_class = SpooledRequest
+app.config["UPLOAD_SPOOL_THRESHOLD"] = int(
+    os.getenv("UPLOAD_SPOOL_THRESHOLD", 8 * 1024 * 1024)
+)
 
-# Ensure the upload folder exists
-os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
+# Finished /classify-text responses, keyed by the query's sorted tokens
+classify_cache = ResultCache(
+    max_entries=int(os.getenv("CLASSIFY_CACHE_SIZE", 10000)),
+    ttl=float(os.getenv("CLASSIFY_CACHE_TTL", 3600)),
+)
 
 # MongoDB setup
 client = MongoClient(os.getenv("MONGODB_URI"))
@@ -96,14 +137,12 @@ def classify_image():
     file = request.files["image"]
     logger.info(f"Received image: {file.filename}")
 
-    file_path = os.path.join(app.config["UPLOAD_FOLDER"], "temp_classify.jpg")
-
-    if file:
-        file.save(file_path)
-        logger.debug(f"Image saved to {file_path}")
-
     try:
-        confidences, classifications = infer_image(file_path)
+        # Decode straight from the upload stream, nothing is written to disk
+        image = Image.open(file.stream).convert("RGB")
+
+        # Coalesced with concurrent requests into one batched forward pass
+        confidences, classifications = get_batcher().infer(image)
         classification = classifications[0]
         logger.info(f"Image classified as: {classification}")
 
@@ -279,11 +318,7 @@ def upload_text_image(lang):
     file = request.files["image"]
     logger.info(f"Received image for text extraction: {file.filename}")
 
-    # Save the uploaded image to a temporary file
-    file_path = os.path.join("temp", secure_filename(file.filename))
-
-    # Ensure the temp directory exists
-    os.makedirs("temp", exist_ok=True)
+    filename = secure_filename(file.filename) or "image.jpg"
 
     # Check the file size
     file.seek(0, os.SEEK_END)
@@ -292,18 +327,21 @@ def upload_text_image(lang):
 
     logger.debug(f"Image file size: {file_size} bytes")
 
-    # If the file size exceeds 1 MB, resize the image
+    # If the file size exceeds 1 MB, resize the image in memory
     if file_size > 1 * 1024 * 1024:  # 1 MB in bytes
         logger.info("Image exceeds 1MB, resizing")
-        with Image.open(file) as img:
+        image_stream = io.BytesIO()
+        with Image.open(file.stream) as img:
             img = img.convert("RGB")  # Ensure the image is in RGB mode
             img.thumbnail((1024, 1024))  # Resize the image to a maximum of 1024x1024
-            img.save(file_path, format="JPEG", quality=85)  # Save with reduced quality
+            img.save(image_stream, format="JPEG", quality=85)  # Reduced quality
+        image_stream.seek(0)
+        filename = os.path.splitext(filename)[0] + ".jpg"
+        mimetype = "image/jpeg"
     else:
-        file.save(file_path)
-        logger.debug(f"Image saved to {file_path}")
-
-    filename = file_path
+        # Stream the upload as is
+        image_stream = file.stream
+        mimetype = file.mimetype
 
     # Prepare the image for the OCR API
     payload = {
@@ -314,9 +352,12 @@ def upload_text_image(lang):
 
     # Send image to OCR API
     try:
-        with open(filename, "rb") as f:
-            logger.info("Sending image to OCR API")
-            response = requests.post(OCR_API_URL, files={filename: f}, data=payload)
+        logger.info("Sending image to OCR API")
+        response = requests.post(
+            OCR_API_URL,
+            files={filename: (filename, image_stream, mimetype)},
+            data=payload,
+        )
 
         if response.status_code == 200:
             logger.info("OCR API request successful")
@@ -362,30 +403,52 @@ def classify_text():
     text = request.get_json().get("text")
     logger.info(f"Received text for classification: {text}...")
 
-    results = GetRecipe(text)
+    start_time = time.perf_counter()
+    cache_key = QueryKey(text)
+    cache_version = f"{RetrievalVersion()}:{GetAllergenVersion()}"
+    return_item = classify_cache.get(cache_key, cache_version)
+    if return_item is not None:
+        logger.info("Returning cached classification")
+    else:
+        results = GetRecipe(text)
 
-    recipe = results[0].get("recipe", "")
+        recipe = results[0].get("recipe", "")
 
-    logger.info(f"Got result: {results}")
+        logger.info(f"Got result: {results}")
 
-    allergens = ProcessRecipe(
-        {
+        allergens = ProcessRecipe(
+            {
+                "ingredients": recipe.get("ingredients", []),
+                "recipe_name": recipe.get("recipe_name", ""),
+            }
+        )
+        logger.info(f"Allergens detected: {allergens}")
+
+        return_item = {
+            "classifications": [
+                result.get("recipe", {}).get("recipe_name", "") for result in results
+            ],
+            "keys": [result.get("recipe", {}).get("key", "") for result in results],
+            # Raw cross-encoder scores, 0 for hits the cascade left unscored
+            "confidences": [
+                0 if result.get("similarity") is None else result["similarity"]
+                for result in results
+            ],
             "ingredients": recipe.get("ingredients", []),
-            "recipe_name": recipe.get("recipe_name", ""),
+            "allergens": allergens,
+            "steps": recipe.get("steps", []),
         }
-    )
-    logger.info(f"Allergens detected: {allergens}")
-
-    return_item = {
-        "classifications": [
-            result.get("recipe", {}).get("recipe_name", "") for result in results
-        ],
-        "keys": [result.get("recipe", {}).get("key", "") for result in results],
-        "confidences": [result.get("similarity", 0) for result in results],
-        "ingredients": recipe.get("ingredients", []),
-        "allergens": allergens,
-        "steps": recipe.get("steps", []),
-    }
+        if RERANK_CASCADE:
+            # Which stage placed each hit, and its relevance in [0, 1] or
+            # null when only BM25 ranked it
+            return_item["relevances"] = [Confidence(result) for result in results]
+            return_item["bm25_scores"] = [
+                result.get("bm25_score") for result in results
+            ]
+            return_item["sources"] = [result.get("source") for result in results]
+        classify_cache.set(
+            cache_key, cache_version, return_item, time.perf_counter() - start_time
+        )
 
     return (
         jsonify({"message": "Text successfully classified", "data": return_item}),
@@ -402,19 +465,10 @@ def get_recipe(key):
         logger.warning("No key provided")
         return jsonify({"error": "No key provided"}), 400
 
-    return_recipe = None
+    # Reads only this recipe's bytes from the recipe store
+    recipe = get_recipe_store().get(key)
 
-    with open("../data/all_recipes.json", "r", encoding="utf8") as file:
-        data = json.load(file)
-
-        for recipe in data:
-            if recipe["key"] == key:
-                return_recipe = recipe
-                break
-        else:
-            return_recipe = None
-
-    if not return_recipe:
+    if not recipe:
         logger.warning(f"Recipe not found for key: {key}")
         return jsonify({"error": "Recipe not found"}), 404
 
@@ -440,6 +494,54 @@ def get_recipe(key):
     )
 
 
+@app.route("/recipes", methods=["GET"])
+def get_recipes():
+    keys = [key for key in request.args.get("keys", "").split(",") if key]
+    logger.info(f"Retrieving {len(keys)} recipes")
+
+    if not keys:
+        logger.warning("No keys provided")
+        return jsonify({"error": "No keys provided"}), 400
+
+    recipes = get_recipe_store().get_many(keys)
+    found = set(recipe["key"] for recipe in recipes)
+    missing = [key for key in keys if key not in found]
+    if missing:
+        logger.warning(f"Recipes not found for keys: {missing}")
+
+    # Allergens for all recipes in one batch
+    allergens = ProcessRecipes(
+        [
+            {
+                "ingredients": recipe.get("ingredients", []),
+                "recipe_name": recipe.get("recipe_name", ""),
+            }
+            for recipe in recipes
+        ]
+    )
+
+    return_items = [
+        {
+            "recipe": recipe,
+            "allergens": recipe_allergens,
+            "ingredients": recipe.get("ingredients", []),
+            "steps": recipe.get("steps", []),
+        }
+        for recipe, recipe_allergens in zip(recipes, allergens)
+    ]
+
+    return (
+        jsonify(
+            {
+                "message": "Recipes retrieved successfully",
+                "data": return_items,
+                "missing": missing,
+            }
+        ),
+        200,
+    )
+
+
 @app.route("/get-allergens", methods=["GET"])
 def get_allergens():
     logger.info("Retrieving allergen list")
@@ -456,6 +558,72 @@ def get_allergens():
     return jsonify(allergen_list), 200
 
 
+@app.route("/allergens/batch", methods=["POST"])
+def process_allergens_batch():
+    data = request.get_json(silent=True)
+    recipes = data.get("recipes") if isinstance(data, dict) else None
+
+    if not isinstance(recipes, list):
+        logger.warning("No recipes provided for allergen batch")
+        return jsonify({"error": "No recipes provided"}), 400
+
+    if not all(
+        isinstance(recipe, dict)
+        and isinstance(recipe.get("ingredients"), list)
+        and all(isinstance(ingredient, str) for ingredient in recipe["ingredients"])
+        for recipe in recipes
+    ):
+        logger.warning("Invalid recipe in allergen batch")
+        return (
+            jsonify({"error": "Every recipe needs an ingredients list of strings"}),
+            400,
+        )
+
+    logger.info(f"Processing allergen batch of {len(recipes)} recipes")
+
+    start_time = time.time()
+    allergens = ProcessRecipes(
+        [
+            {
+                "ingredients": recipe["ingredients"],
+                "recipe_name": recipe.get("recipe_name", ""),
+            }
+            for recipe in recipes
+        ]
+    )
+    elapsed_time = time.time() - start_time
+    recipes_per_second = len(recipes) / elapsed_time if elapsed_time > 0 else 0.0
+    logger.info(
+        f"Allergen batch of {len(recipes)} recipes completed in {elapsed_time:.2f} seconds "
+        f"({recipes_per_second:.1f} recipes/sec)"
+    )
+
+    return (
+        jsonify(
+            {
+                "message": "Allergens successfully processed",
+                "data": allergens,
+                "recipes_per_second": recipes_per_second,
+            }
+        ),
+        200,
+    )
+
+
+@app.route("/allergens/cache-stats", methods=["GET"])
+def get_allergen_cache_stats():
+    stats = GetCacheStats()
+    logger.info(f"Ingredient cache stats: {stats}")
+    return jsonify(stats), 200
+
+
+@app.route("/classify-text/cache-stats", methods=["GET"])
+def get_classify_cache_stats():
+    stats = classify_cache.stats()
+    logger.info(f"Classification cache stats: {stats}")
+    return jsonify(stats), 200
+
+
 if __name__ == "__main__":
     logger.info("Starting Flask application")
     app.run(debug=True, host="0.0.0.0", port=5001)
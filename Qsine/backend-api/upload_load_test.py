@@ -0,0 +1,77 @@
+import argparse
+import concurrent.futures
+import io
+import os
+import time
+
+import requests
+from PIL import Image
+
+
+# Snapshot of every file under the upload folders the server used to write to
+def temp_files(folders):
+    files = {}
+    for folder in folders:
+        for root, _, names in os.walk(folder):
+            for name in names:
+                path = os.path.join(root, name)
+                files[path] = os.stat(path).st_mtime_ns
+    return files
+
+
+def make_image(size):
+    image = Image.new("RGB", (size, size), (200, 120, 40))
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=95)
+    return buffer.getvalue()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Concurrent upload test for /classify-image and /upload-text-image"
+    )
+    parser.add_argument("--url", default="http://localhost:5001")
+    parser.add_argument("--endpoint", default="/classify-image")
+    parser.add_argument("--image", default=None, help="defaults to a generated JPEG")
+    parser.add_argument("--size", type=int, default=1024)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    if args.image:
+        with open(args.image, "rb") as file:
+            payload = file.read()
+    else:
+        payload = make_image(args.size)
+
+    # Run from backend-api, the folder the server used to save uploads to
+    folders = ["temp"]
+    before = temp_files(folders)
+
+    def upload(_):
+        start_time = time.perf_counter()
+        response = requests.post(
+            args.url + args.endpoint,
+            files={"image": ("upload.jpg", payload, "image/jpeg")},
+        )
+        return time.perf_counter() - start_time, response.status_code
+
+    start_time = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(upload, range(args.requests)))
+    total = time.perf_counter() - start_time
+
+    latencies = sorted(latency for latency, _ in results)
+    statuses = {}
+    for _, status in results:
+        statuses[status] = statuses.get(status, 0) + 1
+
+    after = temp_files(folders)
+    written = [path for path, mtime in after.items() if before.get(path) != mtime]
+
+    print(f"{len(payload)} byte uploads, {args.concurrency} concurrent clients")
+    print(f"Status codes: {statuses}")
+    print(f"Throughput: {len(results) / total:.1f} req/s")
+    print(f"p50 latency: {latencies[len(latencies) // 2] * 1000:.1f} ms")
+    print(f"p99 latency: {latencies[int(len(latencies) * 0.99)] * 1000:.1f} ms")
+    print(f"Temp files written: {len(written)}")
@@ -0,0 +1,66 @@
+import argparse
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+from classify import infer_image, infer_images, load_model
+from micro_batcher import MicroBatcher
+
+
+# Fire `requests` classifications from `concurrency` threads and measure
+# per-request latency and overall throughput
+def run_load(classify, image, concurrency, requests):
+    latencies = []
+    lock = threading.Lock()
+    per_thread = requests // concurrency
+
+    def client():
+        for _ in range(per_thread):
+            start_time = time.perf_counter()
+            classify(image)
+            elapsed = time.perf_counter() - start_time
+            with lock:
+                latencies.append(elapsed)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    start_time = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    total = time.perf_counter() - start_time
+
+    latencies = np.array(latencies) * 1000
+    return len(latencies) / total, np.percentile(latencies, 50), np.percentile(
+        latencies, 99
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-batching load test")
+    parser.add_argument("--image", default=None, help="defaults to a blank image")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=320)
+    parser.add_argument("--windows", default="0,2,5,10,20", help="window sizes in ms")
+    parser.add_argument("--batch-sizes", default="1,4,8,16")
+    args = parser.parse_args()
+
+    image = Image.open(args.image) if args.image else Image.new("RGB", (224, 224))
+    load_model()
+
+    print(f"{'mode':<24}{'img/s':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    throughput, p50, p99 = run_load(
+        infer_image, image, args.concurrency, args.requests
+    )
+    print(f"{'unbatched':<24}{throughput:>10.1f}{p50:>10.1f}{p99:>10.1f}")
+
+    for window in [float(value) for value in args.windows.split(",")]:
+        for batch_size in [int(value) for value in args.batch_sizes.split(",")]:
+            batcher = MicroBatcher(infer_images, batch_size, window)
+            throughput, p50, p99 = run_load(
+                batcher.infer, image, args.concurrency, args.requests
+            )
+            mode = f"window={window:g}ms batch={batch_size}"
+            print(f"{mode:<24}{throughput:>10.1f}{p50:>10.1f}{p99:>10.1f}")
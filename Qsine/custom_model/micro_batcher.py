@@ -0,0 +1,113 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from classify import infer_images, to_image
+
+
+class MicroBatcher:
+    """Coalesce concurrent single-image requests into batched forward passes
+
+    The first request opens a window of max_wait_ms, every request arriving
+    before it closes (up to max_batch_size) is run in the same batch. Images
+    are decoded by prepare on the submitting thread, so an undecodable one
+    fails its own request and never reaches a batch.
+    """
+
+    def __init__(
+        self,
+        infer_batch=infer_images,
+        max_batch_size=8,
+        max_wait_ms=5.0,
+        prepare=to_image,
+    ):
+        self.infer_batch = infer_batch
+        self.prepare = prepare
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.requests = queue.Queue()
+        self.batches = 0
+        self.images = 0
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    def submit(self, image):
+        future = Future()
+        try:
+            image = self.prepare(image)
+        except Exception as e:
+            future.set_exception(e)
+            return future
+        self.requests.put((image, future))
+        return future
+
+    def infer(self, image, timeout=None):
+        """Top-5 (confidences, classes) for one image, like infer_image"""
+        return self.submit(image).result(timeout)
+
+    def _collect(self):
+        batch = [self.requests.get()]
+        deadline = time.perf_counter() + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            images = [image for image, _ in batch]
+            try:
+                results = self.infer_batch(images)
+            except Exception as e:
+                if len(batch) == 1:
+                    batch[0][1].set_exception(e)
+                else:
+                    # Rerun one by one, so only the image at fault fails
+                    self._run_each(batch)
+                continue
+            self.batches += 1
+            self.images += len(batch)
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+    def _run_each(self, batch):
+        for image, future in batch:
+            try:
+                result = self.infer_batch([image])[0]
+            except Exception as e:
+                future.set_exception(e)
+                continue
+            self.batches += 1
+            self.images += 1
+            future.set_result(result)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "images": self.images,
+            "mean_batch_size": self.images / self.batches if self.batches else 0.0,
+        }
+
+
+_batcher = None
+_batcher_lock = threading.Lock()
+
+
+def get_batcher():
+    # Window and batch size are tunable per deployment
+    global _batcher
+    with _batcher_lock:
+        if _batcher is None:
+            _batcher = MicroBatcher(
+                max_batch_size=int(os.environ.get("CLASSIFY_MAX_BATCH", 8)),
+                max_wait_ms=float(os.environ.get("CLASSIFY_BATCH_WINDOW_MS", 5)),
+            )
+        return _batcher
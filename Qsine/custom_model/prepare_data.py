@@ -1,15 +1,18 @@
-import json
 import os
 import shutil
 from dotenv import load_dotenv
 from pymongo import MongoClient
 import requests
-import zlib
-import base64
 import re
+import sys
 import time
+from os.path import abspath, dirname, join
 from requests.exceptions import ConnectionError, Timeout
 
+sys.path.append(join(dirname(dirname(abspath(__file__))), "data"))
+
+from recipe_codec import load_codec
+
 load_dotenv()
 
 
@@ -31,11 +34,6 @@ def connect_to_mongodb():
     return db
 
 
-def decompress_data(compressed_data):
-    decompressed = zlib.decompress(base64.b64decode(compressed_data))
-    return json.loads(decompressed.decode("utf-8"))
-
-
 if __name__ == "__main__":
     # Connect to MongoDB
     db = connect_to_mongodb()
@@ -48,15 +46,17 @@ if __name__ == "__main__":
 
     unique_paths = set()
 
+    codec = load_codec(db)
+
     while True:
-        data = list(collection.find({}))
+        data = list(collection.find({"data": {"$exists": True}}, {"data": 1}))
 
         running_count = 0
 
-        for recipe_idx, recipe in enumerate(data):
-            # Decompress the recipe data
-            compressed_data = recipe["data"]
-            recipe = decompress_data(compressed_data)
+        # Decompress the recipe data in one pass
+        recipes = codec.decode_many([document["data"] for document in data], threads=-1)
+
+        for recipe_idx, recipe in enumerate(recipes):
 
             # Create a directory based on the recipe name
             # recipe_name = recipe.get("name", "unknown").replace(" ", "_")
@@ -0,0 +1,91 @@
+import argparse
+import base64
+import json
+import os
+import random
+import time
+import zlib
+
+from benchmark_recipe_store import make_recipes
+from recipe_codec import RecipeCodec, train_dictionary
+from recipe_store import RECIPES_PATH
+
+
+# What main.py stored before
+def encode_legacy(recipe):
+    return base64.b64encode(zlib.compress(json.dumps(recipe).encode("utf-8"))).decode(
+        "utf-8"
+    )
+
+
+def per_second(func, values, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        func(values)
+        best = min(best, time.perf_counter() - start_time)
+    return len(values) / best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Recipe storage size and decode throughput per format"
+    )
+    parser.add_argument(
+        "--json",
+        default=RECIPES_PATH,
+        help="recipes to measure, synthetic ones if missing",
+    )
+    parser.add_argument("--recipes", type=int, default=20000)
+    parser.add_argument(
+        "--train", type=int, default=5000, help="recipes the dictionary is trained on"
+    )
+    parser.add_argument("--threads", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    if os.path.exists(args.json):
+        with open(args.json, "r", encoding="utf8") as file:
+            recipes = json.load(file)
+        random.Random(0).shuffle(recipes)
+    else:
+        print(f"{args.json} not found, using synthetic recipes")
+        recipes = make_recipes(args.recipes + args.train)
+    # Measured on recipes the dictionary wasn't trained on
+    train, recipes = recipes[: args.train], recipes[args.train :][: args.recipes]
+    raw = sum(len(json.dumps(recipe).encode("utf-8")) for recipe in recipes) / len(
+        recipes
+    )
+    print(
+        f"{len(recipes)} recipes, {raw:.0f} bytes of JSON each, dictionary trained on {len(train)}"
+    )
+
+    start_time = time.perf_counter()
+    with_dictionary = RecipeCodec([train_dictionary(train)])
+    print(f"Trained the dictionary in {time.perf_counter() - start_time:.1f}s")
+
+    formats = [
+        ("base64 zlib", encode_legacy, with_dictionary),
+        ("zstd", RecipeCodec().encode, RecipeCodec()),
+        ("zstd dict", with_dictionary.encode, with_dictionary),
+    ]
+    print(
+        f"{'format':>12}{'bytes':>8}{'of JSON':>9}{'encode/s':>11}{'decode/s':>11}{'bulk/s':>11}{'bulk x' + str(args.threads) + '/s':>13}"
+    )
+    for name, encode, codec in formats:
+        stored = [encode(recipe) for recipe in recipes]
+        assert codec.decode_many(stored) == [codec.decode(data) for data in stored]
+        size = sum(map(len, stored)) / len(stored)
+        encoded = per_second(
+            lambda values: [encode(recipe) for recipe in values], recipes
+        )
+        decoded = per_second(
+            lambda values: [codec.decode(data) for data in values], stored
+        )
+        bulk = per_second(codec.decode_many, stored)
+        threaded = per_second(
+            lambda values: codec.decode_many(values, threads=args.threads), stored
+        )
+        print(
+            f"{name:>12}{size:>8.0f}{size / raw:>9.1%}{encoded:>11,.0f}"
+            f"{decoded:>11,.0f}{bulk:>11,.0f}{threaded:>13,.0f}"
+        )
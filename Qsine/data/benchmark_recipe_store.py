@@ -0,0 +1,86 @@
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+from recipe_store import RecipeStore
+
+
+# Synthetic recipes shaped like all_recipes.json
+def make_recipes(count):
+    words = ["chicken", "garlic", "butter", "flour", "sugar", "salt", "pepper", "milk"]
+    recipes = []
+    for i in range(count):
+        recipes.append(
+            {
+                "key": f"{i:032x}",
+                "recipe_name": f"Recipe {i}",
+                "ingredients": random.sample(words, 5),
+                "steps": [" ".join(random.choices(words, k=20)) for _ in range(4)],
+                "breadcrumbs": ["Recipes", "Dinner", "Chicken"],
+                "url": f"https://www.allrecipes.com/recipe/{i}/",
+            }
+        )
+    return recipes
+
+
+# What /get-recipe did before: load the whole file and scan for the key
+def scan_lookup(json_path, key):
+    with open(json_path, "r", encoding="utf8") as file:
+        for recipe in json.load(file):
+            if recipe["key"] == key:
+                return recipe
+    return None
+
+
+def timed(func, repeat):
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start_time) / repeat * 1000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recipe store lookup benchmark")
+    parser.add_argument("--scales", default="10000,100000,1000000")
+    parser.add_argument("--lookups", type=int, default=1000)
+    parser.add_argument(
+        "--scan-limit",
+        type=int,
+        default=100000,
+        help="skip the json.load baseline above this many recipes",
+    )
+    args = parser.parse_args()
+
+    print(
+        f"{'recipes':>10}{'build s':>10}{'open ms':>10}"
+        f"{'get ms':>10}{'get10 ms':>10}{'scan ms':>10}"
+    )
+    for scale in [int(value) for value in args.scales.split(",")]:
+        with tempfile.TemporaryDirectory() as folder:
+            json_path = os.path.join(folder, "all_recipes.json")
+            with open(json_path, "w", encoding="utf8") as file:
+                json.dump(make_recipes(scale), file)
+            keys = [f"{random.randrange(scale):032x}" for _ in range(args.lookups)]
+
+            start_time = time.perf_counter()
+            RecipeStore(json_path)
+            build = time.perf_counter() - start_time
+
+            start_time = time.perf_counter()
+            store = RecipeStore(json_path)
+            opened = (time.perf_counter() - start_time) * 1000
+
+            keys_iter = iter(keys * 10)
+            get = timed(lambda: store.get(next(keys_iter)), args.lookups)
+            get_many = timed(lambda: store.get_many(random.sample(keys, 10)), 100)
+
+            scan = float("nan")
+            if scale <= args.scan_limit:
+                scan = timed(lambda: scan_lookup(json_path, keys[0]), 3)
+            print(
+                f"{scale:>10}{build:>10.2f}{opened:>10.1f}"
+                f"{get:>10.3f}{get_many:>10.3f}{scan:>10.1f}"
+            )
@@ -2,6 +2,95 @@ import json
 from collections import Counter
 import numpy as np
 import os
+import pickle
+import sys
+import tempfile
+import threading
+
+
+DATA_PATH = os.path.join(os.path.dirname(__file__), "data.json")
+INDEX_PATH = os.path.join(os.path.dirname(__file__), "category_index.pkl")
+
+# Loaded index and the data.json mtime it was built from
+_index = None
+_index_mtime = None
+_index_lock = threading.Lock()
+
+
+def normalize_category(category):
+    return category.lower().replace(" ", "_")
+
+
+def build_category_index(data_path=DATA_PATH, index_path=INDEX_PATH):
+    """
+    Precompute, for every category (second to last breadcrumb), its
+    ingredients sorted by frequency and their counts, and pickle the result.
+
+    Returns:
+        dict: category -> (ingredients appearing more than once, Counter)
+    """
+    with open(data_path, "r") as f:
+        recipes = json.load(f)
+
+    counts = {}
+    for recipe in recipes:
+        if len(recipe["breadcrumbs"]) < 2:
+            continue
+        category = normalize_category(recipe["breadcrumbs"][-2])
+        counts.setdefault(category, Counter()).update(recipe["ingredients"])
+
+    index = {}
+    for category, ingredient_counts in counts.items():
+        # Sort ingredients by frequency (descending), filtering out
+        # ingredients that appear only once
+        sorted_ingredients = sorted(
+            ingredient_counts.items(), key=lambda x: x[1], reverse=True
+        )
+        index[category] = (
+            [ingredient for ingredient, count in sorted_ingredients if count > 1],
+            ingredient_counts,
+        )
+
+    # Write aside and rename so readers never see a half written index. The
+    # temp file is this build's own, concurrent rebuilds don't share it
+    fd, temp_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(index_path)),
+        prefix=os.path.basename(index_path) + ".",
+        suffix=".tmp",
+    )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, index_path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return index
+
+
+def load_category_index(data_path=DATA_PATH, index_path=INDEX_PATH):
+    """Open the index once, rebuilding it when data.json is newer"""
+    global _index, _index_mtime
+
+    data_mtime = os.stat(data_path).st_mtime if os.path.exists(data_path) else None
+    if _index is not None and data_mtime == _index_mtime:
+        return _index
+
+    with _index_lock:
+        if _index is not None and data_mtime == _index_mtime:
+            return _index
+        if os.path.exists(index_path) and (
+            data_mtime is None or os.stat(index_path).st_mtime >= data_mtime
+        ):
+            with open(index_path, "rb") as f:
+                index = pickle.load(f)
+        elif data_mtime is not None:
+            index = build_category_index(data_path, index_path)
+        else:
+            raise FileNotFoundError(data_path)
+        _index, _index_mtime = index, data_mtime
+    return _index
 
 
 def get_ingredients_by_category(category):
@@ -14,42 +103,11 @@ def get_ingredients_by_category(category):
 
     Returns:
         tuple: (list of all ingredients sorted by frequency, Counter object with ingredient frequencies)
+        Both come from the shared index and must not be modified.
     """
     try:
-        # Load the data from the JSON file
-        file_path = os.path.join(os.path.dirname(__file__), "data.json")
-        with open(file_path, "r") as f:
-            recipes = json.load(f)
-
-        category = category.lower().replace(" ", "_")
-
-        # Filter recipes by the specified category (second to last breadcrumb)
-        category_recipes = [
-            recipe
-            for recipe in recipes
-            if len(recipe["breadcrumbs"]) >= 2
-            and recipe["breadcrumbs"][-2].lower().replace(" ", "_") == category
-        ]
-
-        # Extract all ingredients from the filtered recipes
-        all_ingredients = []
-        for recipe in category_recipes:
-            all_ingredients.extend(recipe["ingredients"])
-
-        # Count frequencies
-        ingredient_counts = Counter(all_ingredients)
-
-        # Sort ingredients by frequency (descending)
-        sorted_ingredients = sorted(
-            ingredient_counts.items(), key=lambda x: x[1], reverse=True
-        )
-
-        # Filter out ingredients that appear only once
-        filtered_ingredients = [
-            ingredient for ingredient, count in sorted_ingredients if count > 1
-        ]
-
-        return filtered_ingredients, ingredient_counts
+        index = load_category_index()
+        return index.get(normalize_category(category), ([], Counter()))
 
     except FileNotFoundError:
         print(f"Error: data.json file not found")
@@ -63,6 +121,11 @@ def get_ingredients_by_category(category):
 
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "build":
+        index = build_category_index()
+        print(f"Indexed {len(index)} categories into {INDEX_PATH}")
+        sys.exit(0)
+
     category = "cookies"
     ingredients, ingredient_counts = get_ingredients_by_category(category)
     print(f"\nIngredients for {category}:")
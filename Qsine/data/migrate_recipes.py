@@ -0,0 +1,118 @@
+import argparse
+import time
+
+from pymongo import UpdateOne
+
+from recipe_codec import (
+    DICT_PATH,
+    DICT_SIZE,
+    load_codec,
+    save_dictionary,
+    train_dictionary,
+)
+from save_data_locally import connect_to_mongodb
+
+# Rewrites recipes.data from base64(zlib(json)) strings, or binary written
+# with an older dictionary, to zstd(BSON) with the current dictionary
+
+
+def sample_recipes(collection, codec, count):
+    documents = list(
+        collection.aggregate(
+            [
+                {"$match": {"data": {"$exists": True}}},
+                {"$sample": {"size": count}},
+                {"$project": {"data": 1}},
+            ]
+        )
+    )
+    return codec.decode_many([document["data"] for document in documents])
+
+
+def migrate(collection, codec, batch_size, dry_run=False):
+    """Re-encode every recipe not in the current format, returns (migrated, bytes before, bytes after)"""
+    checked = migrated = before = after = 0
+    last_id = None
+    while True:
+        # Recipes only, not the scraper_state document
+        query = {"data": {"$exists": True}}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        documents = list(
+            collection.find(query, {"data": 1}).sort("_id", 1).limit(batch_size)
+        )
+        if not documents:
+            break
+        last_id = documents[-1]["_id"]
+
+        stale = [
+            document for document in documents if not codec.current(document["data"])
+        ]
+        recipes = codec.decode_many([document["data"] for document in stale])
+        operations = []
+        for document, recipe in zip(stale, recipes):
+            data = codec.encode(recipe)
+            before += len(document["data"])
+            after += len(data)
+            # Only if the scraper didn't rewrite the recipe in the meantime
+            operations.append(
+                UpdateOne(
+                    {"_id": document["_id"], "data": document["data"]},
+                    {"$set": {"data": data}},
+                )
+            )
+        if operations and not dry_run:
+            collection.bulk_write(operations, ordered=False)
+        checked += len(documents)
+        migrated += len(operations)
+        print(
+            f"Checked {checked} recipes, migrated {migrated}, {before} -> {after} bytes"
+        )
+    return migrated, before, after
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Migrate recipes to the zstd BSON format"
+    )
+    parser.add_argument(
+        "--train", action="store_true", help="train a new dictionary first"
+    )
+    parser.add_argument(
+        "--samples", type=int, default=20000, help="recipes to train the dictionary on"
+    )
+    parser.add_argument("--dict-size", type=int, default=DICT_SIZE)
+    parser.add_argument(
+        "--dict-path", default=DICT_PATH, help="local copy of the dictionary"
+    )
+    parser.add_argument("--batch", type=int, default=1000)
+    parser.add_argument(
+        "--dry-run", action="store_true", help="report sizes without writing"
+    )
+    args = parser.parse_args()
+
+    db = connect_to_mongodb()
+    collection = db["recipes"]
+    codec = load_codec(db, args.dict_path)
+
+    if args.train or codec.dictionary is None:
+        start_time = time.time()
+        recipes = sample_recipes(collection, codec, args.samples)
+        dictionary = train_dictionary(recipes, args.dict_size)
+        print(
+            f"Trained dictionary {dictionary.dict_id()} on {len(recipes)} recipes in {time.time() - start_time:.1f}s"
+        )
+        if not args.dry_run:
+            # Stored before any recipe uses it, so readers can always find it
+            save_dictionary(dictionary, db, args.dict_path)
+        codec.add_dictionary(dictionary)
+    elif args.dict_path:
+        # Readers of exports need a local copy of the current dictionary
+        save_dictionary(codec.dictionary, path=args.dict_path)
+
+    start_time = time.time()
+    migrated, before, after = migrate(collection, codec, args.batch, args.dry_run)
+    print(
+        f"{'Would migrate' if args.dry_run else 'Migrated'} {migrated} recipes in {time.time() - start_time:.1f}s, "
+        f"{before / max(migrated, 1):.0f} -> {after / max(migrated, 1):.0f} bytes per recipe"
+    )
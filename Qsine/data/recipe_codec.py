@@ -0,0 +1,196 @@
+import base64
+import json
+import os
+import threading
+import time
+import zlib
+
+import bson
+import zstandard
+from bson import Binary
+
+# First byte of every stored recipe. Legacy recipes are base64 strings and
+# carry no version, anything stored as binary starts with one
+FORMAT_ZSTD_BSON = 1
+
+DICT_PATH = os.environ.get(
+    "RECIPE_DICT_PATH", os.path.join(os.path.dirname(__file__), "recipe_dict.zstd")
+)
+DICT_SIZE = 112 * 1024
+LEVEL = 9
+
+
+def train_dictionary(recipes, size=DICT_SIZE, level=LEVEL):
+    """zstd dictionary trained on the BSON of a sample of recipes"""
+    samples = [bson.encode(recipe) for recipe in recipes]
+    return zstandard.train_dictionary(size, samples, level=level)
+
+
+def decode_legacy(data):
+    """base64(zlib(json)), the format recipes were first stored in"""
+    return json.loads(zlib.decompress(base64.b64decode(data)).decode("utf-8"))
+
+
+class RecipeCodec:
+    """Encodes recipes as a version byte followed by zstd(BSON)
+
+    Frames name the dictionary they were compressed with, so recipes written
+    with an older dictionary stay readable once a newer one is trained. The
+    newest dictionary is the one new recipes are written with. With a db,
+    dictionaries another process trained are fetched from
+    recipe_dictionaries the first time a recipe needs them.
+    """
+
+    def __init__(self, dictionaries=(), db=None, level=LEVEL):
+        self.db = db
+        self.level = level
+        self.lock = threading.Lock()
+        self.dictionaries = {}
+        self.dictionary = None
+        for dictionary in dictionaries:
+            self.add_dictionary(dictionary)
+        # Compression contexts aren't thread safe, one per thread
+        self.local = threading.local()
+
+    def add_dictionary(self, dictionary):
+        if not isinstance(dictionary, zstandard.ZstdCompressionDict):
+            dictionary = zstandard.ZstdCompressionDict(bytes(dictionary))
+        with self.lock:
+            self.dictionaries[dictionary.dict_id()] = dictionary
+            if (
+                self.dictionary is None
+                or dictionary.dict_id() != self.dictionary.dict_id()
+            ):
+                self.dictionary = dictionary
+                # Threads pick up the new dictionary with fresh contexts
+                self.local = threading.local()
+        return dictionary
+
+    def dict_id(self):
+        return self.dictionary.dict_id() if self.dictionary is not None else 0
+
+    def compressor(self):
+        local = self.local
+        if not hasattr(local, "compressor"):
+            local.compressor = zstandard.ZstdCompressor(
+                level=self.level, dict_data=self.dictionary
+            )
+        return local.compressor
+
+    def decompressor(self, dict_id):
+        local = self.local
+        if not hasattr(local, "decompressors"):
+            local.decompressors = {}
+        if dict_id not in local.decompressors:
+            local.decompressors[dict_id] = zstandard.ZstdDecompressor(
+                dict_data=self.lookup(dict_id) if dict_id else None
+            )
+        return local.decompressors[dict_id]
+
+    def lookup(self, dict_id):
+        if dict_id not in self.dictionaries and self.db is not None:
+            document = self.db.recipe_dictionaries.find_one({"_id": dict_id})
+            if document is not None:
+                with self.lock:
+                    self.dictionaries[dict_id] = zstandard.ZstdCompressionDict(
+                        bytes(document["data"])
+                    )
+        if dict_id not in self.dictionaries:
+            raise ValueError(f"Recipe compressed with unknown dictionary {dict_id}")
+        return self.dictionaries[dict_id]
+
+    def encode(self, recipe):
+        frame = self.compressor().compress(bson.encode(recipe))
+        return Binary(bytes([FORMAT_ZSTD_BSON]) + frame)
+
+    def frame(self, data):
+        # The version byte, then the zstd frame
+        if not data or data[0] != FORMAT_ZSTD_BSON:
+            raise ValueError(f"Unknown recipe format {data[:1]!r}")
+        frame = memoryview(data)[1:]
+        return frame, zstandard.get_frame_parameters(frame).dict_id
+
+    def decode(self, data):
+        """Recipe from either format"""
+        if isinstance(data, str):
+            return decode_legacy(data)
+        frame, dict_id = self.frame(data)
+        return bson.decode(self.decompressor(dict_id).decompress(frame))
+
+    def current(self, data):
+        """Whether data is already in the format encode writes"""
+        return not isinstance(data, str) and self.frame(data)[1] == self.dict_id()
+
+    def decode_many(self, values, threads=0):
+        """Recipes for many stored values, in order
+
+        Frames sharing a dictionary are decompressed in one call, on several
+        threads if asked, and their BSON decoded in one pass.
+        """
+        recipes = [None] * len(values)
+        groups = {}
+        for i, data in enumerate(values):
+            if isinstance(data, str):
+                recipes[i] = decode_legacy(data)
+            else:
+                frame, dict_id = self.frame(data)
+                groups.setdefault(dict_id, ([], []))
+                groups[dict_id][0].append(i)
+                groups[dict_id][1].append(frame)
+        for dict_id, (positions, frames) in groups.items():
+            buffers = self.decompressor(dict_id).multi_decompress_to_buffer(
+                frames, threads=threads
+            )
+            data = b"".join(segment.tobytes() for segment in buffers)
+            for i, recipe in zip(positions, bson.decode_all(data)):
+                recipes[i] = recipe
+        return recipes
+
+
+def save_dictionary(dictionary, db=None, path=DICT_PATH):
+    """Store a dictionary where load_codec finds it"""
+    data = dictionary.as_bytes()
+    if db is not None:
+        db.recipe_dictionaries.replace_one(
+            {"_id": dictionary.dict_id()},
+            {
+                "_id": dictionary.dict_id(),
+                "data": Binary(data),
+                "created_at": time.time(),
+            },
+            upsert=True,
+        )
+    if path:
+        with open(path + ".tmp", "wb") as file:
+            file.write(data)
+        os.replace(path + ".tmp", path)
+
+
+def load_codec(db=None, path=DICT_PATH):
+    """Codec writing with the newest dictionary in the db, or else the one at path"""
+    dictionaries = []
+    if path and os.path.exists(path):
+        with open(path, "rb") as file:
+            dictionaries.append(file.read())
+    if db is not None:
+        newest = db.recipe_dictionaries.find_one(sort=[("created_at", -1)])
+        if newest is not None:
+            dictionaries.append(newest["data"])
+    return RecipeCodec(dictionaries, db=db)
+
+
+_codec = None
+_codec_lock = threading.Lock()
+
+
+def get_codec():
+    """Codec shared by readers that only have the local dictionary"""
+    global _codec
+    with _codec_lock:
+        if _codec is None:
+            _codec = load_codec()
+        return _codec
+
+
+def decode_recipe(data):
+    return get_codec().decode(data)
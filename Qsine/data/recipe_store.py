@@ -0,0 +1,170 @@
+import json
+import mmap
+import os
+import pickle
+import struct
+import sys
+import tempfile
+import threading
+
+
+RECIPES_PATH = os.path.join(os.path.dirname(__file__), "all_recipes.json")
+
+# The store ends in the offset of its pickled index and this marker
+STORE_MAGIC = b"QSRSTOR1"
+FOOTER = struct.Struct("<Q8s")
+
+
+def build_recipe_store(json_path, store_path):
+    """
+    Convert a JSON array of recipes into JSON lines followed by a pickled
+    key -> (offset, length) index, in one file.
+
+    Returns:
+        dict: the key -> (offset, length) index
+    """
+    with open(json_path, "r", encoding="utf8") as f:
+        recipes = json.load(f)
+
+    index = {}
+    # A temp file of our own, so concurrent rebuilds don't write into each
+    # other, published with one rename so readers see all of it or none
+    fd, temp_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(store_path)),
+        prefix=os.path.basename(store_path) + ".",
+        suffix=".tmp",
+    )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            offset = 0
+            for recipe in recipes:
+                line = json.dumps(recipe, ensure_ascii=False).encode("utf8")
+                index[recipe["key"]] = (offset, len(line))
+                f.write(line + b"\n")
+                offset += len(line) + 1
+            pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.write(FOOTER.pack(offset, STORE_MAGIC))
+        # mkstemp creates it private, the store is readable like the export
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, store_path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return index
+
+
+def read_index(data):
+    """Index stored at the end of a store, None for a file in another format"""
+    if len(data) < FOOTER.size:
+        return None
+    index_offset, magic = FOOTER.unpack(data[-FOOTER.size :])
+    if magic != STORE_MAGIC:
+        return None
+    return pickle.loads(data[index_offset : -FOOTER.size])
+
+
+class RecipeStore:
+    """Random access to recipes by key, reading only the bytes of each recipe"""
+
+    def __init__(self, json_path=RECIPES_PATH, store_path=None):
+        self.json_path = json_path
+        self.store_path = store_path or os.path.splitext(json_path)[0] + ".jsonl"
+        self.lock = threading.Lock()
+        self.json_mtime = None
+        self.file = None
+        # Data and index are swapped together, readers take both at once
+        self.snapshot = (b"", {})
+        self.refresh()
+
+    def _json_mtime(self):
+        if os.path.exists(self.json_path):
+            return os.stat(self.json_path).st_mtime
+        return None
+
+    def _open(self):
+        if not os.path.exists(self.store_path):
+            return None, None, None
+        file = open(self.store_path, "rb")
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        index = read_index(data)
+        if index is None:
+            data.close()
+            file.close()
+            return None, None, None
+        return file, data, index
+
+    def refresh(self):
+        # Rebuild the store when the JSON export is newer than it
+        json_mtime = self._json_mtime()
+        if self.file is not None and json_mtime == self.json_mtime:
+            return
+        with self.lock:
+            if self.file is not None and json_mtime == self.json_mtime:
+                return
+            file, data, index = None, None, None
+            if not (json_mtime is not None and os.path.exists(self.store_path)
+                    and os.stat(self.store_path).st_mtime < json_mtime):
+                file, data, index = self._open()
+            if file is None:
+                if json_mtime is None:
+                    raise FileNotFoundError(self.json_path)
+                build_recipe_store(self.json_path, self.store_path)
+                file, data, index = self._open()
+
+            old_file = self.file
+            self.file, self.snapshot = file, (data, index)
+            self.json_mtime = json_mtime
+            # Requests still reading the old mapping keep it alive until done
+            if old_file is not None:
+                old_file.close()
+
+    def get(self, key):
+        self.refresh()
+        data, index = self.snapshot
+        entry = index.get(key)
+        if entry is None:
+            return None
+        offset, length = entry
+        return json.loads(data[offset : offset + length])
+
+    def get_many(self, keys):
+        """Recipes for the keys that exist, in the order requested"""
+        self.refresh()
+        data, index = self.snapshot
+        recipes = []
+        # Read in file order to keep the page cache access sequential
+        entries = sorted((index[key], key) for key in set(keys) if key in index)
+        found = {
+            key: json.loads(data[offset : offset + length])
+            for (offset, length), key in entries
+        }
+        for key in keys:
+            if key in found:
+                recipes.append(found[key])
+        return recipes
+
+    def __len__(self):
+        return len(self.snapshot[1])
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_recipe_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = RecipeStore()
+        return _store
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "build":
+        store_path = os.path.splitext(RECIPES_PATH)[0] + ".jsonl"
+        index = build_recipe_store(RECIPES_PATH, store_path)
+        print(f"Stored {len(index)} recipes in {store_path}")
+    else:
+        store = get_recipe_store()
+        for key in sys.argv[1:]:
+            print(json.dumps(store.get(key), indent=2))
@@ -2,8 +2,8 @@ import json
 import os
 from dotenv import load_dotenv
 from pymongo import MongoClient
-import zlib
-import base64
+
+from recipe_codec import get_codec, load_codec
 
 load_dotenv()
 
@@ -40,9 +40,8 @@ def connect_to_mongodb():
     return db
 
 
-def decompress_data(compressed_data):
-    decompressed = zlib.decompress(base64.b64decode(compressed_data))
-    return json.loads(decompressed.decode("utf-8"))
+def decompress_data(compressed_data, codec=None):
+    return (codec or get_codec()).decode(compressed_data)
 
 
 if __name__ == "__main__":
@@ -56,13 +55,13 @@ if __name__ == "__main__":
 
     all_data = []
 
-    data = list(collection.find({}))
+    data = list(collection.find({"data": {"$exists": True}}, {"data": 1}))
 
-    for recipe_idx, recipe in enumerate(data):
-        # Decompress the recipe data
-        compressed_data = recipe["data"]
-        recipe = decompress_data(compressed_data)
+    # Decompress the recipe data in one pass
+    codec = load_codec(db)
+    recipes = codec.decode_many([document["data"] for document in data], threads=-1)
 
+    for recipe_idx, recipe in enumerate(recipes):
         recipe = sanitize_recipe(recipe)
 
         print(f"Processing recipe {recipe_idx + 1}/{len(data)}")
@@ -0,0 +1,68 @@
+import argparse
+import random
+import time
+from collections import Counter
+from os.path import dirname, join
+
+import numpy as np
+
+from reranker import BM25
+
+
+# The previous get_top_n: score every document, rebuilding Counter(doc) each time
+def ExhaustiveTopN(bm25, corpus, query, n):
+    query_terms = bm25.tokenize(query)
+    scores = []
+    for index, doc in enumerate(corpus):
+        score = 0.0
+        freqs = Counter(doc)
+        dl = len(doc)
+        for term in query_terms:
+            if term not in freqs:
+                continue
+            f = freqs[term]
+            idf = bm25.idf(term)
+            denom = f + bm25.k1 * (1 - bm25.b + bm25.b * dl / bm25.avgdl)
+            score += idf * ((f * (bm25.k1 + 1)) / denom)
+        scores.append((index, score))
+    return sorted(scores, key=lambda x: x[1], reverse=True)[:n]
+
+
+def Timed(func, queries):
+    timings = []
+    results = []
+    for query in queries:
+        start_time = time.perf_counter()
+        results.append(func(query))
+        timings.append(time.perf_counter() - start_time)
+    return np.array(timings) * 1000, results
+
+
+if __name__ == "__main__":
+    project_root = dirname(dirname(__file__))
+    parser = argparse.ArgumentParser(description="BM25 per-query latency")
+    parser.add_argument("--passages", default=join(project_root, "data", "all_recipes.json"))
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--n", type=int, default=50)
+    args = parser.parse_args()
+
+    bm25 = BM25(args.passages)
+    corpus = [bm25.tokenize(text) for text in bm25.original_texts]
+
+    # Recipe names plus ingredient lists, like OCR'd menus and labels
+    random.seed(0)
+    queries = [
+        entry["recipe_name"] + " " + " ".join(entry["ingredients"])
+        for entry in random.sample(bm25.data, min(args.queries, bm25.N))
+    ]
+
+    old, old_results = Timed(lambda q: ExhaustiveTopN(bm25, corpus, q, args.n), queries)
+    new, new_results = Timed(lambda q: bm25.top_n_ids(q, args.n), queries)
+    same = all(
+        [i for i, _ in a] == [i for i, _ in b] for a, b in zip(old_results, new_results)
+    )
+
+    print(f"{bm25.N} documents, {len(bm25.vocab)} terms, {len(queries)} queries")
+    print(f"exhaustive  p50 {np.median(old):9.2f} ms  mean {old.mean():9.2f} ms")
+    print(f"inverted    p50 {np.median(new):9.2f} ms  mean {new.mean():9.2f} ms")
+    print(f"Identical rankings: {same}")
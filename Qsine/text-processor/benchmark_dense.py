@@ -0,0 +1,86 @@
+import argparse
+import json
+import random
+import time
+
+import numpy as np
+
+from dense_index import DenseIndex, LoadEncoder, dense_index_path
+from reranker import GetBM25, HybridTopN, RecipeText
+
+
+# OCR style query: part of the recipe text with dropped words and character errors
+def NoisyQuery(recipe, rng, drop=0.4, typo=0.05):
+    words = RecipeText(recipe).split()
+    words = words[: rng.randint(20, 80)]
+    words = [word for word in words if rng.random() > drop]
+    noisy = []
+    for word in words:
+        if len(word) > 3 and rng.random() < typo:
+            position = rng.randrange(len(word))
+            word = word[:position] + rng.choice("aeilnorst") + word[position + 1:]
+        noisy.append(word)
+    return " ".join(noisy)
+
+
+def ReadQueries(path):
+    with open(path, "r", encoding="utf-8") as file:
+        entries = [json.loads(line) for line in file if line.strip()]
+    return [entry["query"] for entry in entries], [entry["key"] for entry in entries]
+
+
+def Evaluate(name, search, queries, keys, depths):
+    hits = {depth: 0 for depth in depths}
+    timings = []
+    for query, key in zip(queries, keys):
+        start_time = time.perf_counter()
+        found = search(query, max(depths))
+        timings.append(time.perf_counter() - start_time)
+        for depth in depths:
+            hits[depth] += key in found[:depth]
+    timings = np.array(timings) * 1000
+    recalls = "".join(f"{hits[depth] / len(queries):>9.3f}" for depth in depths)
+    print(f"{name:>8}{recalls}{np.median(timings):>9.1f}{np.percentile(timings, 99):>9.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="recall@k and latency, BM25 against dense and hybrid")
+    parser.add_argument("--index", default=dense_index_path)
+    parser.add_argument("--queries", default=None, help='held-out JSONL of {"query", "key"}')
+    parser.add_argument("--samples", type=int, default=200, help="generated queries when --queries is not given")
+    parser.add_argument("--depths", default="5,10,50")
+    parser.add_argument("--nprobe", type=int, default=None)
+    args = parser.parse_args()
+
+    bm25 = GetBM25()
+    dense = DenseIndex.load(args.index, LoadEncoder())
+    if args.nprobe:
+        dense.nprobe = args.nprobe
+
+    if args.queries:
+        queries, keys = ReadQueries(args.queries)
+    else:
+        rng = random.Random(0)
+        ids = rng.sample(range(bm25.N), min(args.samples, bm25.N))
+        recipes = bm25.documents(ids)
+        queries = [NoisyQuery(recipe, rng) for recipe in recipes]
+        keys = [recipe["key"] for recipe in recipes]
+
+    depths = [int(depth) for depth in args.depths.split(",")]
+    print(f"{len(queries)} queries, {bm25.N} recipes, {len(dense.centroids)} lists, nprobe {dense.nprobe}")
+    print(f"{'':>8}" + "".join(f"{'R@' + str(depth):>9}" for depth in depths) + f"{'p50 ms':>9}{'p99 ms':>9}")
+    Evaluate(
+        "bm25",
+        lambda query, n: [bm25.txt_ids[i] for i, score in bm25.top_n_ids(query, n)],
+        queries, keys, depths,
+    )
+    Evaluate(
+        "dense",
+        lambda query, n: [dense.keys[i] for i, score in dense.search(query, n)],
+        queries, keys, depths,
+    )
+    Evaluate(
+        "hybrid",
+        lambda query, n: [hit["id"] for hit in HybridTopN(bm25, dense, query, n)],
+        queries, keys, depths,
+    )
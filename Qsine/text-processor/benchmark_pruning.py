@@ -0,0 +1,57 @@
+import argparse
+import random
+import time
+from os.path import dirname, join
+
+import numpy as np
+
+from reranker import BM25
+
+PANTRY = ["salt", "sugar", "water", "flour", "oil", "butter", "eggs", "milk", "pepper", "garlic"]
+
+
+# An OCR'd ingredient label: one recipe's ingredients in between pantry
+# staples, a few of them read twice
+def LabelQuery(recipe, rng):
+    words = " ".join(recipe["ingredients"]).split()
+    words += rng.sample(PANTRY, rng.randint(4, len(PANTRY)))
+    words += rng.choices(PANTRY, k=rng.randint(0, 6))
+    rng.shuffle(words)
+    return "Ingredients: " + ", ".join(words)
+
+
+def Timed(func, queries):
+    timings = []
+    results = []
+    for query in queries:
+        start_time = time.perf_counter()
+        results.append(func(query))
+        timings.append(time.perf_counter() - start_time)
+    return np.array(timings) * 1000, results
+
+
+if __name__ == "__main__":
+    project_root = dirname(dirname(__file__))
+    parser = argparse.ArgumentParser(description="MaxScore against exhaustive BM25 on long OCR style queries")
+    parser.add_argument("--passages", default=join(project_root, "data", "all_recipes.json"))
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--depths", default="5,50")
+    args = parser.parse_args()
+
+    bm25 = BM25(args.passages)
+    rng = random.Random(0)
+    queries = [bm25.tokenize(LabelQuery(recipe, rng)) for recipe in rng.sample(bm25.data, min(args.queries, bm25.N))]
+    lengths = [len(query) for query in queries]
+
+    print(f"{bm25.N} documents, {len(queries)} queries of {np.mean(lengths):.0f} terms on average")
+    print(f"{'n':>4}{'exh p50':>10}{'exh p99':>10}{'mxs p50':>10}{'mxs p99':>10}{'pruned':>8}  identical")
+    for n in [int(depth) for depth in args.depths.split(",")]:
+        exhaustive, expected = Timed(lambda query: bm25.exhaustive_top_n(query, n), queries)
+        pruned, actual = Timed(
+            lambda query: bm25.max_score_top_n(query, n) or bm25.exhaustive_top_n(query, n), queries
+        )
+        share = np.mean([bm25.max_score_top_n(query, n) is not None for query in queries])
+        print(
+            f"{n:>4}{np.median(exhaustive):>10.2f}{np.percentile(exhaustive, 99):>10.2f}"
+            f"{np.median(pruned):>10.2f}{np.percentile(pruned, 99):>10.2f}{share:>8.0%}  {expected == actual}"
+        )
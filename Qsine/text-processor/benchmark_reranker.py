@@ -0,0 +1,65 @@
+import argparse
+import os
+import random
+import time
+
+import numpy as np
+
+# Serve from the local model directory only, never the network
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+
+from reranker import (
+    RERANKER_MODEL_PATH,
+    CheckRerankerAccuracy,
+    GetBM25,
+    GetCrossEncoder,
+    RecipeText,
+)
+
+
+def Timed(model, queries, passages_per_query):
+    timings = []
+    for query, passages in zip(queries, passages_per_query):
+        start_time = time.perf_counter()
+        model.rank(query, passages)
+        timings.append(time.perf_counter() - start_time)
+    return np.array(timings) * 1000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cross-encoder latency and accuracy per backend")
+    parser.add_argument("--model", default=RERANKER_MODEL_PATH, help="local model directory")
+    parser.add_argument("--backends", default="torch,int8,onnx")
+    parser.add_argument("--depths", default="10,25,50")
+    parser.add_argument("--queries", type=int, default=30)
+    args = parser.parse_args()
+
+    bm25 = GetBM25()
+    random.seed(0)
+    keys = random.sample(range(bm25.N), min(args.queries, bm25.N))
+    queries = [RecipeText(recipe) for recipe in bm25.documents(keys)]
+    depths = [int(depth) for depth in args.depths.split(",")]
+    candidates = [[hit["text"] for hit in bm25.get_top_n(query, max(depths))] for query in queries]
+
+    print(f"{len(queries)} queries, model {args.model}")
+    print(f"{'backend':>8}{'depth':>7}{'load s':>9}{'p50 ms':>9}{'p99 ms':>9}{'top1':>7}{'@5':>7}")
+    for backend in args.backends.split(","):
+        start_time = time.perf_counter()
+        try:
+            model = GetCrossEncoder(args.model, backend)
+        except Exception as e:
+            print(f"{backend:>8}  unavailable: {e}")
+            continue
+        load = time.perf_counter() - start_time
+        # First call pays for lazy initialisation, keep it out of the numbers
+        model.rank(queries[0], candidates[0][:2])
+
+        for depth in depths:
+            passages = [passages[:depth] for passages in candidates]
+            timings = Timed(model, queries, passages)
+            accuracy = CheckRerankerAccuracy(queries, passages, backend, args.model)
+            print(
+                f"{backend:>8}{depth:>7}{load:>9.2f}"
+                f"{np.median(timings):>9.1f}{np.percentile(timings, 99):>9.1f}"
+                f"{accuracy['top1_agreement']:>7.2f}{accuracy['overlap_at_5']:>7.2f}"
+            )
@@ -0,0 +1,43 @@
+import argparse
+import json
+import subprocess
+import sys
+
+from reranker import index_path, passage_path
+
+# Each mode runs in a fresh interpreter so time and peak RSS are its own
+CHILD = """
+import json, resource, sys, time
+start_time = time.time()
+from reranker import BM25
+if sys.argv[1] == "build":
+    bm25 = BM25(sys.argv[2])
+else:
+    bm25 = BM25.load(sys.argv[3])
+bm25.get_top_n("chicken alfredo pasta", n=50)
+print(json.dumps({
+    "seconds": time.time() - start_time,
+    "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+}))
+"""
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="BM25 startup time and memory")
+    parser.add_argument("--passages", default=passage_path)
+    parser.add_argument("--index", default=index_path)
+    args = parser.parse_args()
+
+    for mode in ["build", "mmap"]:
+        output = subprocess.run(
+            [sys.executable, "-c", CHILD, mode, args.passages, args.index],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(
+            "{:<6} first query after {:8.2f}s  peak RSS {:8.1f} MB".format(
+                mode, result["seconds"], result["max_rss_mb"]
+            )
+        )
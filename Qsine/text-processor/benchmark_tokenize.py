@@ -0,0 +1,46 @@
+import argparse
+import os
+import time
+from os.path import dirname, join
+
+from reranker import BM25
+
+
+if __name__ == "__main__":
+    project_root = dirname(dirname(__file__))
+    parser = argparse.ArgumentParser(description="BM25 index build time against tokenizer processes")
+    parser.add_argument("--passages", default=join(project_root, "data", "all_recipes.json"))
+    parser.add_argument("--workers", default=None, help="comma separated, defaults to 1,2,4.. up to the core count")
+    args = parser.parse_args()
+
+    if args.workers:
+        worker_counts = [int(count) for count in args.workers.split(",")]
+    else:
+        worker_counts = [1]
+        while worker_counts[-1] * 2 <= os.cpu_count():
+            worker_counts.append(worker_counts[-1] * 2)
+
+    bm25 = BM25(args.passages)
+    # Serial and without the lemma memo, like the tokenizer before it
+    bm25.lemmatize = bm25.lemmatizer.lemmatize
+    start_time = time.perf_counter()
+    expected = [bm25.tokenize(text) for text in bm25.original_texts]
+    baseline = time.perf_counter() - start_time
+
+    print(f"{bm25.N} documents, {os.cpu_count()} cores")
+    print(f"uncached serial tokenize {baseline:8.2f}s")
+    for workers in worker_counts:
+        fresh = BM25.__new__(BM25)
+        fresh.init_tokenizer()
+        fresh.k1, fresh.b = bm25.k1, bm25.b
+        start_time = time.perf_counter()
+        tokens = list(fresh.tokenize_corpus(bm25.original_texts, workers))
+        tokenized = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        fresh.build_index(iter(tokens))
+        indexed = time.perf_counter() - start_time
+        print(
+            f"{workers:>3} workers  tokenize {tokenized:8.2f}s  index {indexed:6.2f}s"
+            f"  speedup {baseline / tokenized:5.2f}x  identical {tokens == expected}"
+        )
@@ -0,0 +1,25 @@
+import argparse
+import os
+import time
+
+from reranker import BM25, index_path, passage_path
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build the BM25 index artifact offline"
+    )
+    parser.add_argument("--passages", default=passage_path)
+    parser.add_argument("--out", default=index_path)
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count(), help="tokenizer processes"
+    )
+    args = parser.parse_args()
+
+    start_time = time.time()
+    bm25 = BM25(args.passages, workers=args.workers)
+    bm25.save(args.out, os.stat(args.passages).st_mtime)
+    print(
+        "Indexed {} documents, {} terms into {} in {:.1f}s".format(
+            bm25.N, len(bm25.vocab), args.out, time.time() - start_time
+        )
+    )
@@ -0,0 +1,117 @@
+import argparse
+import json
+import random
+import time
+
+import numpy as np
+
+from benchmark_dense import NoisyQuery, ReadQueries
+from reranker import (
+    RERANKER_BACKEND,
+    RERANKER_MODEL_PATH,
+    CascadeDepth,
+    GetBM25,
+    GetCrossEncoder,
+    ScoreRatio,
+    cascade_path,
+)
+
+
+def Measure(bm25, model, query, n, shrink_depth):
+    start_time = time.perf_counter()
+    hits = bm25.get_top_n(query, n * 10)
+    retrieval = time.perf_counter() - start_time
+    passages = [hit["text"] for hit in hits[:n]]
+
+    start_time = time.perf_counter()
+    ranks = model.rank(query, passages)
+    full = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    model.rank(query, passages[:shrink_depth])
+    shrunk = time.perf_counter() - start_time
+
+    # Cross-encoder scores don't depend on the other passages, so the top
+    # hit of any smaller depth can be read off the full scores
+    cross_scores = np.full(n, -np.inf)
+    for rank in ranks:
+        cross_scores[rank["corpus_id"]] = rank["score"]
+    return {
+        "scores": [hit["score"] for hit in hits],
+        "cross_scores": cross_scores,
+        "seconds": {0: retrieval, shrink_depth: retrieval + shrunk, n: retrieval + full},
+    }
+
+
+def TopHit(sample, depth):
+    return int(np.argmax(sample["cross_scores"][:depth])) if depth > 0 else 0
+
+
+def Agreement(samples, n, cascade):
+    # Top recipe with the cascade against the top recipe with full reranking
+    return np.mean([
+        TopHit(sample, CascadeDepth(sample["scores"], n, cascade)) == TopHit(sample, n)
+        for sample in samples
+    ])
+
+
+def Lowest(candidates, accept):
+    # Smallest threshold accepted, agreement only grows with the threshold
+    for threshold in candidates:
+        if accept(threshold):
+            return threshold
+    return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calibrate when GetRecipe may skip or shrink reranking")
+    parser.add_argument("--queries", default=None, help='held-out JSONL of {"query", ...}')
+    parser.add_argument("--samples", type=int, default=300, help="generated queries when --queries is not given")
+    parser.add_argument("--n", type=int, default=5)
+    parser.add_argument("--rank", type=int, default=None, help="rank compared with the top score, defaults to n")
+    parser.add_argument("--shrink-depth", type=int, default=2)
+    parser.add_argument("--target", type=float, default=0.98, help="top-1 agreement with full reranking")
+    parser.add_argument("--model", default=RERANKER_MODEL_PATH)
+    parser.add_argument("--backend", default=RERANKER_BACKEND)
+    parser.add_argument("--out", default=cascade_path)
+    args = parser.parse_args()
+
+    bm25 = GetBM25()
+    model = GetCrossEncoder(args.model, args.backend)
+    if args.queries:
+        queries, _ = ReadQueries(args.queries)
+    else:
+        rng = random.Random(0)
+        recipes = bm25.documents(rng.sample(range(bm25.N), min(args.samples, bm25.N)))
+        queries = [NoisyQuery(recipe, rng) for recipe in recipes]
+
+    model.rank(queries[0], ["warmup"])
+    samples = [Measure(bm25, model, query, args.n, args.shrink_depth) for query in queries]
+
+    cascade = {
+        "rank": args.rank or args.n,
+        "skip_ratio": None,
+        "shrink_ratio": None,
+        "shrink_depth": args.shrink_depth,
+    }
+    ratios = sorted(set(ScoreRatio(sample["scores"], cascade["rank"]) for sample in samples))
+    candidates = [ratio for ratio in ratios if np.isfinite(ratio)]
+    cascade["skip_ratio"] = Lowest(
+        candidates, lambda threshold: Agreement(samples, args.n, dict(cascade, skip_ratio=threshold)) >= args.target
+    )
+    cascade["shrink_ratio"] = Lowest(
+        [ratio for ratio in candidates if cascade["skip_ratio"] is None or ratio < cascade["skip_ratio"]],
+        lambda threshold: Agreement(samples, args.n, dict(cascade, shrink_ratio=threshold)) >= args.target,
+    )
+    cascade["agreement"] = float(Agreement(samples, args.n, cascade))
+    with open(args.out, "w", encoding="utf-8") as file:
+        json.dump(cascade, file, indent=2)
+
+    depths = [CascadeDepth(sample["scores"], args.n, cascade) for sample in samples]
+    full = np.array([sample["seconds"][args.n] for sample in samples]) * 1000
+    gated = np.array([sample["seconds"][depth] for sample, depth in zip(samples, depths)]) * 1000
+    print(f"{len(samples)} queries, thresholds written to {args.out}: {json.dumps(cascade)}")
+    print(f"skipped the cross-encoder: {depths.count(0) / len(depths):.1%}")
+    print(f"reranked {args.shrink_depth} instead of {args.n}: {depths.count(args.shrink_depth) / len(depths):.1%}")
+    print(f"top-1 agreement with full reranking: {cascade['agreement']:.3f}")
+    print(f"full reranking  p50 {np.median(full):7.1f} ms  p99 {np.percentile(full, 99):7.1f} ms")
+    print(f"cascade         p50 {np.median(gated):7.1f} ms  p99 {np.percentile(gated, 99):7.1f} ms")
@@ -0,0 +1,194 @@
+import argparse
+import importlib
+import json
+import os
+import shutil
+import threading
+from os.path import dirname, join
+
+import numpy as np
+
+# Directory of the saved dense index, and the encoder it was built with:
+# a local model directory plus a "module:Class" taking that path
+dense_index_path = os.environ.get("DENSE_INDEX_PATH", join(dirname(__file__), "dense_index"))
+DENSE_ENCODER_PATH = os.environ.get("DENSE_ENCODER_PATH", join(dirname(__file__), "models", "encoder"))
+DENSE_ENCODER = os.environ.get("DENSE_ENCODER", "dense_index:SentenceEncoder")
+
+# Bump whenever the on-disk layout written by DenseIndex.save changes
+DENSE_FORMAT_VERSION = 1
+DENSE_ARRAYS = ["embeddings", "scales", "centroids", "list_ptr", "list_ids"]
+
+
+class SentenceEncoder:
+    """sentence-transformers bi-encoder loaded from a local directory"""
+
+    def __init__(self, model_path):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_path, device="cpu", local_files_only=os.path.isdir(model_path))
+
+    def encode(self, texts):
+        return self.model.encode(
+            texts, batch_size=64, normalize_embeddings=True, convert_to_numpy=True
+        ).astype(np.float32)
+
+
+def LoadEncoder(model_path=DENSE_ENCODER_PATH, encoder=DENSE_ENCODER):
+    # Any class with encode(list of str) -> (n, dim) float array can be plugged in
+    module_name, class_name = encoder.split(":")
+    return getattr(importlib.import_module(module_name), class_name)(model_path)
+
+
+def Normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def Quantize(vectors, dtype):
+    """float16 as is, or int8 with one float32 scale per row"""
+    if dtype == "float16":
+        return vectors.astype(np.float16), np.ones(len(vectors), dtype=np.float32)
+    if dtype == "int8":
+        scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127
+        return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+    raise ValueError("Unknown embedding dtype {}".format(dtype))
+
+
+def KMeans(vectors, clusters, iterations=10, seed=0):
+    # Spherical k-means, centroids stay unit length for inner product search
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), clusters, replace=False)]
+    for _ in range(iterations):
+        assignment = Assign(vectors, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        empty = np.bincount(assignment, minlength=clusters) == 0
+        sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+        centroids = Normalize(sums)
+    return centroids
+
+
+def Assign(vectors, centroids, chunk_size=8192):
+    return np.concatenate([
+        np.argmax(vectors[start:start + chunk_size] @ centroids.T, axis=1)
+        for start in range(0, len(vectors), chunk_size)
+    ])
+
+
+class DenseIndex:
+    """Inverted file (IVF) index over quantized, normalized recipe embeddings"""
+
+    def __init__(self, embeddings, scales, centroids, list_ptr, list_ids, keys, dtype, nprobe=8):
+        self.embeddings = embeddings
+        self.scales = scales
+        self.centroids = centroids
+        self.list_ptr = list_ptr
+        self.list_ids = list_ids
+        self.keys = keys
+        self.dtype = dtype
+        self.nprobe = nprobe
+        self.encoder = None
+
+    @classmethod
+    def build(cls, vectors, keys, dtype="float16", lists=None, sample_size=50000, seed=0):
+        vectors = Normalize(vectors)
+        lists = lists or max(1, int(np.sqrt(len(vectors))))
+        # Train the coarse quantizer on a sample, then file every vector
+        rng = np.random.default_rng(seed)
+        sample = vectors[rng.choice(len(vectors), min(sample_size, len(vectors)), replace=False)]
+        centroids = KMeans(sample, min(lists, len(sample)), seed=seed)
+        assignment = Assign(vectors, centroids)
+        list_ids = np.argsort(assignment, kind="stable").astype(np.int32)
+        counts = np.bincount(assignment, minlength=len(centroids))
+        list_ptr = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        embeddings, scales = Quantize(vectors, dtype)
+        return cls(embeddings, scales, centroids, list_ptr, list_ids, list(keys), dtype)
+
+    def vectors(self, ids):
+        return self.embeddings[ids].astype(np.float32) * self.scales[ids, None]
+
+    def search_vector(self, query_vector, k=10, nprobe=None):
+        """(id, cosine similarity) of the k nearest documents among the probed lists"""
+        query_vector = Normalize(query_vector)
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        probe = np.argpartition(-(self.centroids @ query_vector), nprobe - 1)[:nprobe]
+        ids = np.concatenate([self.list_ids[self.list_ptr[i]:self.list_ptr[i + 1]] for i in probe])
+        if len(ids) == 0:
+            return []
+        scores = self.vectors(ids) @ query_vector
+        if len(ids) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            ids, scores = ids[top], scores[top]
+        order = np.lexsort((ids, -scores))
+        return [(int(ids[i]), float(scores[i])) for i in order]
+
+    def search(self, query, k=10, nprobe=None):
+        return self.search_vector(self.encoder.encode([query])[0], k, nprobe)
+
+    def save(self, path=dense_index_path):
+        temp_path = "{}.tmp{}".format(path, os.getpid())
+        shutil.rmtree(temp_path, ignore_errors=True)
+        os.makedirs(temp_path)
+        for name in DENSE_ARRAYS:
+            np.save(join(temp_path, name + ".npy"), np.ascontiguousarray(getattr(self, name)))
+        with open(join(temp_path, "keys.json"), "w", encoding="utf-8") as file:
+            json.dump(self.keys, file)
+        with open(join(temp_path, "meta.json"), "w", encoding="utf-8") as file:
+            json.dump({"format_version": DENSE_FORMAT_VERSION, "dtype": self.dtype, "nprobe": self.nprobe}, file)
+
+        old_path = "{}.old{}".format(path, os.getpid())
+        if os.path.exists(path):
+            os.rename(path, old_path)
+        os.rename(temp_path, path)
+        shutil.rmtree(old_path, ignore_errors=True)
+
+    @classmethod
+    def load(cls, path=dense_index_path, encoder=None):
+        with open(join(path, "meta.json"), "r", encoding="utf-8") as file:
+            meta = json.load(file)
+        if meta["format_version"] != DENSE_FORMAT_VERSION:
+            raise ValueError("Unsupported dense index format {}".format(meta["format_version"]))
+        arrays = {name: np.load(join(path, name + ".npy"), mmap_mode="r") for name in DENSE_ARRAYS}
+        with open(join(path, "keys.json"), "r", encoding="utf-8") as file:
+            keys = json.load(file)
+        self = cls(keys=keys, dtype=meta["dtype"], nprobe=meta["nprobe"], **arrays)
+        # Centroids are small and probed on every query
+        self.centroids = np.array(self.centroids)
+        self.encoder = encoder
+        # Changes whenever the index is rebuilt, for keying cached results
+        self.version = str(os.stat(join(path, "meta.json")).st_mtime_ns)
+        return self
+
+
+_dense_index = None
+_dense_index_lock = threading.Lock()
+
+
+def GetDenseIndex(path=dense_index_path):
+    # Loaded with its encoder once per process
+    global _dense_index
+    with _dense_index_lock:
+        if _dense_index is None:
+            _dense_index = DenseIndex.load(path, LoadEncoder())
+        return _dense_index
+
+
+if __name__ == "__main__":
+    from reranker import RecipeText, passage_path
+
+    parser = argparse.ArgumentParser(description="Embed the recipes and build the dense index")
+    parser.add_argument("--passages", default=passage_path)
+    parser.add_argument("--out", default=dense_index_path)
+    parser.add_argument("--dtype", default="float16", choices=["float16", "int8"])
+    parser.add_argument("--lists", type=int, default=None, help="IVF lists, defaults to sqrt(N)")
+    parser.add_argument("--nprobe", type=int, default=8)
+    args = parser.parse_args()
+
+    with open(args.passages, "r", encoding="utf-8") as file:
+        recipes = json.load(file)
+    vectors = LoadEncoder().encode([RecipeText(recipe) for recipe in recipes])
+    index = DenseIndex.build(vectors, [recipe["key"] for recipe in recipes], args.dtype, args.lists)
+    index.nprobe = args.nprobe
+    index.save(args.out)
+    print("Embedded {} recipes into {} lists at {}".format(len(recipes), len(index.centroids), args.out))
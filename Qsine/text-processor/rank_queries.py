@@ -0,0 +1,56 @@
+import argparse
+import json
+import sys
+import time
+
+from reranker import GetBM25
+
+
+# One query per line, either a JSON string or an object with a "query" field
+def ReadQueries(path):
+    ids = []
+    queries = []
+    with open(path, "r", encoding="utf-8") as file:
+        for line_number, line in enumerate(file):
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if isinstance(entry, str):
+                entry = {"query": entry}
+            ids.append(entry.get("id", line_number))
+            queries.append(entry["query"])
+    return ids, queries
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rank a JSONL file of queries with BM25")
+    parser.add_argument("queries", help="JSONL file of queries")
+    parser.add_argument("--out", default=None, help="JSONL results, defaults to stdout")
+    parser.add_argument("--n", type=int, default=10)
+    parser.add_argument("--chunk-size", type=int, default=1024)
+    parser.add_argument("--compare", action="store_true", help="also time the one query at a time path")
+    args = parser.parse_args()
+
+    ids, queries = ReadQueries(args.queries)
+    bm25 = GetBM25()
+    # Build the weight matrix outside the timed section, it is reused by later calls
+    bm25.weight_matrix()
+
+    start_time = time.perf_counter()
+    tops = bm25.top_n_ids_batch(queries, args.n, args.chunk_size)
+    elapsed = time.perf_counter() - start_time
+
+    out = open(args.out, "w", encoding="utf-8") if args.out else sys.stdout
+    for query_id, top in zip(ids, tops):
+        results = [{"key": bm25.txt_ids[i], "score": score} for i, score in top]
+        out.write(json.dumps({"id": query_id, "results": results}) + "\n")
+    if args.out:
+        out.close()
+
+    print(f"{len(queries)} queries in {elapsed:.2f}s, {len(queries) / elapsed:.1f} queries/sec", file=sys.stderr)
+    if args.compare:
+        start_time = time.perf_counter()
+        for query in queries:
+            bm25.top_n_ids(query, args.n)
+        single = time.perf_counter() - start_time
+        print(f"one at a time: {len(queries) / single:.1f} queries/sec", file=sys.stderr)
@@ -2,22 +2,107 @@ import torch
 from sentence_transformers import CrossEncoder
 import math
 import json
-from collections import Counter, defaultdict
+from collections import Counter, deque
 from os.path import dirname, join
 from nltk.stem import WordNetLemmatizer
 from nltk.tokenize import word_tokenize
 from nltk.corpus import stopwords
 import string
 import unicodedata
+import heapq
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from array import array
+from itertools import islice
+import numpy as np
+from scipy import sparse
+import os
+import shutil
+import sys
+import threading
+import time
+import logging
+import hashlib
+from contextlib import contextmanager
 
+try:
+    import fcntl
+except ImportError:
+    # Windows, builds aren't serialized across processes
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+project_root = dirname(dirname(__file__))
+sys.path.append(join(project_root, "data"))
+
+from recipe_store import RecipeStore
+from dense_index import DENSE_ENCODER, DENSE_ENCODER_PATH, GetDenseIndex
+
+passage_path = join(project_root, "data", "all_recipes.json")
+index_path = join(dirname(__file__), "bm25_index")
+
+# Bump whenever the on-disk layout written by BM25.save changes
+INDEX_FORMAT_VERSION = 4
+INDEX_ARRAYS = [
+    "post_ptr",
+    "post_docs",
+    "post_tfs",
+    "doc_lens",
+    "idfs",
+    "norms",
+    "alive",
+    "max_tfs",
+    "min_lens",
+    "doc_ptr",
+    "doc_terms",
+]
+
+# Recipe vocabularies repeat a lot, so lemmas are memoized per process
+LEMMA_CACHE_SIZE = 200000
+PUNCTUATION_TABLE = str.maketrans("", "", string.punctuation)
+# Processes used to tokenize the corpus when building the index
+BUILD_WORKERS = int(os.environ.get("BM25_BUILD_WORKERS", "1"))
+# Fuse dense retrieval candidates with BM25 before reranking
+HYBRID_RETRIEVAL = os.environ.get("HYBRID_RETRIEVAL", "0") == "1"
+RRF_K = 60
+# Skip or shrink reranking when BM25 is decisive, see calibrate_cascade.py
+RERANK_CASCADE = os.environ.get("RERANK_CASCADE", "0") == "1"
+cascade_path = os.environ.get(
+    "RERANK_CASCADE_PATH", join(dirname(__file__), "cascade.json")
+)
+# Added documents buffered before a background merge into the postings
+MERGE_DOCS = int(os.environ.get("BM25_MERGE_DOCS", "5000"))
+# Saved versions are directories named by CURRENT, the newest few are kept
+# for workers still loading one of them
+CURRENT_FILE = "CURRENT"
+# Changes saved since a version was written, replayed on load
+DELTA_FILE = "delta.jsonl"
+KEEP_VERSIONS = 3
+# A worker can follow CURRENT to a version pruned just after, it retries
+LOAD_RETRIES = 5
+LOAD_RETRY_DELAY = 0.2
+# Seconds between checks for a new version or saved changes
+RELOAD_INTERVAL = float(os.environ.get("BM25_RELOAD_INTERVAL", "1.0"))
+
+
+# Passage text used for both BM25 and the cross-encoder
+def RecipeText(entry):
+    return (
+        entry["recipe_name"]
+        + "\nIngredients: "
+        + ", ".join(entry["ingredients"])
+        + "\nDirections:"
+        + " ".join(entry["steps"])
+    )
 
 
 class BM25:
-    def __init__(self, json_path, k1=1.5, b=0.75):
+    def __init__(self, json_path, k1=1.5, b=0.75, workers=BUILD_WORKERS):
         self.k1 = k1
         self.b = b
-        self.lemmatizer = WordNetLemmatizer()
-        self.stop_words = set(stopwords.words('english'))
+        self.source_mtime = None
+        self.init_tokenizer()
         # Load and store original passages
         
         
@@ -26,96 +111,1324 @@ class BM25:
         
         # Extract text content from each passage
         self.txt_ids = [entry["key"] for entry in self.data] 
-        self.original_texts = [entry['recipe_name'] \
-                    + "\nIngredients: " + ", ".join(entry['ingredients']) \
-                    + "\nDirections:" + " ".join(entry['steps']) for entry in self.data]
+        self.original_texts = [RecipeText(entry) for entry in self.data]
         
-        # Tokenize and preprocess
-        self.corpus = [self.tokenize(text) for text in self.original_texts]
-        self.doc_lens = [len(doc) for doc in self.corpus]
-        self.avgdl = sum(self.doc_lens) / len(self.doc_lens)
-        self.df = self.compute_df()
-        self.N = len(self.corpus)
+        # Tokenize, preprocess and build the inverted index
+        self.build_index(self.tokenize_corpus(self.original_texts, workers))
+
+    def init_tokenizer(self):
+        self.lemmatizer = WordNetLemmatizer()
+        self.stop_words = set(stopwords.words("english"))
+        self.lemmatize = lru_cache(maxsize=LEMMA_CACHE_SIZE)(self.lemmatizer.lemmatize)
 
     def tokenize(self, text):
         #Normalize to ASCII
         text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('utf-8')
         
         #Remove punctuation
-        text = text.translate(str.maketrans('', '', string.punctuation))
+        text = text.translate(PUNCTUATION_TABLE)
 
         # Tokenize and lemmatize
         tokens = word_tokenize(text.lower())
         tokens = [t for t in tokens if t not in self.stop_words and t.isalpha()]
-        return [self.lemmatizer.lemmatize(t) for t in tokens]
+        return [self.lemmatize(t) for t in tokens]
+
+    def tokenize_corpus(self, texts, workers=1, shard_size=512):
+        """Tokens of each text in order, sharded over a process pool when workers > 1"""
+        if workers <= 1:
+            for text in texts:
+                yield self.tokenize(text)
+            return
+
+        texts = iter(texts)
+        with ProcessPoolExecutor(workers, initializer=InitTokenizerWorker) as pool:
+            # Only a few shards in flight, so tokens stream instead of piling up
+            pending = deque()
+            while True:
+                while len(pending) < workers * 2:
+                    shard = list(islice(texts, shard_size))
+                    if not shard:
+                        break
+                    pending.append(pool.submit(TokenizeShard, shard))
+                if not pending:
+                    return
+                yield from pending.popleft().result()
+
+    def build_index(self, corpus):
+        # Postings are stored term-major like a CSR matrix: the documents of
+        # term t are post_docs[post_ptr[t]:post_ptr[t + 1]], in doc id order
+        self.vocab = {}
+        term_docs = []
+        term_tfs = []
+        doc_lens = []
+        for doc_id, doc in enumerate(corpus):
+            doc_lens.append(len(doc))
+            for term, tf in Counter(doc).items():
+                if term not in self.vocab:
+                    self.vocab[term] = len(self.vocab)
+                    term_docs.append(array("i"))
+                    term_tfs.append(array("i"))
+                term_id = self.vocab[term]
+                term_docs[term_id].append(doc_id)
+                term_tfs[term_id].append(tf)
+
+        self.N = len(doc_lens)
+        self.doc_lens = np.array(doc_lens, dtype=np.int32)
+        self.avgdl = sum(doc_lens) / len(doc_lens)
+        df = np.array([len(docs) for docs in term_docs], dtype=np.int64)
+        self.post_ptr = np.concatenate([[0], np.cumsum(df)]).astype(np.int64)
+        self.post_docs = np.frombuffer(b"".join(term_docs), dtype=np.int32)
+        self.post_tfs = np.frombuffer(b"".join(term_tfs), dtype=np.int32)
+        self.finalize()
+
+    def finalize(self):
+        # Precompute what doesn't depend on the query
+        self.df = np.diff(self.post_ptr)
+        self.alive = np.ones(self.N, dtype=bool)
+        self.total_len = int(self.doc_lens.sum())
+        self.idfs = np.array([self.idf(term) for term in self.vocab], dtype=np.float64)
+        self.norms = self.k1 * (1 - self.b + self.b * self.doc_lens / self.avgdl)
+        self.max_tfs, self.min_lens = TermBounds(
+            self.post_ptr, self.post_docs, self.post_tfs, self.doc_lens
+        )
+        self.doc_ptr, self.doc_terms = ForwardIndex(
+            self.post_ptr, self.post_docs, self.N
+        )
+        self.version = "{}-{}-{}".format(INDEX_FORMAT_VERSION, self.N, time.time_ns())
+        self.init_segments()
+
+    def init_segments(self):
+        # Documents added since the last merge: term id -> doc ids and tfs.
+        # Their ids come after every merged document, so appending them to a
+        # term's merged postings keeps the doc ids sorted
+        self.lock = threading.RLock()
+        self.merge_lock = threading.RLock()
+        self.buffer_docs = {}
+        self.buffer_tfs = {}
+        # Term ids of each buffered document, to maintain df when it is removed
+        self.buffer_terms = {}
+        # Removed documents whose postings are still in the merged arrays
+        self.pending_deletes = 0
+        self.added_recipes = {}
+        self.key_ids = None
+        self.checkpoint = None
+        self.weights = None
+        self.bounds = None
+        # Changes since the saved version, the first saved_ops are in its delta
+        self.base = None
+        self.ops = []
+        self.saved_ops = 0
+        self.saved_checkpoint = None
+        self.delta_end = 0
+        self.delta_size = 0
 
     def compute_df(self):
-        df = defaultdict(int)
-        for doc in self.corpus:
-            for term in set(doc):
-                df[term] += 1
-        return df
+        return {term: int(self.df[i]) for term, i in self.vocab.items()}
 
     def idf(self, term):
-        df = self.df.get(term, 0)
+        term_id = self.vocab.get(term)
+        df = 0 if term_id is None else int(self.df[term_id])
         return math.log(1 + (self.N - df + 0.5) / (df + 0.5))
 
+    def refresh_stats(self):
+        # N, avgdl, idf and length norms after documents were added or removed
+        self.avgdl = self.total_len / self.N if self.N else 0.0
+        self.idfs = Idfs(self.df, self.N)
+        self.norms = self.k1 * (
+            1 - self.b + self.b * self.doc_lens / (self.avgdl or 1.0)
+        )
+        self.version = "{}-{}-{}".format(INDEX_FORMAT_VERSION, self.N, time.time_ns())
+        self.weights = None
+        self.bounds = None
+
+    def key_index(self):
+        if self.key_ids is None:
+            self.key_ids = {
+                key: i for i, key in enumerate(self.txt_ids) if self.alive[i]
+            }
+        return self.key_ids
+
+    def add_documents(self, recipes):
+        """Index recipes into the append buffer, replacing any with the same key"""
+        # The last copy of a key wins, tokenizing happens outside the lock
+        recipes = list({recipe["key"]: recipe for recipe in recipes}.values())
+        doc_lens = []
+        doc_terms = []
+        for recipe in recipes:
+            tokens = self.tokenize(RecipeText(recipe))
+            doc_lens.append(len(tokens))
+            doc_terms.append(list(Counter(tokens).items()))
+        with self.lock:
+            self.index_documents(recipes, doc_lens, doc_terms)
+            self.refresh_stats()
+            self.ops.append(
+                {
+                    "add": [
+                        list(document) for document in zip(recipes, doc_lens, doc_terms)
+                    ]
+                }
+            )
+        self.maybe_merge()
+
+    def index_documents(self, recipes, doc_lens, doc_terms):
+        # Recipes with their lengths and (term, tf) pairs, under the lock
+        self.drop_documents([recipe["key"] for recipe in recipes])
+        key_ids = self.key_index()
+        terms = len(self.vocab)
+        term_ids = []
+        term_tfs = []
+        term_lens = []
+        for recipe, doc_len, counts in zip(recipes, doc_lens, doc_terms):
+            doc_id = len(self.txt_ids)
+            ids = []
+            for term, tf in counts:
+                term_id = self.vocab.setdefault(term, len(self.vocab))
+                if term_id not in self.buffer_docs:
+                    self.buffer_docs[term_id] = array("i")
+                    self.buffer_tfs[term_id] = array("i")
+                self.buffer_docs[term_id].append(doc_id)
+                self.buffer_tfs[term_id].append(tf)
+                ids.append(term_id)
+                term_tfs.append(tf)
+            self.buffer_terms[doc_id] = ids
+            term_ids.extend(ids)
+            term_lens.extend([doc_len] * len(ids))
+            self.txt_ids.append(recipe["key"])
+            key_ids[recipe["key"]] = doc_id
+            self.added_recipes[doc_id] = recipe
+            if self.data is not None:
+                self.data.append(recipe)
+
+        # New terms have no merged postings yet
+        new_terms = len(self.vocab) - terms
+        if new_terms:
+            self.df = np.concatenate(
+                [self.df, np.zeros(new_terms, dtype=self.df.dtype)]
+            )
+            self.post_ptr = np.concatenate(
+                [self.post_ptr, np.full(new_terms, self.post_ptr[-1])]
+            )
+            self.max_tfs = np.concatenate(
+                [self.max_tfs, np.zeros(new_terms, dtype=np.int32)]
+            )
+            self.min_lens = np.concatenate(
+                [self.min_lens, np.full(new_terms, NO_LENGTH, dtype=np.int32)]
+            )
+        term_ids = np.array(term_ids, dtype=np.int64)
+        np.add.at(self.df, term_ids, 1)
+        # Bounds only ever loosen here, merges tighten them again
+        np.maximum.at(self.max_tfs, term_ids, np.array(term_tfs, dtype=np.int32))
+        np.minimum.at(self.min_lens, term_ids, np.array(term_lens, dtype=np.int32))
+        self.doc_lens = np.concatenate(
+            [self.doc_lens, np.array(doc_lens, dtype=np.int32)]
+        )
+        self.alive = np.concatenate([self.alive, np.ones(len(recipes), dtype=bool)])
+        self.total_len += sum(doc_lens)
+        self.N += len(recipes)
+
+    def remove_documents(self, keys):
+        """Stop returning the recipes with these keys, returns how many were indexed"""
+        with self.lock:
+            removed = self.drop_documents(keys)
+            if removed:
+                self.refresh_stats()
+                self.ops.append({"remove": list(keys)})
+        self.maybe_merge()
+        return removed
+
+    def update_document(self, recipe):
+        self.add_documents([recipe])
+
+    def drop_documents(self, keys):
+        # Tombstone the documents and take them out of df, N and the total length
+        key_ids = self.key_index()
+        doc_ids = [key_ids.pop(key) for key in set(keys) if key in key_ids]
+        if not doc_ids:
+            return 0
+        merged = [i for i in doc_ids if i not in self.buffer_terms]
+        if merged:
+            term_ids = [
+                self.doc_terms[self.doc_ptr[i] : self.doc_ptr[i + 1]] for i in merged
+            ]
+            np.subtract.at(self.df, np.concatenate(term_ids), 1)
+            self.pending_deletes += len(merged)
+        for i in doc_ids:
+            for term_id in self.buffer_terms.pop(i, []):
+                self.df[term_id] -= 1
+            self.added_recipes.pop(i, None)
+        self.alive[doc_ids] = False
+        self.total_len -= int(self.doc_lens[doc_ids].sum())
+        self.N -= len(doc_ids)
+        return len(doc_ids)
+
+    def maybe_merge(self):
+        # Fold a full append buffer into the postings without blocking searches
+        if (
+            len(self.buffer_terms) + self.pending_deletes >= MERGE_DOCS
+            and not self.merging()
+        ):
+            threading.Thread(target=self.compact, daemon=True).start()
+
+    def merging(self):
+        if self.merge_lock.acquire(blocking=False):
+            self.merge_lock.release()
+            return False
+        return True
+
+    def state(self):
+        # What a saved version of the index holds, taken under the lock
+        return {
+            "post_ptr": self.post_ptr,
+            "post_docs": self.post_docs,
+            "post_tfs": self.post_tfs,
+            "doc_lens": self.doc_lens,
+            "alive": self.alive.copy(),
+            "max_tfs": self.max_tfs.copy(),
+            "min_lens": self.min_lens.copy(),
+            "doc_ptr": self.doc_ptr,
+            "doc_terms": self.doc_terms,
+            "N": self.N,
+            "total_len": self.total_len,
+            "vocab": list(self.vocab),
+            "keys": list(self.txt_ids),
+            "added": dict(self.added_recipes),
+            "checkpoint": self.checkpoint,
+            "ops": len(self.ops),
+        }
+
+    def merge(self):
+        """Fold the append buffer into the merged postings and drop removed
+        documents, returns the merged state or None if there was nothing to merge"""
+        with self.merge_lock:
+            with self.lock:
+                if not self.buffer_docs and not self.pending_deletes:
+                    return None
+                state = self.state()
+                post_ptr, post_docs, post_tfs = (
+                    self.post_ptr,
+                    self.post_docs,
+                    self.post_tfs,
+                )
+                buffer_docs = {
+                    term_id: np.array(docs, dtype=np.int32)
+                    for term_id, docs in self.buffer_docs.items()
+                }
+                buffer_tfs = {
+                    term_id: np.array(tfs, dtype=np.int32)
+                    for term_id, tfs in self.buffer_tfs.items()
+                }
+                buffered = list(self.buffer_terms)
+                pending_deletes = self.pending_deletes
+                alive = state["alive"]
+                doc_lens = self.doc_lens
+
+            # The expensive part runs while searches and additions continue
+            post_ptr, post_docs, post_tfs = MergePostings(
+                post_ptr, post_docs, post_tfs, buffer_docs, buffer_tfs, alive
+            )
+            max_tfs, min_lens = TermBounds(post_ptr, post_docs, post_tfs, doc_lens)
+            doc_ptr, doc_terms = ForwardIndex(post_ptr, post_docs, len(doc_lens))
+            state.update(
+                post_ptr=post_ptr,
+                post_docs=post_docs,
+                post_tfs=post_tfs,
+                max_tfs=max_tfs,
+                min_lens=min_lens,
+                doc_ptr=doc_ptr,
+                doc_terms=doc_terms,
+            )
+
+            with self.lock:
+                # Keep whatever was buffered or removed while merging
+                new_terms = len(self.vocab) + 1 - len(post_ptr)
+                self.post_ptr = np.concatenate(
+                    [post_ptr, np.full(new_terms, post_ptr[-1])]
+                )
+                self.post_docs, self.post_tfs = post_docs, post_tfs
+                self.doc_ptr, self.doc_terms = doc_ptr, doc_terms
+                for term_id, docs in buffer_docs.items():
+                    self.buffer_docs[term_id] = self.buffer_docs[term_id][len(docs) :]
+                    self.buffer_tfs[term_id] = self.buffer_tfs[term_id][len(docs) :]
+                    if not self.buffer_docs[term_id]:
+                        del self.buffer_docs[term_id]
+                        del self.buffer_tfs[term_id]
+                for i in buffered:
+                    self.buffer_terms.pop(i, None)
+                self.max_tfs = np.concatenate(
+                    [max_tfs, np.zeros(new_terms, dtype=np.int32)]
+                )
+                self.min_lens = np.concatenate(
+                    [min_lens, np.full(new_terms, NO_LENGTH, dtype=np.int32)]
+                )
+                for term_id, docs in self.buffer_docs.items():
+                    self.max_tfs[term_id] = max(
+                        self.max_tfs[term_id], max(self.buffer_tfs[term_id])
+                    )
+                    self.min_lens[term_id] = min(
+                        self.min_lens[term_id], self.doc_lens[np.array(docs)].min()
+                    )
+                # Buffered documents removed while merging are now merged postings
+                removed = [i for i in buffered if alive[i] and not self.alive[i]]
+                self.pending_deletes += len(removed) - pending_deletes
+                self.weights = None
+                self.bounds = None
+            return state
+
+    def compact(self):
+        # Background merge. With a saved version, the merged state is written
+        # as the next one and its delta starts over
+        with self.merge_lock:
+            state = self.merge()
+            if state is None or self.base is None:
+                return
+            path = self.base[0]
+            name = self.write(path, state)
+            with self.lock:
+                self.publish(path, name, state)
+
+    def save(self, path=index_path, source_mtime=None):
+        """Persist the index, only appending the changes since the last save
+        to the saved version's delta when there is one"""
+        if source_mtime is None:
+            source_mtime = self.source_mtime
+        with self.lock:
+            if (
+                self.base == (path, IndexStamp(path))
+                and source_mtime == self.source_mtime
+            ):
+                self.write_delta()
+                return
+        # A new version has no append buffer, merge it first and hold off
+        # changes until the files are written
+        with self.merge_lock, self.lock:
+            self.merge()
+            self.source_mtime = source_mtime
+            state = self.state()
+            self.publish(path, self.write(path, state), state)
+
+    def write_delta(self):
+        # Under the lock, appends the changes readers replay on load
+        if self.checkpoint != self.saved_checkpoint:
+            self.ops.append({"checkpoint": self.checkpoint})
+            self.saved_checkpoint = self.checkpoint
+        if self.saved_ops == len(self.ops):
+            return
+        path, name = self.base
+        lines = "".join(json.dumps(op) + "\n" for op in self.ops[self.saved_ops :])
+        with open(join(path, name, DELTA_FILE), "r+b") as file:
+            # Drops a line a crashed writer left unfinished
+            file.truncate(self.delta_end)
+            file.seek(self.delta_end)
+            file.write(lines.encode("utf-8"))
+            self.delta_end = file.tell()
+        self.saved_ops = len(self.ops)
+
+    def write(self, path, state):
+        # Each version is a new directory, published by pointing CURRENT at
+        # it, so a loading worker never sees a partial or missing index
+        name = "{}-{}".format(time.time_ns(), os.getpid())
+        temp_path = join(path, name + ".tmp")
+        os.makedirs(temp_path)
+        avgdl = state["total_len"] / state["N"] if state["N"] else 0.0
+        arrays = dict(
+            state,
+            idfs=Idfs(np.diff(state["post_ptr"]), state["N"]),
+            norms=self.k1 * (1 - self.b + self.b * state["doc_lens"] / (avgdl or 1.0)),
+        )
+        for array_name in INDEX_ARRAYS:
+            np.save(
+                join(temp_path, array_name + ".npy"),
+                np.ascontiguousarray(arrays[array_name]),
+            )
+        with open(join(temp_path, "vocab.json"), "w", encoding="utf-8") as file:
+            json.dump(state["vocab"], file)
+        with open(join(temp_path, "keys.json"), "w", encoding="utf-8") as file:
+            json.dump(state["keys"], file)
+        # Recipes added since the dump are not in the recipe store
+        with open(join(temp_path, "added.json"), "w", encoding="utf-8") as file:
+            json.dump({str(i): recipe for i, recipe in state["added"].items()}, file)
+        with open(join(temp_path, "meta.json"), "w", encoding="utf-8") as file:
+            json.dump(
+                {
+                    "format_version": INDEX_FORMAT_VERSION,
+                    "version": "{}-{}-{}".format(
+                        INDEX_FORMAT_VERSION, state["N"], time.time_ns()
+                    ),
+                    "k1": self.k1,
+                    "b": self.b,
+                    "N": state["N"],
+                    "avgdl": avgdl,
+                    "source_mtime": self.source_mtime,
+                    "checkpoint": state["checkpoint"],
+                },
+                file,
+            )
+        os.rename(temp_path, join(path, name))
+        return name
+
+    def publish(self, path, name, state):
+        # Under the lock. Changes saved after the state was taken carry over
+        # to the new version's delta, then CURRENT points at it
+        ops = self.ops[state["ops"] :]
+        saved = max(0, self.saved_ops - state["ops"])
+        with open(join(path, name, DELTA_FILE), "wb") as file:
+            file.write(
+                "".join(json.dumps(op) + "\n" for op in ops[:saved]).encode("utf-8")
+            )
+            self.delta_end = file.tell()
+        pointer_path = "{}.{}".format(join(path, CURRENT_FILE), os.getpid())
+        with open(pointer_path, "w", encoding="utf-8") as file:
+            file.write(name)
+        os.replace(pointer_path, join(path, CURRENT_FILE))
+        self.base = (path, name)
+        self.ops = ops
+        self.saved_ops = saved
+        PruneVersions(path)
+
+    def replay(self, path, start=0):
+        # Applies a version's delta from byte start on, consecutive additions
+        # of different recipes are indexed together
+        try:
+            with open(path, "rb") as file:
+                file.seek(start)
+                data = file.read()
+        except FileNotFoundError:
+            data = b""
+        self.delta_size = start + len(data)
+        # A line still being written is left for the next replay
+        end = data.rfind(b"\n") + 1
+        ops = [json.loads(line) for line in data[:end].splitlines()]
+        self.delta_end = start + end
+        added = []
+        keys = set()
+        with self.lock:
+            for op in ops + [{}]:
+                batch = op.get("add", [])
+                if added and (
+                    not batch
+                    or keys.intersection(recipe["key"] for recipe, _, _ in batch)
+                ):
+                    self.index_documents(*map(list, zip(*added)))
+                    added = []
+                    keys = set()
+                added.extend(batch)
+                keys.update(recipe["key"] for recipe, _, _ in batch)
+                if "remove" in op:
+                    self.drop_documents(op["remove"])
+                if "checkpoint" in op:
+                    self.checkpoint = op["checkpoint"]
+            if ops:
+                self.refresh_stats()
+            self.ops.extend(ops)
+            self.saved_ops = len(self.ops)
+            self.saved_checkpoint = self.checkpoint
+            # The same for every worker that replayed the same changes
+            self.version = (
+                "{}+{}".format(self.base_version, len(self.ops))
+                if self.ops
+                else self.base_version
+            )
+
+    @classmethod
+    def load(cls, path=index_path, recipe_store=None):
+        """Memory-map a saved index, the arrays are shared by every process,
+        and replay the changes saved since"""
+        stamp = IndexStamp(path)
+        if stamp is None:
+            raise FileNotFoundError("No BM25 index in {}".format(path))
+        index_dir = IndexDir(path, stamp)
+        with open(join(index_dir, "meta.json"), "r", encoding="utf-8") as file:
+            meta = json.load(file)
+        if meta["format_version"] != INDEX_FORMAT_VERSION:
+            raise ValueError(
+                "Unsupported BM25 index format {}".format(meta["format_version"])
+            )
+
+        self = cls.__new__(cls)
+        self.k1 = meta["k1"]
+        self.b = meta["b"]
+        self.N = meta["N"]
+        self.avgdl = meta["avgdl"]
+        self.version = self.base_version = meta["version"]
+        self.source_mtime = meta.get("source_mtime")
+        self.init_tokenizer()
+        self.stamp = stamp
+        for name in INDEX_ARRAYS:
+            setattr(self, name, np.load(join(index_dir, name + ".npy"), mmap_mode="r"))
+        with open(join(index_dir, "vocab.json"), "r", encoding="utf-8") as file:
+            self.vocab = {term: i for i, term in enumerate(json.load(file))}
+        with open(join(index_dir, "keys.json"), "r", encoding="utf-8") as file:
+            self.txt_ids = json.load(file)
+
+        # Saved versions are merged, so df comes straight from the postings
+        self.df = np.diff(self.post_ptr)
+        self.alive = np.array(self.alive)
+        self.max_tfs = np.array(self.max_tfs)
+        self.min_lens = np.array(self.min_lens)
+        self.total_len = int(self.doc_lens[self.alive].sum())
+        self.init_segments()
+        self.checkpoint = meta.get("checkpoint")
+        with open(join(index_dir, "added.json"), "r", encoding="utf-8") as file:
+            self.added_recipes = {
+                int(i): recipe for i, recipe in json.load(file).items()
+            }
+
+        # Recipes are read on demand from the recipe store instead of
+        # keeping the whole corpus in every worker
+        self.data = None
+        self.recipe_store = recipe_store or RecipeStore()
+
+        if isinstance(stamp, str):
+            self.base = (path, stamp)
+            self.replay(join(index_dir, DELTA_FILE))
+        return self
+
+    def documents(self, ids):
+        if self.data is not None:
+            return [self.data[i] for i in ids]
+        stored = [self.txt_ids[i] for i in ids if i not in self.added_recipes]
+        recipes = {
+            recipe["key"]: recipe for recipe in self.recipe_store.get_many(stored)
+        }
+        return [
+            (
+                self.added_recipes[i]
+                if i in self.added_recipes
+                else recipes.get(self.txt_ids[i], {})
+            )
+            for i in ids
+        ]
+
+    def postings(self, term_id):
+        start, end = self.post_ptr[term_id], self.post_ptr[term_id + 1]
+        docs, tfs = self.post_docs[start:end], self.post_tfs[start:end]
+        if term_id in self.buffer_docs:
+            docs = np.concatenate(
+                [docs, np.array(self.buffer_docs[term_id], dtype=np.int32)]
+            )
+            tfs = np.concatenate(
+                [tfs, np.array(self.buffer_tfs[term_id], dtype=np.int32)]
+            )
+        return docs, tfs
+
+    def term_scores(self, term_id, docs, tfs):
+        # Same operation order as the original per-document loop, so the
+        # floating point results are identical
+        tfs = tfs.astype(np.float64)
+        return self.idfs[term_id] * ((tfs * (self.k1 + 1)) / (tfs + self.norms[docs]))
+
     def score(self, query, index):
         score = 0.0
-        doc = self.corpus[index]
-        freqs = Counter(doc)
-        dl = self.doc_lens[index]
+        if not self.alive[index]:
+            return score
         for term in self.tokenize(query):
-            if term not in freqs:
+            if term not in self.vocab:
                 continue
-            f = freqs[term]
-            idf = self.idf(term)
-            denom = f + self.k1 * (1 - self.b + self.b * dl / self.avgdl)
-            score += idf * ((f * (self.k1 + 1)) / denom)
+            term_id = self.vocab[term]
+            docs, tfs = self.postings(term_id)
+            position = np.searchsorted(docs, index)
+            if position < len(docs) and docs[position] == index:
+                at = slice(position, position + 1)
+                score += float(self.term_scores(term_id, docs[at], tfs[at])[0])
         return score
 
-    def get_top_n(self, query, n=5, return_ids=False, id_key="id"):
-        scores = [(i, self.score(query, i)) for i in range(len(self.corpus))]
-        sorted_scores = sorted(scores, key=lambda x: x[1], reverse=True)
-        
+    def score_query(self, query_terms):
+        """Scores of every document matching at least one query term"""
+        scores = np.zeros(len(self.doc_lens))
+        matched = []
+        # Repeated query terms count once per occurrence, in query order
+        for term in query_terms:
+            term_id = self.vocab.get(term)
+            if term_id is None:
+                continue
+            docs, tfs = self.postings(term_id)
+            scores[docs] += self.term_scores(term_id, docs, tfs)
+            matched.append(docs)
+        if not matched:
+            return np.zeros(0, dtype=np.int32), scores
+        candidates = np.unique(np.concatenate(matched))
+        # Removed documents keep their postings until the next merge
+        return candidates[self.alive[candidates]], scores
+
+    def zero_fill(self, top, n):
+        # Documents without any query term score 0 and follow in index order
+        if len(top) < n:
+            matched = set(top)
+            rest = (
+                i
+                for i in range(len(self.doc_lens))
+                if i not in matched and self.alive[i]
+            )
+            top += list(islice(rest, n - len(top)))
+        return top
+
+    def top_n_ids(self, query, n=5):
+        query_terms = self.tokenize(query)
+        with self.lock:
+            top = self.max_score_top_n(query_terms, n)
+            if top is None:
+                top = self.exhaustive_top_n(query_terms, n)
+        return top
+
+    def exhaustive_top_n(self, query_terms, n):
+        candidates, scores = self.score_query(query_terms)
+        # Highest score first, ties in index order like a stable sort
+        top = heapq.nsmallest(n, candidates.tolist(), key=lambda i: (-scores[i], i))
+        top = self.zero_fill(top, n)
+        return [(i, float(scores[i])) for i in top]
+
+    def upper_bounds(self):
+        """Most each term can add to a score, from its largest tf and shortest document"""
+        if self.bounds is None:
+            tfs = self.max_tfs.astype(np.float64)
+            norms = self.k1 * (
+                1 - self.b + self.b * self.min_lens / (self.avgdl or 1.0)
+            )
+            self.bounds = self.idfs * ((tfs * (self.k1 + 1)) / (tfs + norms))
+        return self.bounds
+
+    def score_docs(self, docs, term_ids, postings):
+        matches = {}
+        for term_id in set(term_ids):
+            term_docs, tfs = postings[term_id]
+            if len(term_docs) == 0:
+                continue
+            positions = np.minimum(np.searchsorted(term_docs, docs), len(term_docs) - 1)
+            found = np.flatnonzero(term_docs[positions] == docs)
+            matches[term_id] = found, self.term_scores(
+                term_id, docs[found], tfs[positions[found]]
+            )
+        scores = np.zeros(len(docs))
+        # Query order with repeats, so every sum matches score_query bit for bit
+        for term_id in term_ids:
+            if term_id in matches:
+                found, term_scores = matches[term_id]
+                scores[found] += term_scores
+        return scores
+
+    def max_score_top_n(self, query_terms, n):
+        """
+        Exact top n with MaxScore pruning, or None when pruning cannot help.
+        Documents found only in terms whose upper bounds add up to less than
+        the n-th best score seen so far are never scored.
+        """
+        term_ids = [self.vocab[term] for term in query_terms if term in self.vocab]
+        if n <= 0 or not term_ids:
+            return None
+        unique, counts = np.unique(term_ids, return_counts=True)
+        if len(unique) < 2:
+            return None
+        # Slack for rounding, a bound must never fall below a score it covers
+        bounds = self.upper_bounds()[unique] * counts * (1 + 1e-9)
+        postings = {term_id: self.postings(term_id) for term_id in unique.tolist()}
+
+        # Threshold from the documents of the highest bound terms
+        seed = []
+        for j in np.argsort(-bounds, kind="stable"):
+            seed.append(postings[unique[j]][0])
+            candidates = np.unique(np.concatenate(seed))
+            candidates = candidates[self.alive[candidates]]
+            if len(candidates) >= n:
+                break
+        else:
+            return None
+        scores = self.score_docs(candidates, term_ids, postings)
+        threshold = np.partition(scores, len(scores) - n)[len(scores) - n]
+
+        # Lowest bound terms that together cannot reach the threshold only
+        # matter for documents that also contain an essential term
+        ascending = np.argsort(bounds, kind="stable")
+        skipped = int(np.count_nonzero(np.cumsum(bounds[ascending]) < threshold))
+        if skipped == 0:
+            return None
+        essential = unique[ascending[skipped:]].tolist()
+        candidates = np.unique(
+            np.concatenate([postings[term_id][0] for term_id in essential])
+        )
+        candidates = candidates[self.alive[candidates]]
+        scores = self.score_docs(candidates, term_ids, postings)
+        order = np.lexsort((candidates, -scores))[:n]
+        return [(int(candidates[i]), float(scores[i])) for i in order]
+
+    def weight_matrix(self):
+        """Term x document BM25 weights, the postings arrays already are its CSR layout"""
+        with self.lock:
+            if self.weights is None:
+                post_ptr, post_docs, post_tfs = (
+                    self.post_ptr,
+                    self.post_docs,
+                    self.post_tfs,
+                )
+                if self.buffer_docs or self.pending_deletes:
+                    post_ptr, post_docs, post_tfs = MergePostings(
+                        post_ptr,
+                        post_docs,
+                        post_tfs,
+                        self.buffer_docs,
+                        self.buffer_tfs,
+                        self.alive,
+                    )
+                tfs = post_tfs.astype(np.float64)
+                data = np.repeat(self.idfs, np.diff(post_ptr)) * (
+                    (tfs * (self.k1 + 1)) / (tfs + self.norms[post_docs])
+                )
+                self.weights = sparse.csr_matrix(
+                    (data, post_docs, post_ptr),
+                    shape=(len(self.vocab), len(self.doc_lens)),
+                )
+            return self.weights
+
+    def query_matrix(self, queries):
+        """Query x term counts, repeated query terms count once per occurrence"""
+        rows, cols, counts = [], [], []
+        for row, query in enumerate(queries):
+            for term, count in Counter(self.tokenize(query)).items():
+                term_id = self.vocab.get(term)
+                if term_id is not None:
+                    rows.append(row)
+                    cols.append(term_id)
+                    counts.append(count)
+        return sparse.csr_matrix(
+            (counts, (rows, cols)),
+            shape=(len(queries), len(self.vocab)),
+            dtype=np.float64,
+        )
+
+    def top_n_ids_batch(self, queries, n=5, chunk_size=1024):
+        """
+        top_n_ids for many queries, scored with one sparse product per chunk.
+        Scores are summed in a different order, so documents whose scores tie
+        exactly in theory can swap places relative to top_n_ids.
+        """
         results = []
-        for i, score in sorted_scores[:n]:
-            results.append({
-                "id": self.txt_ids[i],  # 'key' from JSON
-                "text": self.original_texts[i],
-                "recipe": self.data[i]
-            })
+        for start in range(0, len(queries), chunk_size):
+            with self.lock:
+                scores = (
+                    self.query_matrix(queries[start : start + chunk_size])
+                    @ self.weight_matrix()
+                )
+            for row in range(scores.shape[0]):
+                docs = scores.indices[scores.indptr[row] : scores.indptr[row + 1]]
+                values = scores.data[scores.indptr[row] : scores.indptr[row + 1]]
+                if len(values) > n:
+                    # Keep everything tied with the n-th best so ties still go by index
+                    kth = values[np.argpartition(-values, n - 1)[n - 1]]
+                    keep = values >= kth
+                    docs, values = docs[keep], values[keep]
+                order = np.lexsort((docs, -values))[:n]
+                top = [(int(docs[i]), float(values[i])) for i in order]
+                ids = self.zero_fill([i for i, score in top], n)
+                results.append(top + [(i, 0.0) for i in ids[len(top) :]])
         return results
 
+    def hits(self, ids, scores=None):
+        results = []
+        for i, recipe in zip(ids, self.documents(ids)):
+            results.append(
+                {
+                    "id": self.txt_ids[i],  # 'key' from JSON
+                    "text": RecipeText(recipe) if recipe else "",
+                    "recipe": recipe,
+                }
+            )
+        if scores is not None:
+            for result, score in zip(results, scores):
+                result["score"] = score
+        return results
 
-    
+    def get_top_n(self, query, n=5, return_ids=False, id_key="id"):
+        top = self.top_n_ids(query, n)
+        return self.hits([i for i, score in top], [score for i, score in top])
+
+    def get_top_n_batch(self, queries, n=5):
+        tops = self.top_n_ids_batch(queries, n)
+        ids = sorted(set(i for top in tops for i, score in top))
+        recipes = dict(zip(ids, self.documents(ids)))
+        return [
+            [
+                {
+                    "id": self.txt_ids[i],
+                    "text": RecipeText(recipes[i]) if recipes[i] else "",
+                    "recipe": recipes[i],
+                }
+                for i, score in top
+            ]
+            for top in tops
+        ]
+
+
+NO_LENGTH = np.iinfo(np.int32).max
+
+
+def TermBounds(post_ptr, post_docs, post_tfs, doc_lens):
+    """Largest tf and shortest document length in each term's postings"""
+    terms = len(post_ptr) - 1
+    max_tfs = np.zeros(terms, dtype=np.int32)
+    min_lens = np.full(terms, NO_LENGTH, dtype=np.int32)
+    nonempty = np.flatnonzero(np.diff(post_ptr))
+    if len(nonempty):
+        starts = np.asarray(post_ptr)[:-1][nonempty]
+        max_tfs[nonempty] = np.maximum.reduceat(post_tfs, starts)
+        min_lens[nonempty] = np.minimum.reduceat(
+            np.asarray(doc_lens)[post_docs], starts
+        )
+    return max_tfs, min_lens
+
+
+def Idfs(dfs, N):
+    return np.array(
+        [math.log(1 + (N - df + 0.5) / (df + 0.5)) for df in dfs.tolist()],
+        dtype=np.float64,
+    )
+
+
+def ForwardIndex(post_ptr, post_docs, n_docs):
+    """Term ids of each document, the postings transposed from CSR to CSC"""
+    terms = len(post_ptr) - 1
+    matrix = sparse.csr_matrix(
+        (
+            np.ones(len(post_docs), dtype=np.int8),
+            np.asarray(post_docs),
+            np.asarray(post_ptr),
+        ),
+        shape=(terms, n_docs),
+    ).tocsc()
+    return matrix.indptr.astype(np.int64), matrix.indices.astype(np.int32)
+
+
+def MergePostings(post_ptr, post_docs, post_tfs, buffer_docs, buffer_tfs, alive):
+    """CSR postings of merged plus buffered documents, without removed ones"""
+    terms = len(post_ptr) - 1
+    term_ids = [np.repeat(np.arange(terms), np.diff(post_ptr))]
+    docs = [np.asarray(post_docs)]
+    tfs = [np.asarray(post_tfs)]
+    for term_id, buffered in buffer_docs.items():
+        term_ids.append(np.full(len(buffered), term_id))
+        docs.append(np.array(buffered, dtype=np.int32))
+        tfs.append(np.array(buffer_tfs[term_id], dtype=np.int32))
+    term_ids, docs, tfs = (
+        np.concatenate(term_ids),
+        np.concatenate(docs),
+        np.concatenate(tfs),
+    )
+
+    keep = alive[docs]
+    term_ids, docs, tfs = term_ids[keep], docs[keep], tfs[keep]
+    # Stable, so each term's documents stay in doc id order
+    order = np.argsort(term_ids, kind="stable")
+    counts = np.bincount(
+        term_ids, minlength=max(terms, int(term_ids.max(initial=-1)) + 1)
+    )
+    return (
+        np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+        docs[order],
+        tfs[order],
+    )
+
+
+_worker_tokenizer = None
+
+
+def InitTokenizerWorker():
+    global _worker_tokenizer
+    _worker_tokenizer = BM25.__new__(BM25)
+    _worker_tokenizer.init_tokenizer()
+
+
+def TokenizeShard(texts):
+    return [_worker_tokenizer.tokenize(text) for text in texts]
+
+
+def IndexStamp(path):
+    """Version directory CURRENT points at, or the meta.json mtime of an
+    index saved directly in path, None without an index"""
+    try:
+        with open(join(path, CURRENT_FILE), "r", encoding="utf-8") as file:
+            return file.read().strip()
+    except FileNotFoundError:
+        pass
+    try:
+        return os.stat(join(path, "meta.json")).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def DeltaSize(path, stamp):
+    try:
+        return os.stat(join(IndexDir(path, stamp), DELTA_FILE)).st_size
+    except FileNotFoundError:
+        return 0
+
+
+def IndexDir(path, stamp):
+    # Indexes saved before versioning have their files directly in path
+    return join(path, stamp) if isinstance(stamp, str) else path
+
+
+def PruneVersions(path, keep=KEEP_VERSIONS):
+    current = IndexStamp(path)
+    # Version names are "<time_ns>-<pid>", unfinished ones end in .tmp
+    versions = sorted(
+        (name for name in os.listdir(path) if name.replace("-", "").isdigit()),
+        key=lambda name: [int(part) for part in name.split("-")],
+    )
+    # Workers that mapped a pruned version keep reading it until they reload
+    for name in versions[:-keep]:
+        if name != current:
+            shutil.rmtree(join(path, name), ignore_errors=True)
+    if isinstance(current, str):
+        for name in INDEX_ARRAYS:
+            FileRemove(join(path, name + ".npy"))
+        for name in ["vocab.json", "keys.json", "added.json", "meta.json"]:
+            FileRemove(join(path, name))
+
+
+def FileRemove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def LoadIndex(path=index_path, retries=LOAD_RETRIES):
+    for attempt in range(retries):
+        try:
+            return BM25.load(path)
+        except OSError:
+            if attempt == retries - 1:
+                raise
+            time.sleep(LOAD_RETRY_DELAY)
+
+
+@contextmanager
+def IndexLock(path):
+    # One process builds the index while the others wait and load its build
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(path, exist_ok=True)
+    with open(join(path, ".lock"), "w") as file:
+        fcntl.flock(file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(file, fcntl.LOCK_UN)
+
+
+def BuildIndex(passage_path=passage_path, path=index_path):
+    """Load the saved index, building it first if missing or older than the passages"""
+    source_mtime = (
+        os.stat(passage_path).st_mtime if os.path.exists(passage_path) else None
+    )
+
+    def load():
+        try:
+            bm25 = LoadIndex(path, retries=1)
+        except (OSError, ValueError):
+            return None
+        return bm25 if source_mtime in (None, bm25.source_mtime) else None
+
+    bm25 = load()
+    if bm25 is None:
+        with IndexLock(path):
+            # Another process may have built it while this one waited
+            bm25 = load()
+            if bm25 is None:
+                logger.info("Building the BM25 index from %s", passage_path)
+                BM25(passage_path).save(path, source_mtime)
+                bm25 = BM25.load(path)
+    return bm25
+
+
+_bm25 = None
+_bm25_lock = threading.Lock()
+_bm25_checked = 0.0
+# (stamp, delta size) that last failed to load
+_bm25_failed = None
+
+
+def WarmBM25(passage_path=passage_path, path=index_path):
+    # Called at startup, so no request waits for a build
+    global _bm25
+    bm25 = BuildIndex(passage_path, path)
+    with _bm25_lock:
+        _bm25 = bm25
+
+
+def GetBM25(passage_path=passage_path, path=index_path):
+    # Load the saved index once per process and follow what update_index.py
+    # saves: changes to the loaded version are replayed onto it, a new
+    # version is loaded. Requests never rebuild it, that is for
+    # build_index.py or WarmBM25 at startup
+    global _bm25, _bm25_checked, _bm25_failed
+    with _bm25_lock:
+        if _bm25 is not None and time.monotonic() - _bm25_checked < RELOAD_INTERVAL:
+            return _bm25
+        _bm25_checked = time.monotonic()
+        stamp = IndexStamp(path)
+        delta_size = DeltaSize(path, stamp)
+        if _bm25 is None:
+            _bm25 = BuildIndex(passage_path, path)
+            return _bm25
+        if stamp is None or (stamp, delta_size) in (
+            (_bm25.stamp, _bm25.delta_size),
+            _bm25_failed,
+        ):
+            return _bm25
+        if stamp == _bm25.stamp and delta_size >= _bm25.delta_end:
+            try:
+                _bm25.replay(join(IndexDir(path, stamp), DELTA_FILE), _bm25.delta_end)
+                return _bm25
+            except (OSError, ValueError):
+                logger.exception(
+                    "Could not replay BM25 index changes, reloading version %s", stamp
+                )
+        try:
+            _bm25 = LoadIndex(path)
+        except (OSError, ValueError):
+            # Keep serving what is loaded, and only try again once it changes
+            logger.exception(
+                "Could not load BM25 index version %s, serving %s", stamp, _bm25.stamp
+            )
+            _bm25_failed = (stamp, delta_size)
+            return _bm25
+        source_mtime = (
+            os.stat(passage_path).st_mtime if os.path.exists(passage_path) else None
+        )
+        if source_mtime not in (None, _bm25.source_mtime):
+            logger.warning(
+                "BM25 index is older than %s, run build_index.py", passage_path
+            )
+        return _bm25
+
+
+def QueryKey(query):
+    # Same lemmatized tokens in any order retrieve the same recipes
+    return " ".join(sorted(GetBM25().tokenize(query)))
+
+
+def IndexVersion():
+    return GetBM25().version
+
+
+def RetrievalVersion():
+    """Index version plus every setting the ranked results depend on, for
+    keying cached results"""
+    parts = [IndexVersion(), RERANKER_BACKEND, RERANKER_MODEL_PATH]
+    if HYBRID_RETRIEVAL:
+        parts += ["hybrid", GetDenseIndex().version, DENSE_ENCODER, DENSE_ENCODER_PATH]
+    elif RERANK_CASCADE:
+        cascade = json.dumps(GetCascade(), sort_keys=True).encode("utf-8")
+        parts += ["cascade", hashlib.sha1(cascade).hexdigest()[:12]]
+    return ":".join(parts)
+
+
+# Local model directory or hub id, and "torch" (fp32), "int8" (dynamic
+# quantization of the Linear layers) or "onnx" (ONNX Runtime on CPU)
+RERANKER_MODEL_PATH = os.environ.get(
+    "RERANKER_MODEL_PATH", "cross-encoder/ms-marco-MiniLM-L6-v2"
+)
+RERANKER_BACKEND = os.environ.get("RERANKER_BACKEND", "torch")
+
+_cross_encoders = {}
+_cross_encoders_lock = threading.Lock()
+
+
+def GetCrossEncoder(model_path=RERANKER_MODEL_PATH, backend=RERANKER_BACKEND):
+    # Loaded once per process and backend, then kept resident
+    with _cross_encoders_lock:
+        key = (model_path, backend)
+        if key not in _cross_encoders:
+            local = os.path.isdir(model_path)
+            if backend == "onnx":
+                model = CrossEncoder(
+                    model_path, device="cpu", backend="onnx", local_files_only=local
+                )
+            elif backend == "int8":
+                model = CrossEncoder(model_path, device="cpu", local_files_only=local)
+                model.model = torch.quantization.quantize_dynamic(
+                    model.model, {torch.nn.Linear}, dtype=torch.qint8
+                )
+            elif backend == "torch":
+                model = CrossEncoder(model_path, local_files_only=local)
+            else:
+                raise ValueError("Unknown reranker backend {}".format(backend))
+            _cross_encoders[key] = model
+        return _cross_encoders[key]
+
+
+def Reranker(query, model_path, old_results, n=5, backend=RERANKER_BACKEND, depth=None):
+    # Only the first depth hits (all n by default) go through the model,
+    # the rest keep their first stage order. "similarity" is only ever a
+    # cross-encoder score, None for hits the model didn't see, and "source"
+    # says which stage placed the hit
+    depth = n if depth is None else min(depth, n)
+    results = []
+    if depth > 0:
+        # Get the resident model for inference
+        model = GetCrossEncoder(model_path, backend)
+
+        passages = [result["text"] for result in old_results[:depth]]
+
+        ranks = model.rank(query, passages)
+
+        results = [
+            {
+                "recipe": old_results[rank["corpus_id"]]["recipe"],
+                "similarity": float(rank["score"]),
+                "bm25_score": old_results[rank["corpus_id"]].get("score"),
+                "source": "cross_encoder",
+            }
+            for rank in ranks
+        ]
+    results += [
+        {
+            "recipe": result["recipe"],
+            "similarity": None,
+            "bm25_score": result.get("score"),
+            "source": "bm25",
+        }
+        for result in old_results[depth:n]
+    ]
 
-def Reranker(query, model_path, old_results, n = 5):    
-    #Load model for inference
-    model = CrossEncoder(model_path)
-    
-    passages = [result["text"] for result in old_results[:n]]
-    
-    ranks = model.rank(query, passages)
-    
-    results = [{"recipe" : old_results[rank['corpus_id']]["recipe"],
-                "similarity": float(rank['score'])} for rank in ranks]
-        
     # Return predicted recipes
     return results
+
+
+def Confidence(result):
+    """Cross-encoder relevance in [0, 1], None when the cross-encoder didn't score the hit"""
+    if result.get("similarity") is None:
+        return None
+    # The ms-marco cross-encoders output logits
+    return 1.0 / (1.0 + math.exp(-result["similarity"]))
+
+
+def CheckRerankerAccuracy(
+    queries, passages_per_query, backend, model_path=RERANKER_MODEL_PATH, k=5
+):
+    """Compare a backend's rankings with fp32 on the same candidate lists"""
+    reference = GetCrossEncoder(model_path, "torch")
+    candidate = GetCrossEncoder(model_path, backend)
+    top1 = 0
+    overlap = 0.0
+    max_score_diff = 0.0
+    for query, passages in zip(queries, passages_per_query):
+        expected = reference.rank(query, passages)
+        actual = candidate.rank(query, passages)
+        top1 += expected[0]["corpus_id"] == actual[0]["corpus_id"]
+        overlap += len(
+            set(rank["corpus_id"] for rank in expected[:k])
+            & set(rank["corpus_id"] for rank in actual[:k])
+        ) / min(k, len(passages))
+        scores = {rank["corpus_id"]: rank["score"] for rank in expected}
+        max_score_diff = max(
+            max_score_diff,
+            max(abs(scores[rank["corpus_id"]] - rank["score"]) for rank in actual),
+        )
+    return {
+        "top1_agreement": top1 / len(queries),
+        "overlap_at_{}".format(k): overlap / len(queries),
+        "max_score_diff": float(max_score_diff),
+    }
     
     
+def ReciprocalRankFusion(rankings, k=RRF_K):
+    """Ids from several best-first rankings ordered by sum of 1 / (k + rank)"""
+    scores = {}
+    for ranking in rankings:
+        for rank, i in enumerate(ranking, 1):
+            scores[i] = scores.get(i, 0.0) + 1.0 / (k + rank)
+    # Stable sort, so ties keep the order ids were first seen in
+    return sorted(scores, key=lambda i: -scores[i])
+
+
+_dense_alignment = {}
+
+
+def DenseToBM25(bm25, dense):
+    # Dense ids mapped to BM25 ids (-1 when missing), redone when either index changes
+    key = (bm25.version, id(dense))
+    alignment = _dense_alignment.get(key)
+    if alignment is None:
+        key_ids = {doc_key: i for i, doc_key in enumerate(bm25.txt_ids)}
+        alignment = np.array([key_ids.get(doc_key, -1) for doc_key in dense.keys])
+        _dense_alignment.clear()
+        _dense_alignment[key] = alignment
+    return alignment
+
+
+def HybridTopN(bm25, dense, query, n=5):
+    # Zero score BM25 fill has no evidence behind it, leave it out of the fusion
+    lexical = [i for i, score in bm25.top_n_ids(query, n) if score > 0]
+    alignment = DenseToBM25(bm25, dense)
+    semantic = [
+        int(alignment[i]) for i, score in dense.search(query, n) if alignment[i] >= 0
+    ]
+    return bm25.hits(ReciprocalRankFusion([lexical, semantic])[:n])
+
+
+def LoadCascade(path=cascade_path):
+    # Thresholds written by calibrate_cascade.py, without them every query is reranked
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+_cascade = None
+
+
+def GetCascade():
+    global _cascade
+    if _cascade is None:
+        _cascade = LoadCascade() or {}
+    return _cascade
+
+
+def ScoreRatio(scores, rank):
+    # How far the best BM25 score is ahead of the score at the given rank
+    if not scores or scores[0] <= 0:
+        return 0.0
+    other = scores[min(rank, len(scores)) - 1]
+    return float("inf") if other <= 0 else scores[0] / other
+
+
+def CascadeDepth(scores, n, cascade):
+    """How many BM25 hits to rerank, 0 when BM25 alone is decisive"""
+    if not cascade:
+        return n
+    ratio = ScoreRatio(scores, cascade["rank"])
+    # None disables a stage
+    if cascade["skip_ratio"] is not None and ratio >= cascade["skip_ratio"]:
+        return 0
+    if cascade["shrink_ratio"] is not None and ratio >= cascade["shrink_ratio"]:
+        return cascade["shrink_depth"]
+    return n
+
+
+if RERANK_CASCADE and HYBRID_RETRIEVAL:
+    # The thresholds are calibrated on BM25 scores, fused results carry none
+    logger.warning(
+        "RERANK_CASCADE is ignored with HYBRID_RETRIEVAL, every query is reranked"
+    )
+
+
 def GetRecipe(query, n = 5):
     #Get dish class
     
-    project_root = dirname(dirname(__file__))
-    data_path = join(project_root, "data")
-    passage_path = join(data_path, "all_recipes.json")
-    model_path = "cross-encoder/ms-marco-MiniLM-L6-v2"
+    model_path = RERANKER_MODEL_PATH
     
-    Ridentifier = BM25(passage_path)
-    results = Ridentifier.get_top_n(query, n=n*10)
-    results = Reranker(query, model_path, results, n=n)
+    Ridentifier = GetBM25()
+    depth = n
+    if HYBRID_RETRIEVAL:
+        results = HybridTopN(Ridentifier, GetDenseIndex(), query, n=n * 10)
+    else:
+        results = Ridentifier.get_top_n(query, n=n * 10)
+        if RERANK_CASCADE:
+            depth = CascadeDepth(
+                [result["score"] for result in results], n, GetCascade()
+            )
+    results = Reranker(query, model_path, results, n=n, depth=depth)
     print(len(results))
     
     return results
@@ -0,0 +1,81 @@
+import argparse
+import time
+
+from bson import ObjectId
+
+from reranker import BM25, index_path
+from recipe_codec import load_codec
+from save_data_locally import connect_to_mongodb, decompress_data, sanitize_recipe
+
+
+# Recipes written after the checkpoint, oldest first. The scraper stamps a
+# whole batch with one updated_at, so _id breaks ties
+def NewRecipes(collection, checkpoint, limit):
+    query = {"updated_at": {"$exists": True}}
+    if checkpoint is not None:
+        updated_at, object_id = checkpoint
+        query = {
+            "$or": [
+                {"updated_at": {"$gt": updated_at}},
+                {"updated_at": updated_at, "_id": {"$gt": ObjectId(object_id)}},
+            ]
+        }
+    return list(collection.find(query).sort([("updated_at", 1), ("_id", 1)]).limit(limit))
+
+
+# The fields save_data_locally.py exports to the JSON dump
+def RecipeFields(document, codec=None):
+    recipe = sanitize_recipe(decompress_data(document["data"], codec))
+    return {
+        "recipe_name": recipe["recipe_name"],
+        "key": recipe["key"],
+        "ingredients": recipe["ingredients"],
+        "steps": recipe["steps"],
+        "breadcrumbs": recipe["breadcrumbs"],
+        "url": recipe["url"],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Apply recipes written to Mongo since the index checkpoint"
+    )
+    parser.add_argument("--index", default=index_path)
+    parser.add_argument("--batch", type=int, default=500)
+    parser.add_argument("--follow", action="store_true", help="keep polling for new recipes")
+    parser.add_argument("--interval", type=float, default=5.0, help="seconds between polls")
+    args = parser.parse_args()
+
+    db = connect_to_mongodb()
+    collection = db["recipes"]
+    # Fetches dictionaries trained after it started from the db
+    codec = load_codec(db)
+    bm25 = BM25.load(args.index)
+    # A fresh build covers everything up to the dump it was built from
+    if bm25.checkpoint is None and bm25.source_mtime is not None:
+        bm25.checkpoint = [bm25.source_mtime, str(ObjectId("0" * 24))]
+
+    while True:
+        documents = NewRecipes(collection, bm25.checkpoint, args.batch)
+        if documents:
+            start_time = time.time()
+            recipes = []
+            for document in documents:
+                try:
+                    recipes.append(RecipeFields(document, codec))
+                except Exception as e:
+                    print(f"Skipping {document['_id']}: {e}")
+            bm25.add_documents(recipes)
+            indexed = time.time() - start_time
+            bm25.checkpoint = [documents[-1]["updated_at"], str(documents[-1]["_id"])]
+            # Saving is what makes the recipes visible to the serving processes
+            bm25.save(args.index)
+            print(
+                "Applied {} recipes in {:.2f}s, searchable after {:.2f}s, {} documents".format(
+                    len(recipes), indexed, time.time() - start_time, bm25.N
+                )
+            )
+        if len(documents) < args.batch:
+            if not args.follow:
+                break
+            time.sleep(args.interval)
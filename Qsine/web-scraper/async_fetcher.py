@@ -0,0 +1,66 @@
+import asyncio
+
+import aiohttp
+from requests.exceptions import RetryError
+from urllib3.util.retry import RequestHistory
+
+
+class AsyncFetcher:
+    """One long-lived aiohttp connection pool for the asyncio crawl mode
+
+    Retries follow the urllib3 Retry given to the threaded session: the same
+    budget, status codes, backoff and Retry-After handling, and the same
+    RetryError once the budget is spent on bad statuses.
+    """
+
+    def __init__(self, retry, max_in_flight=20, headers=None, timeout=30):
+        self.retry = retry
+        self.max_in_flight = max_in_flight
+        self.headers = headers
+        self.timeout = timeout
+        self.session = None
+        self.in_flight = None
+
+    async def __aenter__(self):
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_in_flight),
+            headers=self.headers,
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+        self.in_flight = asyncio.Semaphore(self.max_in_flight)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+
+    def increment(self, retry, url, error=None, status=None):
+        return retry.new(
+            total=retry.total - 1,
+            history=retry.history + (RequestHistory("GET", url, error, status, None),),
+        )
+
+    async def get(self, url):
+        """Status code and body of url"""
+        retry = self.retry
+        while True:
+            try:
+                async with self.in_flight, self.session.get(url) as response:
+                    retry_after = response.headers.get("Retry-After")
+                    if not retry.is_retry("GET", response.status, retry_after is not None):
+                        return response.status, await response.text(errors="replace")
+                    status = response.status
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                retry = self.increment(retry, url, error=e)
+                if retry.is_exhausted():
+                    raise
+                delay = retry.get_backoff_time()
+            else:
+                retry = self.increment(retry, url, status=status)
+                if retry.is_exhausted():
+                    raise RetryError(f"Max retries exceeded for {url}: too many {status} responses")
+                if retry_after is not None and retry.respect_retry_after_header:
+                    delay = retry.parse_retry_after(retry_after)
+                else:
+                    delay = retry.get_backoff_time()
+            # Backing off doesn't hold one of the in-flight slots
+            await asyncio.sleep(delay)
@@ -0,0 +1,68 @@
+import argparse
+import time
+from types import SimpleNamespace
+
+from fixture_server import start_fixture_server
+from crawl_journal import MemoryJournal
+from main import AllrecipesSearch
+
+
+class OfflineSearch(AllrecipesSearch):
+    """AllrecipesSearch keeping its state in memory instead of Mongo"""
+
+    def connect_to_mongodb(self):
+        return SimpleNamespace(recipes=None, failures=None)
+
+    def journal_backend(self):
+        return MemoryJournal()
+
+    def load_legacy_state(self):
+        self.frontier.push(self.start_url)
+        return 0
+
+    def load_failures(self):
+        self.failures = set()
+        self.saved = []
+
+    def add_failure(self, url):
+        self.failures.add(url)
+
+    def write(self, recipes, entries, snapshot=None):
+        self.saved += recipes
+        self.journal.write(entries, snapshot)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Crawl pages/sec of each mode against the fixture server")
+    parser.add_argument("--pages", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.02, help="mean seconds per response")
+    parser.add_argument("--slow-share", type=float, default=0.02, help="share of responses delayed by --slow-latency")
+    parser.add_argument("--slow-latency", type=float, default=0.5)
+    parser.add_argument("--concurrency", type=int, default=10, help="thread pool size and requests in flight")
+    parser.add_argument("--modes", default="threads,async")
+    parser.add_argument("--parse-workers", type=int, default=4)
+    args = parser.parse_args()
+
+    server, base_url = start_fixture_server(
+        args.pages, latency=args.latency, slow_share=args.slow_share, slow_latency=args.slow_latency
+    )
+    print(f"{args.pages} fixture recipes, {args.latency * 1000:.0f} ms mean latency, {args.concurrency} concurrent")
+    print(f"{'mode':>8}{'pages':>8}{'recipes':>9}{'requests':>10}{'seconds':>9}{'pages/s':>9}")
+    for mode in args.modes.split(","):
+        search = OfflineSearch(start_url=base_url, crawl_mode=mode)
+        search.max_workers = args.concurrency
+        search.max_in_flight = args.concurrency
+        search.parse_workers = args.parse_workers
+        requests_before = server.requests
+        start_time = time.perf_counter()
+        search.search()
+        seconds = time.perf_counter() - start_time
+        pages = search.pages_checked
+        print(
+            f"{mode:>8}{pages:>8}{len(search.saved):>9}{server.requests - requests_before:>10}"
+            f"{seconds:>9.2f}{pages / seconds:>9.1f}"
+        )
+        if mode == "async":
+            for stage in search.stages.values():
+                print(f"{'':>8}{stage.report()}")
+    server.shutdown()
@@ -0,0 +1,114 @@
+import argparse
+import random
+import time
+import tracemalloc
+
+from frontier import BloomFilter, FingerprintSet, Frontier, canonicalize_url, url_fingerprint
+
+
+def crawl_urls(count, rng):
+    """allrecipes style links, some spelled differently from the page they point to"""
+    urls = []
+    for i in range(count):
+        if rng.random() < 0.7:
+            url = f"https://www.allrecipes.com/recipe/{i}/dish-{i}/"
+        else:
+            url = f"https://www.allrecipes.com/recipes/{i}/hub-{i}/"
+        spelling = rng.random()
+        if spelling < 0.05:
+            url = url.upper().replace("HTTPS://", "https://")
+        elif spelling < 0.1:
+            url = url.rstrip("/")
+        elif spelling < 0.15:
+            url += "?utm_source=feed"
+        urls.append(url)
+    return urls
+
+
+def measure(build):
+    # Timed and traced apart, tracemalloc slows every allocation down
+    start_time = time.perf_counter()
+    result = build()
+    seconds = time.perf_counter() - start_time
+    del result
+    tracemalloc.start()
+    result = build()
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, seconds, memory
+
+
+def lookups_per_second(seen, keys):
+    start_time = time.perf_counter()
+    for key in keys:
+        key in seen
+    return len(keys) / (time.perf_counter() - start_time)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Seen-set memory and ops/sec, frontier updates per page")
+    parser.add_argument("--urls", type=int, default=1_000_000)
+    parser.add_argument("--error-rate", type=float, default=0.001)
+    parser.add_argument("--lookups", type=int, default=200_000)
+    parser.add_argument("--pages", type=int, default=2000, help="pages for the frontier update comparison")
+    parser.add_argument("--links", type=int, default=8, help="links found per page")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    urls = crawl_urls(args.urls, rng)
+    start_time = time.perf_counter()
+    canonical = [canonicalize_url(url) for url in urls]
+    canonicalize_seconds = time.perf_counter() - start_time
+    fingerprints = [url_fingerprint(url) for url in canonical]
+    unseen = [url_fingerprint(f"https://www.allrecipes.com/recipe/{i}/unseen/") for i in range(args.lookups)]
+    print(f"{args.urls} URLs, canonicalized at {args.urls / canonicalize_seconds:,.0f}/s")
+
+    def fill(seen, keys):
+        for key in keys:
+            seen.add(key)
+        return seen
+
+    candidates = [
+        # Fresh copies, so the strings count against the set as they did in checked_urls
+        (
+            "set of URLs",
+            lambda: fill(set(), (url.encode().decode() for url in canonical)),
+            canonical,
+            [f"{url}x" for url in canonical[: args.lookups]],
+        ),
+        ("fingerprints", lambda: fill(FingerprintSet(), fingerprints), fingerprints, unseen),
+        (f"bloom {args.error_rate}", lambda: fill(BloomFilter(args.urls, args.error_rate), fingerprints), fingerprints, unseen),
+    ]
+    print(f"{'seen-set':>16}{'MB':>9}{'B/URL':>7}{'adds/s':>12}{'hits/s':>12}{'misses/s':>12}{'false +':>9}")
+    for name, build, keys, misses in candidates:
+        seen, seconds, memory = measure(build)
+        hits = keys[: args.lookups]
+        false_positives = sum(key in seen for key in misses) / len(misses)
+        print(
+            f"{name:>16}{memory / 2 ** 20:>9.1f}{memory / args.urls:>7.1f}{args.urls / seconds:>12,.0f}"
+            f"{lookups_per_second(seen, hits):>12,.0f}{lookups_per_second(seen, misses):>12,.0f}{false_positives:>9.4f}"
+        )
+        del seen
+
+    # Frontier update per crawled page: the old list(set()) rebuild against push/pop
+    backlog = urls[: args.urls // 2]
+    found = [rng.sample(urls, args.links) for _ in range(args.pages)]
+
+    to_check_urls = list(set(backlog))
+    start_time = time.perf_counter()
+    for links in found:
+        to_check_urls.pop()
+        to_check_urls = list(set(to_check_urls + links))
+    rebuild = (time.perf_counter() - start_time) / args.pages
+
+    frontier = Frontier()
+    frontier.extend(backlog)
+    start_time = time.perf_counter()
+    for links in found:
+        frontier.pop()
+        frontier.extend(links)
+    update = (time.perf_counter() - start_time) / args.pages
+    print(
+        f"frontier of {len(backlog)} URLs, per page: list(set()) {rebuild * 1000:.2f} ms, "
+        f"Frontier {update * 1000:.3f} ms ({rebuild / update:,.0f}x)"
+    )
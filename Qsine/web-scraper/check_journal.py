@@ -0,0 +1,141 @@
+import argparse
+import os
+import random
+import shutil
+import tempfile
+
+from crawl_journal import CrawlJournal, FileJournal, MemoryJournal, MongoJournal
+from frontier import BloomFilter, Frontier, canonicalize_url
+
+# Runs a random crawl against every journal backend, crashes it now and then
+# and checks each backend recovers what the in-memory stand-in recovers, and
+# what was durable when the crash came
+
+
+class Tee:
+    """Backend writing to several backends at once"""
+
+    def __init__(self, backends):
+        self.backends = backends
+
+    def append(self, entries):
+        for backend in self.backends.values():
+            backend.append(entries)
+
+    def save_snapshot(self, snapshot):
+        for backend in self.backends.values():
+            backend.save_snapshot(snapshot)
+
+
+def seen_fingerprints(frontier):
+    if isinstance(frontier.seen, BloomFilter):
+        return frontier.seen.to_bytes()
+    return {int(fingerprint) for fingerprint in frontier.seen.sorted} | frontier.seen.buffer
+
+
+def link(rng, pages):
+    page = rng.randrange(pages)
+    url = f"https://www.allrecipes.com/{rng.choice(['recipe', 'recipes'])}/{page}/dish-{page}/"
+    # Spellings canonicalization folds together
+    return rng.choice([url, url.rstrip("/"), url + "?utm_source=feed", url.replace("dish", "DISH")])
+
+
+def recover(backend):
+    journal = CrawlJournal(backend)
+    frontier = Frontier()
+    pages_checked = journal.recover(frontier)
+    return journal, frontier, pages_checked
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check crawl journal recovery on every backend")
+    parser.add_argument("--steps", type=int, default=5000)
+    parser.add_argument("--pages", type=int, default=2000, help="distinct pages links point to")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    directory = tempfile.mkdtemp(prefix="crawl_journal_")
+    backends = {"memory": MemoryJournal(), "file": FileJournal(directory)}
+    client = None
+    if os.environ.get("MONGODB_URI"):
+        from pymongo import MongoClient
+
+        client = MongoClient(os.environ["MONGODB_URI"])
+        client.drop_database("crawl_journal_check")
+        # Small parts, so snapshots are split over several documents
+        backends["mongo"] = MongoJournal(client["crawl_journal_check"], part_bytes=64, part_urls=5)
+    print(f"Checking {', '.join(backends)} backends over {args.steps} steps")
+
+    journal = CrawlJournal(Tee(backends), compact_every=rng.choice([20, 200]))
+    frontier = Frontier()
+    journal.pushed(frontier.extend([link(rng, args.pages)]))
+    in_flight = set()
+    pages_checked = 0
+    durable = None
+    crashes = 0
+
+    for step in range(args.steps):
+        action = rng.random()
+        if action < 0.4 and frontier:
+            in_flight.add(frontier.pop())
+        elif action < 0.8 and in_flight:
+            url = rng.choice(sorted(in_flight))
+            in_flight.discard(url)
+            if rng.random() < 0.9:
+                journal.pushed(frontier.extend(link(rng, args.pages) for _ in range(rng.randint(0, 6))))
+                frontier.done(url)
+                journal.visited(url)
+                pages_checked += 1
+            else:
+                # Queued again by the next link to it, up to max_attempts
+                frontier.fail(url)
+                journal.dropped(url)
+        elif action < 0.95:
+            snapshot = journal.snapshot(frontier, pages_checked, in_flight) if journal.due() else None
+            journal.write(journal.take(), snapshot)
+            durable = {
+                "queue": set(frontier.urls()) | in_flight,
+                "seen": seen_fingerprints(frontier),
+                "pages_checked": pages_checked,
+                "attempts": dict(frontier.attempts),
+                "failed": set(frontier.failed),
+            }
+        elif durable is not None:
+            # Crash: whatever was not written is lost, and the file may end in a torn line
+            crashes += 1
+            if rng.random() < 0.5:
+                with open(backends["file"].journal_path, "a", encoding="utf-8") as file:
+                    file.write(f"{journal.seq + 1}\tpu")
+            backends["file"] = FileJournal(directory)
+
+            expected_journal, expected, expected_pages = recover(backends["memory"])
+            assert set(expected.urls()) == durable["queue"], f"step {step}: memory queue"
+            assert seen_fingerprints(expected) == durable["seen"], f"step {step}: memory seen-set"
+            assert expected_pages == durable["pages_checked"], f"step {step}: memory pages_checked"
+            assert expected.attempts == durable["attempts"], f"step {step}: memory attempts"
+            assert expected.failed == durable["failed"], f"step {step}: memory failed"
+            for name, backend in backends.items():
+                recovered_journal, recovered, recovered_pages = recover(backend)
+                assert recovered.urls() == expected.urls(), f"step {step}: {name} queue"
+                assert seen_fingerprints(recovered) == durable["seen"], f"step {step}: {name} seen-set"
+                assert recovered_pages == expected_pages, f"step {step}: {name} pages_checked"
+                assert recovered.attempts == expected.attempts, f"step {step}: {name} attempts"
+                assert recovered.failed == expected.failed, f"step {step}: {name} failed"
+                assert recovered_journal.seq == expected_journal.seq, f"step {step}: {name} seq"
+
+            # Replayed from the stand-in, written to every backend
+            journal = CrawlJournal(backends["memory"], compact_every=rng.choice([20, 200]))
+            frontier = Frontier()
+            pages_checked = journal.recover(frontier)
+            journal.backend = Tee(backends)
+            in_flight = set()
+
+    assert all(canonicalize_url(url) == url for url in frontier.urls())
+    print(
+        f"OK: {crashes} crashes recovered, {pages_checked} pages checked, {len(frontier)} queued, "
+        f"{len(frontier.attempts)} pages failed"
+    )
+    shutil.rmtree(directory)
+    if client is not None:
+        client.drop_database("crawl_journal_check")
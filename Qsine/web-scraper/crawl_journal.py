@@ -0,0 +1,287 @@
+import glob
+import json
+import math
+import os
+from os.path import basename, exists, join
+
+from bson import Binary
+from pymongo.errors import BulkWriteError
+
+from frontier import new_seen_set, seen_from_bytes, url_fingerprint
+
+# Journal entries between two snapshots
+COMPACT_EVERY = int(os.environ.get("CRAWL_COMPACT_EVERY", "100000"))
+
+
+class CrawlJournal:
+    """Append-only log of frontier changes on top of periodic snapshots
+
+    Entries are "push" (a URL was queued), "visit" (a page was crawled) and
+    "drop" (a page failed, links may queue it again). Recovery loads the latest snapshot and replays
+    the entries written after it. The backend is one of MemoryJournal,
+    FileJournal or MongoJournal.
+    """
+
+    def __init__(self, backend, compact_every=COMPACT_EVERY):
+        self.backend = backend
+        self.compact_every = compact_every
+        self.seq = 0
+        self.pending = []
+        self.since_snapshot = 0
+
+    def record(self, kind, url):
+        self.seq += 1
+        self.pending.append((self.seq, kind, url))
+
+    def pushed(self, urls):
+        for url in urls:
+            self.record("push", url)
+
+    def visited(self, url):
+        self.record("visit", url)
+
+    def dropped(self, url):
+        self.record("drop", url)
+
+    def due(self):
+        """Whether enough entries piled up to compact them into a snapshot"""
+        return self.since_snapshot + len(self.pending) >= self.compact_every
+
+    def take(self):
+        """Entries recorded since the last take, to hand to write()"""
+        entries, self.pending = self.pending, []
+        return entries
+
+    def snapshot(self, frontier, pages_checked, in_flight=()):
+        """State as of the last recorded entry, pages in flight go back in the queue"""
+        return {
+            "seq": self.seq,
+            "pages_checked": pages_checked,
+            "seen": frontier.seen.to_bytes(),
+            "queue": frontier.urls() + sorted(in_flight),
+            "attempts": dict(frontier.attempts),
+        }
+
+    def write(self, entries, snapshot=None):
+        """Append entries, then replace the snapshot, off the crawl thread if need be"""
+        self.backend.append(entries)
+        self.since_snapshot += len(entries)
+        if snapshot is not None:
+            self.backend.save_snapshot(snapshot)
+            self.since_snapshot = 0
+
+    def recover(self, frontier):
+        """Rebuild frontier from the backend, returns pages_checked or None for an empty journal"""
+        snapshot = self.backend.load_snapshot()
+        if snapshot is not None:
+            seen = seen_from_bytes(snapshot["seen"])
+            queue = dict.fromkeys(snapshot["queue"])
+            pages_checked = snapshot["pages_checked"]
+            # Snapshots written before failed pages were retried have none
+            attempts = dict(snapshot.get("attempts", {}))
+            self.seq = snapshot["seq"]
+        else:
+            seen = new_seen_set()
+            queue = {}
+            pages_checked = 0
+            attempts = {}
+
+        replayed = 0
+        for seq, kind, url in self.backend.entries(self.seq):
+            if kind == "push":
+                # Also for URLs crawled since, they stay seen
+                seen.add(url_fingerprint(url))
+                queue[url] = None
+            elif kind == "visit":
+                queue.pop(url, None)
+                attempts.pop(url, None)
+                pages_checked += 1
+            else:
+                queue.pop(url, None)
+                attempts[url] = attempts.get(url, 0) + 1
+            self.seq = seq
+            replayed += 1
+        if snapshot is None and not replayed:
+            return None
+
+        frontier.seen = seen
+        frontier.requeue(queue)
+        frontier.restore_failed(attempts)
+        self.since_snapshot = replayed
+        return pages_checked
+
+
+class MemoryJournal:
+    """In-memory stand-in for the journal backends"""
+
+    def __init__(self):
+        self.log = []
+        self.stored_snapshot = None
+
+    def append(self, entries):
+        self.log.extend(entries)
+
+    def entries(self, after):
+        return [entry for entry in self.log if entry[0] > after]
+
+    def load_snapshot(self):
+        return self.stored_snapshot
+
+    def save_snapshot(self, snapshot):
+        self.stored_snapshot = dict(snapshot, queue=list(snapshot["queue"]), attempts=dict(snapshot["attempts"]))
+        self.log = [entry for entry in self.log if entry[0] > snapshot["seq"]]
+
+
+class FileJournal:
+    """Journal in a local directory: journal.log, snapshot.json and seen-<seq>.bin"""
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.journal_path = join(directory, "journal.log")
+        self.snapshot_path = join(directory, "snapshot.json")
+        self.repair()
+
+    def repair(self):
+        # Cut a line a crash left half written, appends would run on from it
+        if not exists(self.journal_path):
+            return
+        with open(self.journal_path, "rb+") as file:
+            data = file.read()
+            if data and not data.endswith(b"\n"):
+                file.truncate(data.rfind(b"\n") + 1)
+
+    def append(self, entries):
+        if not entries:
+            return
+        with open(self.journal_path, "a", encoding="utf-8") as file:
+            file.write("".join(f"{seq}\t{kind}\t{url}\n" for seq, kind, url in entries))
+            file.flush()
+            os.fsync(file.fileno())
+
+    def entries(self, after):
+        if not exists(self.journal_path):
+            return
+        with open(self.journal_path, "r", encoding="utf-8") as file:
+            for line in file:
+                fields = line.rstrip("\n").split("\t")
+                if not line.endswith("\n") or len(fields) != 3:
+                    break
+                if int(fields[0]) > after:
+                    yield int(fields[0]), fields[1], fields[2]
+
+    def load_snapshot(self):
+        if not exists(self.snapshot_path):
+            return None
+        with open(self.snapshot_path, "r", encoding="utf-8") as file:
+            snapshot = json.load(file)
+        with open(join(self.directory, snapshot.pop("seen_file")), "rb") as file:
+            snapshot["seen"] = file.read()
+        return snapshot
+
+    def write_file(self, path, data, mode="w"):
+        # Written aside and renamed, so a crash leaves the old file or the new one
+        with open(path + ".tmp", mode, **({} if "b" in mode else {"encoding": "utf-8"})) as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(path + ".tmp", path)
+
+    def save_snapshot(self, snapshot):
+        seen_file = f"seen-{snapshot['seq']}.bin"
+        self.write_file(join(self.directory, seen_file), snapshot["seen"], "wb")
+        meta = {
+            "seq": snapshot["seq"],
+            "pages_checked": snapshot["pages_checked"],
+            "seen_file": seen_file,
+            "queue": snapshot["queue"],
+            "attempts": snapshot["attempts"],
+        }
+        self.write_file(self.snapshot_path, json.dumps(meta))
+
+        for path in glob.glob(join(self.directory, "seen-*.bin")):
+            if basename(path) != seen_file:
+                os.remove(path)
+        kept = "".join(f"{seq}\t{kind}\t{url}\n" for seq, kind, url in self.entries(snapshot["seq"]))
+        self.write_file(self.journal_path, kept)
+
+
+class MongoJournal:
+    """Journal in Mongo: one crawl_journal document per entry, snapshots split into parts
+
+    A snapshot of a large crawl doesn't fit in one 16 MB document, so its
+    seen-set and queue are spread over crawl_snapshots documents and the
+    "head" document points at the complete one.
+    """
+
+    def __init__(self, db, part_bytes=4 * 2 ** 20, part_urls=20000):
+        self.journal = db.crawl_journal
+        self.snapshots = db.crawl_snapshots
+        self.snapshots.create_index("snapshot")
+        # A multiple of 8 keeps fingerprints whole
+        self.part_bytes = part_bytes - part_bytes % 8
+        self.part_urls = part_urls
+
+    def append(self, entries):
+        if not entries:
+            return
+        try:
+            self.journal.insert_many(
+                [{"_id": seq, "kind": kind, "url": url} for seq, kind, url in entries], ordered=False
+            )
+        except BulkWriteError as e:
+            # Entries an earlier, failed attempt already wrote are fine
+            if e.details.get("writeConcernErrors") or any(
+                error["code"] != 11000 for error in e.details["writeErrors"]
+            ):
+                raise
+
+    def entries(self, after):
+        for document in self.journal.find({"_id": {"$gt": after}}).sort("_id", 1):
+            yield document["_id"], document["kind"], document["url"]
+
+    def load_snapshot(self):
+        head = self.snapshots.find_one({"_id": "head"})
+        if head is None:
+            return None
+        parts = list(self.snapshots.find({"snapshot": head["seq"]}).sort("part", 1))
+        return {
+            "seq": head["seq"],
+            "pages_checked": head["pages_checked"],
+            "seen": b"".join(part["seen"] for part in parts),
+            "queue": [url for part in parts for url in part["queue"]],
+            "attempts": {url: count for part in parts for url, count in part.get("attempts", [])},
+        }
+
+    def save_snapshot(self, snapshot):
+        seq = snapshot["seq"]
+        seen = snapshot["seen"]
+        queue = snapshot["queue"]
+        attempts = [[url, count] for url, count in snapshot["attempts"].items()]
+        count = max(
+            math.ceil(len(seen) / self.part_bytes),
+            math.ceil(len(queue) / self.part_urls),
+            math.ceil(len(attempts) / self.part_urls),
+            1,
+        )
+        # Parts left by a crash while saving this same snapshot
+        self.snapshots.delete_many({"snapshot": seq})
+        self.snapshots.insert_many([
+            {
+                "_id": f"{seq}:{part}",
+                "snapshot": seq,
+                "part": part,
+                "seen": Binary(seen[part * self.part_bytes:(part + 1) * self.part_bytes]),
+                "queue": queue[part * self.part_urls:(part + 1) * self.part_urls],
+                "attempts": attempts[part * self.part_urls:(part + 1) * self.part_urls],
+            }
+            for part in range(count)
+        ])
+        # Switching the head is what makes the new snapshot current
+        self.snapshots.replace_one(
+            {"_id": "head"},
+            {"_id": "head", "seq": seq, "pages_checked": snapshot["pages_checked"]},
+            upsert=True,
+        )
+        self.snapshots.delete_many({"_id": {"$ne": "head"}, "snapshot": {"$ne": seq}})
+        self.journal.delete_many({"_id": {"$lte": seq}})
@@ -0,0 +1,107 @@
+import argparse
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Stand-in for allrecipes.com: generated recipe pages with the markup parse()
+# reads, so crawl modes can be benchmarked offline
+
+INGREDIENTS = ["flour", "sugar", "butter", "eggs", "milk", "salt", "garlic", "onion", "chicken", "rice", "basil", "lemon"]
+
+
+def recipe_links(base_url, page, pages, links):
+    rng = random.Random(page)
+    return [f"{base_url}recipe/{other}/dish-{other}/" for other in rng.sample(range(pages), min(links, pages))]
+
+
+def index_page(base_url, pages, links):
+    hrefs = "".join(f'<a href="{link}">recipe</a>' for link in recipe_links(base_url, -1, pages, links))
+    return f"<html><head><title>Recipes</title></head><body>{hrefs}</body></html>"
+
+
+def recipe_page(base_url, page, pages, links):
+    rng = random.Random(page)
+    ingredients = "".join(
+        f'<li><span data-ingredient-name="true">{ingredient}</span></li>'
+        for ingredient in rng.sample(INGREDIENTS, rng.randint(3, 8))
+    )
+    steps = "".join(
+        f'<li><p class="mntl-sc-block-html">Step {step} of dish {page}.</p></li>'
+        for step in range(rng.randint(2, 6))
+    )
+    hrefs = "".join(f'<a href="{link}">more</a>' for link in recipe_links(base_url, page, pages, links))
+    # Image links are never crawled
+    hrefs += f'<a href="{base_url}thmb/{page}.jpg">photo</a>'
+    return f"""<html><head><title>Dish {page}</title></head><body>
+<p class="article-subheading text-body-100">Fixture dish {page}</p>
+<div class="mm-recipes-details__label">Servings:</div><div class="mm-recipes-details__value">{rng.randint(1, 8)}</div>
+<ul>{ingredients}</ul>
+<div id="mm-recipes-steps__content_1-0"><ol>{steps}</ol></div>
+<ul><li class="mntl-breadcrumbs__item"><a class="link__wrapper">Fixtures</a></li></ul>
+{hrefs}
+</body></html>"""
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            delay = server.rng.expovariate(1 / server.latency) if server.latency else 0.0
+            if server.rng.random() < server.slow_share:
+                delay += server.slow_latency
+        time.sleep(delay)
+
+        parts = self.path.strip("/").split("/")
+        if self.path == "/":
+            body = index_page(server.base_url, server.pages, server.links)
+        elif len(parts) == 3 and parts[0] == "recipe" and parts[1].isdigit() and int(parts[1]) < server.pages:
+            body = recipe_page(server.base_url, int(parts[1]), server.pages, server.links)
+        else:
+            self.send_error(404)
+            return
+        data = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_fixture_server(pages=1000, links=8, latency=0.02, slow_share=0.0, slow_latency=0.5, port=0):
+    """Serve the fixture site from a background thread, returns the server and its base URL"""
+    server = ThreadingHTTPServer(("127.0.0.1", port), FixtureHandler)
+    server.daemon_threads = True
+    server.base_url = f"http://127.0.0.1:{server.server_address[1]}/"
+    server.pages = pages
+    server.links = links
+    server.latency = latency
+    server.slow_share = slow_share
+    server.slow_latency = slow_latency
+    server.rng = random.Random(0)
+    server.lock = threading.Lock()
+    server.requests = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, server.base_url
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve generated recipe pages in place of allrecipes.com")
+    parser.add_argument("--pages", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.02, help="mean seconds per response")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    server, base_url = start_fixture_server(args.pages, latency=args.latency, port=args.port)
+    print(f"Serving {args.pages} recipes at {base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,257 @@
+import bisect
+import hashlib
+import math
+import os
+import re
+import struct
+from collections import deque
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import numpy as np
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+TRACKING_PARAMS = {"fbclid", "gclid", "yclid", "igshid", "mc_cid", "mc_eid", "ref", "ref_src", "_ga"}
+RECIPE_PATH = "/recipe/"
+# Failed fetches of a page before links to it stop queueing it again
+MAX_ATTEMPTS = 3
+# "fingerprints" remembers every URL exactly in 8 bytes, "bloom" takes about
+# 1.8 bytes per URL of capacity but skips about error rate of unseen URLs
+SEEN_SET = os.environ.get("CRAWL_SEEN_SET", "fingerprints")
+BLOOM_CAPACITY = int(os.environ.get("CRAWL_BLOOM_CAPACITY", "20000000"))
+BLOOM_ERROR_RATE = float(os.environ.get("CRAWL_BLOOM_ERROR_RATE", "0.001"))
+# Saved Bloom filters start with this header, fingerprint sets have none
+BLOOM_HEADER = struct.Struct("<8sQdQ")
+BLOOM_MAGIC = b"QSBLOOM1"
+
+
+def canonicalize_url(url):
+    """One spelling per page: lowercase, no fragment or tracking params, trailing slash on pages"""
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    port = parts.port
+    netloc = host if port is None or DEFAULT_PORTS.get(scheme) == port else f"{host}:{port}"
+
+    path = re.sub(r"/{2,}", "/", parts.path.lower()) or "/"
+    # Pages end in a slash, files such as images don't
+    if not path.endswith("/") and "." not in path.rsplit("/", 1)[-1]:
+        path += "/"
+
+    query = urlencode(sorted(
+        (name, value)
+        for name, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not name.lower().startswith("utm_") and name.lower() not in TRACKING_PARAMS
+    ))
+    return urlunsplit((scheme, netloc, path, query, ""))
+
+
+def url_fingerprint(url):
+    """64-bit fingerprint of a canonical URL"""
+    return int.from_bytes(hashlib.blake2b(url.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class FingerprintSet:
+    """Seen-set of 64-bit fingerprints, 8 bytes per URL
+
+    Fingerprints sit in a sorted array. New ones go to a buffer that is
+    merged into the array once it holds buffer_size or a sixteenth of the
+    array, whichever is larger, so merging stays linear in the set size.
+    """
+
+    def __init__(self, fingerprints=None, buffer_size=16384):
+        self.set_sorted(np.unique(np.asarray(fingerprints if fingerprints is not None else [], dtype=np.uint64)))
+        self.buffer = set()
+        self.buffer_size = buffer_size
+
+    def set_sorted(self, fingerprints):
+        self.sorted = fingerprints
+        # bisect on a memoryview is several times faster than a numpy call per lookup
+        self.view = memoryview(fingerprints)
+
+    def __len__(self):
+        return len(self.sorted) + len(self.buffer)
+
+    def __contains__(self, fingerprint):
+        if fingerprint in self.buffer:
+            return True
+        position = bisect.bisect_left(self.view, fingerprint)
+        return position < len(self.view) and self.view[position] == fingerprint
+
+    def add(self, fingerprint):
+        """Add a fingerprint, False when it was already there"""
+        if fingerprint in self:
+            return False
+        self.buffer.add(fingerprint)
+        if len(self.buffer) >= max(self.buffer_size, len(self.sorted) // 16):
+            self.merge()
+        return True
+
+    def merge(self):
+        if self.buffer:
+            new = np.sort(np.fromiter(self.buffer, np.uint64, len(self.buffer)))
+            self.set_sorted(np.insert(self.sorted, np.searchsorted(self.sorted, new), new))
+            self.buffer = set()
+
+    def nbytes(self):
+        return self.sorted.nbytes + 8 * len(self.buffer)
+
+    def to_bytes(self):
+        self.merge()
+        return self.sorted.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data):
+        seen = cls()
+        seen.set_sorted(np.frombuffer(data, dtype=np.uint64).copy())
+        return seen
+
+
+class BloomFilter:
+    """Seen-set in a fixed bit array, wrong about unseen URLs at about error_rate
+
+    A false positive means a URL is never crawled, so size it for the crawl.
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.bits = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.bits / capacity * math.log(2)))
+        self.array = bytearray((self.bits + 7) // 8)
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def positions(self, fingerprint):
+        # Double hashing on the two halves of the fingerprint
+        first = fingerprint & 0xFFFFFFFF
+        second = (fingerprint >> 32) | 1
+        return [(first + i * second) % self.bits for i in range(self.hashes)]
+
+    def __contains__(self, fingerprint):
+        return all(self.array[position >> 3] & (1 << (position & 7)) for position in self.positions(fingerprint))
+
+    def add(self, fingerprint):
+        """Add a fingerprint, False when it was (probably) already there"""
+        new = False
+        for position in self.positions(fingerprint):
+            mask = 1 << (position & 7)
+            if not self.array[position >> 3] & mask:
+                self.array[position >> 3] |= mask
+                new = True
+        self.count += new
+        return new
+
+    def nbytes(self):
+        return len(self.array)
+
+    def to_bytes(self):
+        return BLOOM_HEADER.pack(BLOOM_MAGIC, self.capacity, self.error_rate, self.count) + bytes(self.array)
+
+    @classmethod
+    def from_bytes(cls, data):
+        magic, capacity, error_rate, count = BLOOM_HEADER.unpack_from(data)
+        if magic != BLOOM_MAGIC:
+            raise ValueError("Not a saved Bloom filter")
+        seen = cls(capacity, error_rate)
+        seen.array = bytearray(data[BLOOM_HEADER.size:])
+        seen.count = count
+        return seen
+
+
+def new_seen_set(kind=None):
+    """Empty seen-set of the configured kind"""
+    kind = kind or SEEN_SET
+    if kind == "bloom":
+        return BloomFilter(BLOOM_CAPACITY, BLOOM_ERROR_RATE)
+    if kind == "fingerprints":
+        return FingerprintSet()
+    raise ValueError(f"Unknown seen-set {kind!r}")
+
+
+def seen_from_bytes(data):
+    """Seen-set saved by to_bytes, of whichever kind it was saved as"""
+    # A fingerprint set starting with the magic is a 1 in 2**64 chance per URL
+    if bytes(data[: len(BLOOM_MAGIC)]) == BLOOM_MAGIC:
+        return BloomFilter.from_bytes(data)
+    return FingerprintSet.from_bytes(data)
+
+
+class Frontier:
+    """URLs waiting to be crawled, /recipe/ pages ahead of hub pages
+
+    Every canonical URL is queued at most once, the seen-set remembers it
+    after it has been popped. A page whose fetch failed is the exception:
+    the seen-set can't forget it, so it is kept in failed and the next link
+    to it queues it again, up to max_attempts fetches.
+    """
+
+    def __init__(self, seen=None, max_attempts=MAX_ATTEMPTS):
+        self.seen = seen if seen is not None else new_seen_set()
+        self.recipes = deque()
+        self.hubs = deque()
+        self.max_attempts = max_attempts
+        # Failed fetches per URL until it is crawled, and the failed URLs
+        # that aren't queued
+        self.attempts = {}
+        self.failed = set()
+
+    def __len__(self):
+        return len(self.recipes) + len(self.hubs)
+
+    def enqueue(self, url):
+        (self.recipes if RECIPE_PATH in url else self.hubs).append(url)
+
+    def push(self, url):
+        """Queue a URL unless it was seen before, returns the queued canonical URL or None"""
+        try:
+            url = canonicalize_url(url)
+        except ValueError:
+            return None
+        if not self.seen.add(url_fingerprint(url)):
+            if url not in self.failed:
+                return None
+            self.failed.discard(url)
+        self.enqueue(url)
+        return url
+
+    def extend(self, urls):
+        """Canonical URLs of the ones that were queued"""
+        return [url for url in map(self.push, urls) if url is not None]
+
+    def requeue(self, urls):
+        """Queue saved URLs again, seen or not"""
+        for url in urls:
+            url = canonicalize_url(url)
+            self.seen.add(url_fingerprint(url))
+            self.failed.discard(url)
+            self.enqueue(url)
+
+    def mark_seen(self, urls):
+        for url in urls:
+            self.seen.add(url_fingerprint(canonicalize_url(url)))
+
+    def fail(self, url):
+        """A popped URL couldn't be fetched, links may queue it again"""
+        self.attempts[url] = self.attempts.get(url, 0) + 1
+        if self.attempts[url] < self.max_attempts:
+            self.failed.add(url)
+
+    def done(self, url):
+        """A popped URL was crawled"""
+        self.attempts.pop(url, None)
+
+    def restore_failed(self, attempts):
+        """Failure counts from a snapshot, for URLs requeue already queued or not"""
+        self.attempts = dict(attempts)
+        queued = set(self.urls())
+        self.failed = {
+            url for url, count in self.attempts.items() if count < self.max_attempts and url not in queued
+        }
+
+    def pop(self):
+        return self.recipes.popleft() if self.recipes else self.hubs.popleft()
+
+    def urls(self):
+        return list(self.recipes) + list(self.hubs)
@@ -1,36 +1,66 @@
 import requests
 import re
-import json
 import os
 from pymongo import MongoClient, UpdateOne
-from bs4 import BeautifulSoup
 from dotenv import load_dotenv
 import time
-import hashlib
-import zlib
-import json
-import base64
+import argparse
+import sys
+import asyncio
 import concurrent.futures
+import multiprocessing
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
+from os.path import abspath, dirname, join
 
-from selenium_helper import find_image_urls
+project_root = dirname(dirname(abspath(__file__)))
+sys.path.append(join(project_root, "data"))
+
+from recipe_codec import load_codec
+from async_fetcher import AsyncFetcher
+from crawl_journal import CrawlJournal, FileJournal, MongoJournal
+from frontier import Frontier, seen_from_bytes
+from recipe_parser import parse_page, parse_recipe
+from stage_counter import StageCounter
 
 load_dotenv()
 
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+}
+# "threads" fetches batches on a thread pool, "async" runs a fetch -> parse ->
+# write pipeline with a fixed number of requests in flight
+CRAWL_MODE = os.environ.get("CRAWL_MODE", "threads")
+MAX_IN_FLIGHT = int(os.environ.get("CRAWL_MAX_IN_FLIGHT", "20"))
+PARSE_WORKERS = int(os.environ.get("CRAWL_PARSE_WORKERS", os.cpu_count() or 1))
+# The crawl journal goes to this directory when set, to Mongo otherwise
+CRAWL_JOURNAL_DIR = os.environ.get("CRAWL_JOURNAL_DIR")
+
 
 class AllrecipesSearch:
-    def __init__(self):
-        self.start_url = "https://www.allrecipes.com/"
+    def __init__(self, start_url="https://www.allrecipes.com/", crawl_mode=CRAWL_MODE):
+        self.start_url = start_url
+        self.link_pattern = re.compile(r'href="(' + re.escape(start_url) + r'(?!thmb)[^"?]+)')
         self.temp_recipes = []
         self.db = self.connect_to_mongodb()
+        self.retry_strategy = Retry(
+            total=3,
+            backoff_factor=0.5,
+            status_forcelist=[429, 500, 502, 503, 504],
+        )
         self.session = self._create_session()
         self.batch_size = 20  # Increased from 5 to 20 for better performance
         self.max_workers = 10  # Number of parallel workers
+        self.crawl_mode = crawl_mode
+        self.max_in_flight = MAX_IN_FLIGHT  # Concurrent requests in async mode
+        self.parse_workers = PARSE_WORKERS  # Parser processes in async mode
+        self.in_flight = set()  # Pages popped from the frontier but not finished
         
         # Initialize MongoDB collections
         self.recipes_collection = self.db.recipes
         self.failures_collection = self.db.failures
+        self.codec = load_codec(self.db)
+        self.journal = CrawlJournal(self.journal_backend())
         
         # Load state from MongoDB
         self.load_state()
@@ -38,12 +68,7 @@ class AllrecipesSearch:
     def _create_session(self):
         """Create a session with retry strategy for better performance"""
         session = requests.Session()
-        retry_strategy = Retry(
-            total=3,
-            backoff_factor=0.5,
-            status_forcelist=[429, 500, 502, 503, 504],
-        )
-        adapter = HTTPAdapter(max_retries=retry_strategy, pool_connections=20, pool_maxsize=20)
+        adapter = HTTPAdapter(max_retries=self.retry_strategy, pool_connections=20, pool_maxsize=20)
         session.mount("https://", adapter)
         session.mount("http://", adapter)
         return session
@@ -59,49 +84,50 @@ class AllrecipesSearch:
         return db
 
     def compress_data(self, data):
-        json_str = json.dumps(data)
-        compressed = zlib.compress(json_str.encode("utf-8"))
-        return base64.b64encode(compressed).decode("utf-8")  # Encode for storage
-
-    def save(self):
-        # Save state to MongoDB using the recipes collection
-        self.recipes_collection.update_one(
-            {"_id": "scraper_state"},
-            {
-                "$set": {
-                    "checked_urls": list(self.checked_urls),
-                    "to_check_urls": self.to_check_urls,
-                    "last_updated": time.time()
-                }
-            },
-            upsert=True,
-        )
+        return self.codec.encode(data)
+
+    def journal_backend(self):
+        if CRAWL_JOURNAL_DIR:
+            return FileJournal(CRAWL_JOURNAL_DIR)
+        return MongoJournal(self.db)
 
+    def save(self, compact=False):
+        snapshot = None
+        if compact or self.journal.due():
+            snapshot = self.journal.snapshot(self.frontier, self.pages_checked, self.in_flight)
+        self.write(self.temp_recipes, self.journal.take(), snapshot)
+
+        # Clear temp recipes after saving
+        self.temp_recipes = []
+
+    def write(self, recipes, entries, snapshot=None):
         # Batch database operations
-        if self.temp_recipes:
+        if recipes:
             # Prepare bulk operations
             bulk_operations = []
-            for recipe in self.temp_recipes:
+
+            # Recipes already stored, fetched and decoded in one go
+            existing = list(self.recipes_collection.find(
+                {"key": {"$in": [recipe["key"] for recipe in recipes]}}, {"key": 1, "data": 1}
+            ))
+            existing_data = dict(zip(
+                [document["key"] for document in existing],
+                self.codec.decode_many([document["data"] for document in existing]),
+            ))
+            for recipe in recipes:
                 key = recipe["key"]
                 
-                # Retrieve the recipe from the database using the key
-                existing_recipe = self.recipes_collection.find_one({"key": key})
-                
                 # If the recipe exists, update its image_urls
-                if existing_recipe:
-                    existing_data = json.loads(
-                        zlib.decompress(base64.b64decode(existing_recipe["data"])).decode(
-                            "utf-8"
-                        )
-                    )
-                    recipe["image_urls"] = existing_data.get("image_urls", [])
+                if key in existing_data:
+                    recipe["image_urls"] = existing_data[key].get("image_urls", [])
                 
                 compressed_recipe = self.compress_data(recipe)
                 
                 # Create UpdateOne operation
                 update_operation = UpdateOne(
                     {"key": key},
-                    {"$set": {"data": compressed_recipe}},
+                    # updated_at lets text-processor/update_index.py pick up new recipes
+                    {"$set": {"data": compressed_recipe, "updated_at": time.time()}},
                     upsert=True
                 )
                 
@@ -111,23 +137,40 @@ class AllrecipesSearch:
             # Execute bulk operations
             if bulk_operations:
                 self.recipes_collection.bulk_write(bulk_operations)
-            
-            # Clear temp recipes after saving
-            self.temp_recipes = []
+
+        # Journal entries follow the recipes, so a page is never marked
+        # visited before its recipe is stored
+        self.journal.write(entries, snapshot)
 
         print("Saved progress")
 
     def load_state(self):
-        """Load state from MongoDB using the recipes collection"""
+        """Replay the crawl journal, or start it from the old scraper_state document"""
+        self.frontier = Frontier()
+        self.pages_checked = self.journal.recover(self.frontier)
+        if self.pages_checked is None:
+            self.pages_checked = self.load_legacy_state()
+            self.journal.write([], self.journal.snapshot(self.frontier, self.pages_checked))
+        self.load_failures()
+
+    def load_legacy_state(self):
+        """Frontier from the scraper_state document written before the journal"""
         state_doc = self.recipes_collection.find_one({"_id": "scraper_state"})
-        
-        if state_doc:
-            self.checked_urls = set(state_doc.get("checked_urls", []))
-            self.to_check_urls = state_doc.get("to_check_urls", [])
+        if not state_doc:
+            self.frontier.push(self.start_url)
+            return 0
+        if "seen" in state_doc:
+            # Saved from a Frontier, its queue holds unvisited URLs only
+            self.frontier.seen = seen_from_bytes(state_doc["seen"])
+            self.frontier.requeue(state_doc.get("to_check_urls", []))
         else:
-            self.checked_urls = set()
-            self.to_check_urls = [self.start_url]
-            
+            # to_check_urls was never filtered against checked_urls, so
+            # pushing skips the pages already crawled
+            self.frontier.mark_seen(state_doc.get("checked_urls", []))
+            self.frontier.extend(state_doc.get("to_check_urls", []))
+        return state_doc.get("pages_checked", len(state_doc.get("checked_urls", [])))
+
+    def load_failures(self):
         # Load failures from MongoDB
         failures_docs = self.failures_collection.find({}, {"url": 1})
         self.failures = set(doc["url"] for doc in failures_docs)
@@ -144,23 +187,17 @@ class AllrecipesSearch:
 
     def process_url(self, url):
         """Process a single URL - extracted from search method for parallel processing"""
-        if url in self.checked_urls:
-            return None
-        
         try:
-            response = self.session.get(url)
+            response = self.session.get(url, headers=HEADERS)
             if response.status_code != 200:
                 print(f"Bad response for {url}: {response.status_code}")
                 return None
                 
             # Extract new links
-            new_links = re.findall(
-                r'href="(https://www.allrecipes.com/(?!thmb)[^"?]+)',
-                response.text,
-            )
+            new_links = self.link_pattern.findall(response.text)
             
-            # Parse the recipe
-            recipe = self.parse(url)
+            # Parse the recipe from the same response
+            recipe = self.parse(url, html=response.text)
             
             return {
                 "recipe": recipe,
@@ -174,14 +211,185 @@ class AllrecipesSearch:
                 self.add_failure(url)
             return None
 
+    def add_result(self, result):
+        """Queue the links of a processed page and keep its recipe"""
+        self.journal.pushed(self.frontier.extend(result["new_links"]))
+        self.frontier.done(result["url"])
+        self.journal.visited(result["url"])
+        self.pages_checked += 1
+        if result["recipe"]:
+            self.temp_recipes.append(result["recipe"])
+            # Save progress periodically
+            if len(self.temp_recipes) >= self.batch_size:
+                self.save()
+
     def search(self):
-        count = 0
-        
+        if self.crawl_mode == "async":
+            try:
+                asyncio.run(self.search_async())
+            except KeyboardInterrupt:
+                print("Interrupted by user. Saving progress...")
+            self.save(compact=True)
+        else:
+            self.search_threads()
+
+    async def next_url(self, ready):
+        """URL for the fetch stage, None once the frontier is empty and nothing is in flight"""
+        async with ready:
+            await ready.wait_for(lambda: self.frontier or not self.in_flight)
+            if not self.frontier:
+                return None
+            url = self.frontier.pop()
+            self.in_flight.add(url)
+            return url
+
+    async def add_links(self, ready, links):
+        async with ready:
+            self.journal.pushed(self.frontier.extend(links))
+            ready.notify_all()
+
+    async def finish_url(self, ready, url, visited):
+        async with ready:
+            self.in_flight.discard(url)
+            if visited:
+                self.pages_checked += 1
+                self.frontier.done(url)
+                self.journal.visited(url)
+            else:
+                self.frontier.fail(url)
+                self.journal.dropped(url)
+            ready.notify_all()
+
+    async def fetch_worker(self, fetcher, ready, parse_queue):
+        """Fetch stage: every page is downloaded once and handed to the parsers"""
+        stage = self.stages["fetch"]
+        while True:
+            url = await self.next_url(ready)
+            if url is None:
+                return
+            # A block page pauses every fetcher, not only the one that saw it
+            await asyncio.sleep(max(self.rest_until - time.monotonic(), 0.0))
+
+            start_time = time.perf_counter()
+            try:
+                status, text = await fetcher.get(url)
+            except Exception as e:
+                print(f"Error processing {url}: {e}")
+                self.add_failure(url)
+                status = None
+            stage.record(time.perf_counter() - start_time)
+
+            if status != 200:
+                if status is not None:
+                    print(f"Bad response for {url}: {status}")
+                await self.finish_url(ready, url, visited=False)
+                continue
+            blocked = "Signal - Not Acceptable" in text
+            if blocked:
+                print("Resting for 5 minutes")
+                self.rest_until = time.monotonic() + 300
+            # Known failures still give their links, as with parse(check_failures=True)
+            await parse_queue.put((url, text, not blocked and url not in self.failures))
+
+    async def parse_worker(self, parsers, ready, parse_queue, write_queue):
+        """Parse stage: links and recipe fields come out of one pass in a parser process"""
+        loop = asyncio.get_running_loop()
+        stage = self.stages["parse"]
+        while True:
+            url, html, with_recipe = await parse_queue.get()
+            start_time = time.perf_counter()
+            try:
+                page = await loop.run_in_executor(
+                    parsers, parse_page, url, html, self.link_pattern.pattern, with_recipe
+                )
+            except Exception as e:
+                page = {"url": url, "new_links": [], "recipe": None, "error": str(e)}
+            stage.record(time.perf_counter() - start_time)
+
+            if page["error"]:
+                print(f"Error parsing {url}: {page['error']}")
+                self.add_failure(url)
+            await self.add_links(ready, page["new_links"])
+            # The page stays in flight until the writer has its recipe
+            await write_queue.put((url, page["recipe"]))
+
+    async def write_worker(self, ready, write_queue):
+        """Write stage: recipes go to Mongo batch_size at a time, then the journal entries"""
+        loop = asyncio.get_running_loop()
+        stage = self.stages["write"]
+        while True:
+            page = await write_queue.get()
+            if page is None:
+                return
+            url, recipe = page
+            if recipe:
+                self.temp_recipes.append(recipe)
+            await self.finish_url(ready, url, visited=True)
+            if len(self.temp_recipes) < self.batch_size:
+                continue
+
+            recipes, self.temp_recipes = self.temp_recipes, []
+            snapshot = None
+            if self.journal.due():
+                snapshot = self.journal.snapshot(self.frontier, self.pages_checked, self.in_flight)
+            entries = self.journal.take()
+            start_time = time.perf_counter()
+            try:
+                # The snapshot is taken on the event loop, the writes run on a thread
+                await loop.run_in_executor(None, self.write, recipes, entries, snapshot)
+            except Exception as e:
+                print(f"Error saving progress: {e}")
+                self.temp_recipes = recipes + self.temp_recipes
+                self.journal.pending = entries + self.journal.pending
+                continue
+            stage.record(time.perf_counter() - start_time, len(recipes))
+
+    async def search_async(self):
+        """Crawl as a fetch -> parse -> write pipeline with no batch barriers"""
+        self.rest_until = 0.0
+        # Wakes fetchers waiting on an empty frontier
+        ready = asyncio.Condition()
+        # Bounded, so fetchers wait for the parsers instead of piling up pages
+        parse_queue = asyncio.Queue(maxsize=2 * self.parse_workers)
+        write_queue = asyncio.Queue()
+        self.stages = {
+            "fetch": StageCounter("fetch", lambda: len(self.frontier)),
+            "parse": StageCounter("parse", parse_queue.qsize),
+            "write": StageCounter("write", write_queue.qsize),
+        }
+
+        # Spawned parsers don't inherit the event loop's threads and sockets
+        with concurrent.futures.ProcessPoolExecutor(
+            self.parse_workers, mp_context=multiprocessing.get_context("spawn")
+        ) as parsers:
+            async with AsyncFetcher(self.retry_strategy, self.max_in_flight, headers=HEADERS) as fetcher:
+                fetchers = [
+                    asyncio.create_task(self.fetch_worker(fetcher, ready, parse_queue))
+                    for _ in range(self.max_in_flight)
+                ]
+                parse_tasks = [
+                    asyncio.create_task(self.parse_worker(parsers, ready, parse_queue, write_queue))
+                    for _ in range(self.parse_workers)
+                ]
+                writer = asyncio.create_task(self.write_worker(ready, write_queue))
+                try:
+                    while not all(task.done() for task in fetchers):
+                        await asyncio.wait(fetchers, timeout=10)
+                        print(" | ".join(stage.report() for stage in self.stages.values()))
+                    # Fetchers stop once nothing is in flight, so only the writer has work left
+                    await write_queue.put(None)
+                    await writer
+                finally:
+                    for task in fetchers + parse_tasks + [writer]:
+                        task.cancel()
+
+    def search_threads(self):
         try:
-            while len(self.to_check_urls) > 0:
+            while len(self.frontier) > 0:
                 # Get a batch of URLs to process
-                batch_size = min(self.max_workers, len(self.to_check_urls))
-                batch_urls = [self.to_check_urls.pop() for _ in range(batch_size)]
+                batch_size = min(self.max_workers, len(self.frontier))
+                batch_urls = [self.frontier.pop() for _ in range(batch_size)]
+                self.in_flight.update(batch_urls)
                 
                 # Process URLs in parallel
                 with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
@@ -191,112 +399,43 @@ class AllrecipesSearch:
                         url = future_to_url[future]
                         try:
                             result = future.result()
-                            if result:
-                                # Add new links to the queue
-                                self.to_check_urls = list(set(self.to_check_urls + result["new_links"]))
-                                
-                                # Add to checked URLs
-                                self.checked_urls.add(url)
-                                
-                                # Add recipe to temp recipes if it exists
-                                if result["recipe"]:
-                                    self.temp_recipes.append(result["recipe"])
-                                    count += 1
-                                    
-                                    # Save progress periodically
-                                    if count >= self.batch_size:
-                                        self.save()
-                                        count = 0
-                                        
                         except Exception as e:
                             print(f"Error processing {url}: {e}")
+                            result = None
+
+                        self.in_flight.discard(url)
+                        if result:
+                            self.add_result(result)
+                        else:
+                            self.frontier.fail(url)
+                            self.journal.dropped(url)
                 
-                print(f"Processed batch. Checked: {len(self.checked_urls)}, To check: {len(self.to_check_urls)}")
+                print(f"Processed batch. Checked: {self.pages_checked}, To check: {len(self.frontier)}")
 
         except KeyboardInterrupt:
             print("Interrupted by user. Saving progress...")
             self.save()
 
         # Final save
-        self.save()
+        self.save(compact=True)
 
-    def parse(self, url, check_failures=True):
+    def parse(self, url, check_failures=True, html=None):
         try:
             if check_failures and url in self.failures:
                 print(f"{url}: URL already in failures")
                 return None
 
-            temp_recipe = {}
-            key = hashlib.md5(url.encode("utf-8")).hexdigest()
-
             print(f"Parsing {url}")
-            temp_recipe["url"] = url
-            temp_recipe["key"] = key
 
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-            }
-
-            response = self.session.get(url, headers=headers)
-            if "Signal - Not Acceptable" in response.text:
+            # html is the page when the caller already fetched it
+            if html is None:
+                html = self.session.get(url, headers=HEADERS).text
+            if "Signal - Not Acceptable" in html:
                 print("Resting for 5 minutes")
                 time.sleep(300)
                 return None
 
-            soup = BeautifulSoup(response.text, "html.parser")
-
-            # Extract recipe name
-            title_tag = soup.find("title")
-            temp_recipe["recipe_name"] = (
-                title_tag.text.strip() if title_tag else "Unknown"
-            )
-
-            # Extract ingredients
-            ingredients = [
-                tag.text.strip() for tag in soup.select('[data-ingredient-name="true"]')
-            ]
-            if not ingredients:
-                raise ValueError("Ingredients not found")
-            temp_recipe["ingredients"] = ingredients
-
-            # Extract recipe description
-            description_tag = soup.select_one(".article-subheading.text-body-100")
-            temp_recipe["recipe_description"] = (
-                description_tag.text.strip() if description_tag else "No description"
-            )
-
-            # Extract details (label-value pairs)
-            details = {}
-            for detail in soup.select(".mm-recipes-details__label"):
-                label = detail.text.strip()
-                value_tag = detail.find_next_sibling(class_="mm-recipes-details__value")
-                if value_tag:
-                    details[label] = value_tag.text.strip()
-            temp_recipe["details"] = details
-
-            # Extract steps
-            steps = [
-                step.text.strip()
-                for step in soup.select(
-                    "#mm-recipes-steps__content_1-0 ol li p.mntl-sc-block-html"
-                )
-            ]
-            temp_recipe["steps"] = steps
-
-            # Extract breadcrumbs
-            breadcrumbs = [
-                breadcrumb.text.strip()
-                for breadcrumb in soup.select(".mntl-breadcrumbs__item .link__wrapper")
-            ]
-            temp_recipe["breadcrumbs"] = breadcrumbs
-
-            # Extract the image URLs - commented out for now as it's slow
-            # image_urls = find_image_urls(url)
-            # if len(image_urls) == 0:
-            #     raise ValueError("No images found")
-            # temp_recipe["image_urls"] = image_urls
-
-            return temp_recipe
+            return parse_recipe(url, html)
 
         except Exception as e:
             print(f"Error parsing {url}: {e}")
@@ -308,7 +447,11 @@ class AllrecipesSearch:
 
 
 if __name__ == "__main__":
-    allrecipes_search = AllrecipesSearch()
+    parser = argparse.ArgumentParser(description="Crawl allrecipes.com into Mongo")
+    parser.add_argument("--mode", choices=["threads", "async"], default=CRAWL_MODE)
+    args = parser.parse_args()
+
+    allrecipes_search = AllrecipesSearch(crawl_mode=args.mode)
     allrecipes_search.search()
 
     # For testing purposes, you can uncomment the following lines to test the parse method directly
@@ -0,0 +1,90 @@
+import hashlib
+import re
+
+from bs4 import BeautifulSoup
+
+
+def parse_recipe(url, html):
+    """Recipe fields of an allrecipes page, raises ValueError when it has no ingredients"""
+    temp_recipe = {}
+    key = hashlib.md5(url.encode("utf-8")).hexdigest()
+
+    temp_recipe["url"] = url
+    temp_recipe["key"] = key
+
+    soup = BeautifulSoup(html, "html.parser")
+
+    # Extract recipe name
+    title_tag = soup.find("title")
+    temp_recipe["recipe_name"] = (
+        title_tag.text.strip() if title_tag else "Unknown"
+    )
+
+    # Extract ingredients
+    ingredients = [
+        tag.text.strip() for tag in soup.select('[data-ingredient-name="true"]')
+    ]
+    if not ingredients:
+        raise ValueError("Ingredients not found")
+    temp_recipe["ingredients"] = ingredients
+
+    # Extract recipe description
+    description_tag = soup.select_one(".article-subheading.text-body-100")
+    temp_recipe["recipe_description"] = (
+        description_tag.text.strip() if description_tag else "No description"
+    )
+
+    # Extract details (label-value pairs)
+    details = {}
+    for detail in soup.select(".mm-recipes-details__label"):
+        label = detail.text.strip()
+        value_tag = detail.find_next_sibling(class_="mm-recipes-details__value")
+        if value_tag:
+            details[label] = value_tag.text.strip()
+    temp_recipe["details"] = details
+
+    # Extract steps
+    steps = [
+        step.text.strip()
+        for step in soup.select(
+            "#mm-recipes-steps__content_1-0 ol li p.mntl-sc-block-html"
+        )
+    ]
+    temp_recipe["steps"] = steps
+
+    # Extract breadcrumbs
+    breadcrumbs = [
+        breadcrumb.text.strip()
+        for breadcrumb in soup.select(".mntl-breadcrumbs__item .link__wrapper")
+    ]
+    temp_recipe["breadcrumbs"] = breadcrumbs
+
+    # Extract the image URLs - commented out for now as it's slow. The
+    # import installs a Firefox driver, so it stays out of the crawl too
+    # from selenium_helper import find_image_urls
+    # image_urls = find_image_urls(url)
+    # if len(image_urls) == 0:
+    #     raise ValueError("No images found")
+    # temp_recipe["image_urls"] = image_urls
+
+    return temp_recipe
+
+
+def parse_page(url, html, link_pattern, with_recipe=True):
+    """Links and recipe of a fetched page, runs in the crawl's parser processes
+
+    Errors come back in "error" since the failures collection lives in the
+    crawling process.
+    """
+    page = {
+        "url": url,
+        "new_links": re.findall(link_pattern, html),
+        "recipe": None,
+        "error": None,
+    }
+    if with_recipe:
+        try:
+            page["recipe"] = parse_recipe(url, html)
+        except Exception as e:
+            page["error"] = str(e)
+    return page
@@ -0,0 +1,35 @@
+import time
+
+
+class StageCounter:
+    """Throughput and queue depth of one crawl pipeline stage"""
+
+    def __init__(self, name, depth):
+        self.name = name
+        # Callable giving the number of items waiting for the stage
+        self.depth = depth
+        self.processed = 0
+        self.busy = 0.0
+        self.max_depth = 0
+        self.started = time.monotonic()
+
+    def record(self, seconds, count=1):
+        self.processed += count
+        self.busy += seconds
+        self.max_depth = max(self.max_depth, self.depth())
+
+    def stats(self):
+        elapsed = time.monotonic() - self.started
+        return {
+            "processed": self.processed,
+            "per_second": self.processed / elapsed if elapsed else 0.0,
+            "busy_seconds": round(self.busy, 3),
+            "queue": self.depth(),
+            "max_queue": self.max_depth,
+        }
+
+    def report(self):
+        stats = self.stats()
+        return "{}: {} done, {:.1f}/s, queue {} (max {})".format(
+            self.name, stats["processed"], stats["per_second"], stats["queue"], stats["max_queue"]
+        )